@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import logging
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+# Write a loaded value back only if the key was not invalidated since the load started
+_SET_IF_CURRENT = """
+if (redis.call("get", KEYS[2]) or "") == ARGV[1] then
+    redis.call("set", KEYS[1], ARGV[2], "EX", ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class TwoTierCache:
+    """In-process TTL LRU (L1) in front of Redis (L2).
+
+    Entries are grouped by namespace (one per lookup type) so hit ratios can be
+    reported separately. invalidate() drops the L2 key and publishes the key on
+    a pub/sub channel; every replica listening on it drops its L1 copy.
+    None results are never cached.
+
+    invalidate() also bumps a per-key generation. A miss reads the generation
+    together with the L2 key and stores the loaded value only if it has not
+    changed, so a load that raced an invalidation is returned but not cached.
+    """
+
+    def __init__(self, l1_ttl: float = 30, l2_ttl: int = 300, l1_maxsize: int = 5000,
+                 prefix: str = "cache:", channel: str = "cache_invalidate"):
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        self.l1_maxsize = l1_maxsize
+        self.prefix = prefix
+        self.channel = channel
+        self.redis: Optional[redis.Redis] = None
+        self._l1: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._set_if_current = None
+
+    def attach(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self._set_if_current = redis_client.register_script(_SET_IF_CURRENT)
+
+    def _key(self, namespace: str, parts: Tuple[str, ...]) -> str:
+        return f"{self.prefix}{namespace}:" + ":".join(str(part) for part in parts)
+
+    def _gen_key(self, key: str) -> str:
+        return f"{self.prefix}gen:{key[len(self.prefix):]}"
+
+    def _count(self, namespace: str, field: str):
+        counters = self._stats.setdefault(namespace, {"l1_hits": 0, "l2_hits": 0, "misses": 0})
+        counters[field] += 1
+
+    def _l1_get(self, key: str) -> Optional[Any]:
+        entry = self._l1.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._l1[key]
+            return None
+        self._l1.move_to_end(key)
+        return value
+
+    def _l1_set(self, key: str, value: Any):
+        self._l1[key] = (time.monotonic() + self.l1_ttl, value)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_maxsize:
+            self._l1.popitem(last=False)
+
+    def peek(self, namespace: str, *parts: str) -> Optional[Any]:
+        """L1 only lookup, never touches Redis and is not counted in the stats"""
+        return self._l1_get(self._key(namespace, parts))
+
+    async def get_or_load(self, namespace: str, parts: Tuple[str, ...], loader: Callable[[], Awaitable[Any]]) -> Any:
+        key = self._key(namespace, parts)
+
+        value = self._l1_get(key)
+        if value is not None:
+            self._count(namespace, "l1_hits")
+            return value
+
+        gen_key = self._gen_key(key)
+        generation = None
+        if self.redis is not None:
+            try:
+                raw, generation = await self.redis.mget(key, gen_key)
+            except redis.RedisError as e:
+                logger.warning(f"L2 cache read failed for {key}: {e}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._l1_set(key, value)
+                self._count(namespace, "l2_hits")
+                return value
+
+        self._count(namespace, "misses")
+        value = await loader()
+        if value is None:
+            return value
+        if self.redis is None:
+            self._l1_set(key, value)
+            return value
+        try:
+            stored = await self._set_if_current(keys=[key, gen_key], args=[generation or "", json.dumps(value), self.l2_ttl])
+        except redis.RedisError as e:
+            logger.warning(f"L2 cache write failed for {key}: {e}")
+            stored = True
+        if stored:
+            self._l1_set(key, value)
+        else:
+            logger.debug(f"{key} was invalidated while loading, not caching it")
+        return value
+
+    async def invalidate(self, namespace: str, *parts: str):
+        key = self._key(namespace, parts)
+        self._l1.pop(key, None)
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                gen_key = self._gen_key(key)
+                pipe.incr(gen_key)
+                # only has to outlive a load in flight
+                pipe.expire(gen_key, self.l2_ttl)
+                pipe.delete(key)
+                pipe.publish(self.channel, key)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.error(f"Cache invalidation failed for {key}: {e}")
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                # Invalidations may have been missed while we were not subscribed
+                self._l1.clear()
+                async for message in pubsub.listen():
+                    self._l1.pop(message["data"], None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener failed, resubscribing: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def start(self, redis_client: redis.Redis):
+        self.attach(redis_client)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self.redis = None
+        self._set_if_current = None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for namespace, counters in self._stats.items():
+            total = counters["l1_hits"] + counters["l2_hits"] + counters["misses"]
+            hits = counters["l1_hits"] + counters["l2_hits"]
+            result[namespace] = {**counters, "hit_ratio": round(hits / total, 4) if total else 0.0}
+        return result
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+import logging
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+
+class DispatchQueue:
+    """Alarm delivery jobs on a Redis Stream, consumed by every API replica.
+
+    Each replica joins the same consumer group, so a job is handed to exactly
+    one of them and throughput grows with the replica count. A job is only
+    acknowledged after its handler returned. If the handler raises, this
+    consumer claims the job back (XCLAIM) after retry_backoff, doubling per
+    delivery up to retry_backoff_max. If the replica dies, the job stays
+    pending and another one claims it (XAUTOCLAIM) once it has been idle for
+    claim_idle_ms. After max_deliveries attempts it is moved to the dead letter
+    stream.
+    """
+
+    def __init__(self, stream: str = "alarm_jobs", group: str = "alarm_dispatchers", consumer: Optional[str] = None,
+                 concurrency: int = 16, block_ms: int = 5000, claim_idle_ms: int = 60000, claim_interval: float = 15,
+                 max_deliveries: int = 5, maxlen: int = 100000, latency_window: int = 1000,
+                 retry_backoff: float = 1, retry_backoff_max: float = 15):
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.dead_stream = f"{stream}:dead"
+        self.concurrency = concurrency
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_interval = claim_interval
+        self.max_deliveries = max_deliveries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.maxlen = maxlen
+        self.redis: Optional[redis.Redis] = None
+        self.handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self._running: Set[asyncio.Task] = set()
+        self._retrying: Set[asyncio.Task] = set()
+        self._loops: List[asyncio.Task] = []
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._latency_window = latency_window
+        self._counters = {"enqueued": 0, "processed": 0, "failed": 0, "retried": 0, "reclaimed": 0, "dead": 0}
+
+    def register(self, kind: str, handler: Callable[..., Awaitable[Any]]):
+        """handler is awaited with the job payload as keyword arguments"""
+        self.handlers[kind] = handler
+
+    def _fields(self, kind: str, payload: Dict[str, Any]) -> Dict[str, str]:
+        return {"kind": kind, "payload": json.dumps(payload), "enqueued_at": str(time.time())}
+
+    async def enqueue(self, kind: str, **payload: Any) -> str:
+        job_id = await self.redis.xadd(self.stream, self._fields(kind, payload), maxlen=self.maxlen, approximate=True)
+        self._counters["enqueued"] += 1
+        return job_id
+
+    async def enqueue_many(self, jobs: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        if not jobs:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for kind, payload in jobs:
+                pipe.xadd(self.stream, self._fields(kind, payload), maxlen=self.maxlen, approximate=True)
+            job_ids = await pipe.execute()
+        self._counters["enqueued"] += len(job_ids)
+        return job_ids
+
+    async def _ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _record(self, kind: str, seconds: float):
+        window = self._latencies.setdefault(kind, deque(maxlen=self._latency_window))
+        window.append(seconds)
+
+    async def _run(self, job_id: str, fields: Dict[str, str]):
+        kind = fields.get("kind")
+        handler = self.handlers.get(kind)
+        if handler is None:
+            logger.error(f"No handler for dispatch job {job_id} of kind {kind}, dropping it")
+            await self._dead(job_id, fields)
+            return
+        try:
+            await handler(**json.loads(fields["payload"]))
+        except Exception as e:
+            # left pending, _retry_later delivers it again
+            self._counters["failed"] += 1
+            logger.error(f"Dispatch job {job_id} ({kind}) failed: {e}")
+            task = asyncio.create_task(self._retry_later(job_id, fields))
+            self._retrying.add(task)
+            task.add_done_callback(self._retrying.discard)
+            return
+        await self.redis.xack(self.stream, self.group, job_id)
+        self._counters["processed"] += 1
+        self._record(kind, time.time() - float(fields.get("enqueued_at", time.time())))
+
+    async def _retry_later(self, job_id: str, fields: Dict[str, str]):
+        try:
+            pending = await self.redis.xpending_range(self.stream, self.group, min=job_id, max=job_id, count=1)
+            deliveries = next((entry["times_delivered"] for entry in pending if entry["message_id"] == job_id), 0)
+            if deliveries >= self.max_deliveries:
+                logger.error(f"Dispatch job {job_id} failed {deliveries} times, moving it to {self.dead_stream}")
+                await self._dead(job_id, fields)
+                return
+            delay = min(self.retry_backoff * 2 ** max(deliveries - 1, 0), self.retry_backoff_max)
+            await asyncio.sleep(delay)
+            # a delivery restarts the idle time, so this claims nothing if another consumer took the job meanwhile
+            claimed = await self.redis.xclaim(self.stream, self.group, self.consumer,
+                                              min_idle_time=int(delay * 1000), message_ids=[job_id])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Could not retry dispatch job {job_id}, it is reclaimed after {self.claim_idle_ms}ms: {e}")
+            return
+        if claimed:
+            self._counters["retried"] += 1
+            self._spawn(job_id, fields)
+
+    def _spawn(self, job_id: str, fields: Dict[str, str]):
+        task = asyncio.create_task(self._run(job_id, fields))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _dead(self, job_id: str, fields: Dict[str, str]):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(self.dead_stream, {**fields, "job_id": job_id}, maxlen=self.maxlen, approximate=True)
+            pipe.xack(self.stream, self.group, job_id)
+            await pipe.execute()
+        self._counters["dead"] += 1
+
+    async def _read_once(self) -> int:
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            await asyncio.wait(set(self._running), return_when=asyncio.FIRST_COMPLETED)
+            return 0
+        response = await self.redis.xreadgroup(self.group, self.consumer, {self.stream: ">"},
+                                               count=free, block=self.block_ms)
+        started = 0
+        for _, messages in response or []:
+            for job_id, fields in messages:
+                self._spawn(job_id, fields)
+                started += 1
+        return started
+
+    async def _reclaim_once(self) -> int:
+        """Take over jobs another consumer (or this one) left unacknowledged for too long"""
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            return 0
+        response = await self.redis.xautoclaim(self.stream, self.group, self.consumer,
+                                               min_idle_time=self.claim_idle_ms, start_id="0-0", count=free)
+        messages = [(job_id, fields) for job_id, fields in response[1] if job_id is not None]
+        if not messages:
+            return 0
+
+        pending = await self.redis.xpending_range(self.stream, self.group, min=messages[0][0],
+                                                  max=messages[-1][0], count=len(messages), consumername=self.consumer)
+        deliveries = {entry["message_id"]: entry["times_delivered"] for entry in pending}
+        for job_id, fields in messages:
+            if deliveries.get(job_id, 0) > self.max_deliveries:
+                logger.error(f"Dispatch job {job_id} failed {self.max_deliveries} times, moving it to {self.dead_stream}")
+                await self._dead(job_id, fields)
+                continue
+            self._counters["reclaimed"] += 1
+            self._spawn(job_id, fields)
+        return len(messages)
+
+    async def _consume_loop(self):
+        while True:
+            try:
+                await self._read_once()
+            except asyncio.CancelledError:
+                raise
+            except redis.ResponseError as e:
+                if "NOGROUP" in str(e):
+                    # Redis lost the stream (restart without persistence)
+                    await self._ensure_group()
+                    continue
+                logger.error(f"Dispatch consumer failed: {e}")
+                await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"Dispatch consumer failed: {e}")
+                await asyncio.sleep(1)
+
+    async def _reclaim_loop(self):
+        while True:
+            await asyncio.sleep(self.claim_interval)
+            try:
+                await self._reclaim_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Dispatch reclaim failed: {e}")
+
+    async def start(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        await self._ensure_group()
+        self._loops = [asyncio.create_task(self._consume_loop()), asyncio.create_task(self._reclaim_loop())]
+
+    async def stop(self, grace: float = 5):
+        for loop in self._loops + list(self._retrying):
+            loop.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        self._loops = []
+        # Unfinished jobs stay pending and are reclaimed by another replica
+        if self._running:
+            await asyncio.wait(set(self._running), timeout=grace)
+        for task in list(self._running):
+            task.cancel()
+
+    async def backlog(self) -> Dict[str, Any]:
+        """Jobs not handed out yet (lag) and handed out but not acknowledged (pending)"""
+        for group in await self.redis.xinfo_groups(self.stream):
+            if group["name"] == self.group:
+                return {"pending": group["pending"], "lag": group.get("lag")}
+        return {"pending": 0, "lag": 0}
+
+    def stats(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {**self._counters, "in_flight": len(self._running), "retrying": len(self._retrying),
+                                  "consumer": self.consumer}
+        for kind, window in self._latencies.items():
+            latencies = sorted(window)
+            result[f"{kind}_latency_p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 1)
+            result[f"{kind}_latency_p95_ms"] = round(latencies[int(len(latencies) * 0.95)] * 1000, 1)
+            result[f"{kind}_latency_max_ms"] = round(latencies[-1] * 1000, 1)
+        return result
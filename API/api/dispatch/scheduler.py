@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+import redis.asyncio as redis
+
+from .dispatchqueue import DispatchQueue
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] schedule zset (job id -> due time), KEYS[2] job hash (job id -> kind/payload), KEYS[3] dispatch stream
+# ARGV[1] now, ARGV[2] max jobs to move, ARGV[3] stream maxlen
+# Moves due jobs to the dispatch stream; enqueued_at is the due time so the queue latency includes our poll lag.
+_MOVE_DUE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2])
+for i = 1, #due, 2 do
+    local job = redis.call('HGET', KEYS[2], due[i])
+    if job then
+        local decoded = cjson.decode(job)
+        redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[3], '*',
+            'kind', decoded.kind, 'payload', decoded.payload, 'enqueued_at', due[i + 1])
+    end
+    redis.call('ZREM', KEYS[1], due[i])
+    redis.call('HDEL', KEYS[2], due[i])
+end
+return #due / 2
+"""
+
+
+class DelayedScheduler:
+    """Run at T jobs for the dispatch queue.
+
+    A pending job is one sorted set member plus one hash field in Redis, nothing
+    is held in the process. Every replica polls; the move script is atomic, so a
+    due job reaches the dispatch stream exactly once and runs with the queue's
+    concurrency limit. Jobs scheduled again under the same id replace the
+    previous one, and can be cancelled until they are due.
+    """
+
+    def __init__(self, queue: DispatchQueue, key: str = "alarm_delayed", poll_interval: float = 0.5, batch: int = 100):
+        self.queue = queue
+        self.key = key
+        self.jobs_key = f"{key}:jobs"
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.redis: Optional[redis.Redis] = None
+        self._move_due = None
+        self._poller: Optional[asyncio.Task] = None
+        self.scheduled = 0
+        self.cancelled = 0
+        self.fired = 0
+
+    def attach(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self._move_due = redis_client.register_script(_MOVE_DUE)
+
+    async def schedule_many(self, jobs: List[Tuple[str, str, Dict[str, Any], float]]):
+        """jobs are (job id, kind, payload, delay in seconds)"""
+        if not jobs:
+            return
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for job_id, kind, payload, delay in jobs:
+                pipe.hset(self.jobs_key, job_id, json.dumps({"kind": kind, "payload": json.dumps(payload)}))
+                pipe.zadd(self.key, {job_id: now + delay})
+            await pipe.execute()
+        self.scheduled += len(jobs)
+
+    async def schedule(self, job_id: str, kind: str, delay: float, **payload: Any):
+        await self.schedule_many([(job_id, kind, payload, delay)])
+
+    async def cancel(self, *job_ids: str) -> int:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.key, *job_ids)
+            pipe.hdel(self.jobs_key, *job_ids)
+            removed, _ = await pipe.execute()
+        self.cancelled += removed
+        return removed
+
+    async def fire_due(self) -> int:
+        moved = await self._move_due(keys=[self.key, self.jobs_key, self.queue.stream],
+                                     args=[time.time(), self.batch, self.queue.maxlen])
+        self.fired += moved
+        return moved
+
+    async def _poll(self):
+        while True:
+            try:
+                # a full batch means more are due, go again without waiting
+                if await self.fire_due() >= self.batch:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Delayed job poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def start(self, redis_client: redis.Redis):
+        self.attach(redis_client)
+        self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    async def backlog(self) -> Dict[str, Any]:
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zcard(self.key)
+            pipe.zcount(self.key, "-inf", now)
+            pipe.zrange(self.key, 0, 0, withscores=True)
+            total, overdue, oldest = await pipe.execute()
+        result = {"scheduled": total, "overdue": overdue}
+        if oldest:
+            result["next_due_in_s"] = round(oldest[0][1] - now, 3)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {"scheduled": self.scheduled, "cancelled": self.cancelled, "fired": self.fired}
@@ -0,0 +1,41 @@
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional
+
+import orjson
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+
+class ORJSONResponse(Response):
+    """JSON rendered by orjson for content that is already plain dicts/lists.
+
+    Datetimes come out the way pydantic writes them (UTC as Z, microseconds
+    only when set), so the payload is the same as the response_model path.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+@lru_cache(maxsize=None)
+def adapter(tp: Any) -> TypeAdapter:
+    return TypeAdapter(tp)
+
+
+def validated_response(tp: Any, content: Any, status_code: int = 200) -> Response:
+    """Validate untrusted content once against tp and serialize it in the same pass.
+
+    Returning a Response skips FastAPI's own response_model validation, which
+    would otherwise run a second time over models the handler just built.
+    """
+    typeAdapter = adapter(tp)
+    return Response(typeAdapter.dump_json(typeAdapter.validate_python(content)), status_code=status_code,
+                    media_type="application/json")
+
+
+def parse_timestamps(values: Iterable[Optional[str]]) -> List[Optional[datetime]]:
+    """ISO timestamps as PostgREST returns them, Z suffix included, in one pass"""
+    fromisoformat = datetime.fromisoformat
+    return [fromisoformat(value) if value else None for value in values]
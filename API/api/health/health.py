@@ -0,0 +1,77 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+import logging
+
+from ..metrics.metrics import DEPENDENCY_UP, DEPENDENCY_CHECK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessChecker:
+    """Runs the dependency checks concurrently, each bounded by timeout.
+
+    The result is cached for cache_ttl seconds and probes arriving while a check
+    is running wait for that one, so however often the pod is probed it makes
+    at most one round of upstream calls per cache_ttl. Dependencies not in
+    required are reported but do not make the pod unready; when they fail the
+    pod stays ready and they are listed under degraded.
+    """
+
+    def __init__(self, checks: Dict[str, Callable[[], Awaitable[Any]]], timeout: float = 1.0,
+                 cache_ttl: float = 3.0, required: Optional[Iterable[str]] = None):
+        self.checks = checks
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.required = set(checks if required is None else required)
+        self._result: Optional[Dict[str, Any]] = None
+        self._checked_at: Optional[float] = None
+        self._inflight: Optional[asyncio.Task] = None
+
+    async def _probe(self, name: str, check: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(check(), self.timeout)
+            outcome = {"ok": True}
+        except asyncio.TimeoutError:
+            outcome = {"ok": False, "error": f"timed out after {self.timeout}s"}
+        except Exception as e:
+            outcome = {"ok": False, "error": str(e) or type(e).__name__}
+        elapsed = time.perf_counter() - started
+        outcome["latency_ms"] = round(elapsed * 1000, 2)
+        outcome["required"] = name in self.required
+        DEPENDENCY_UP.set(1 if outcome["ok"] else 0, name)
+        DEPENDENCY_CHECK_SECONDS.set(elapsed, name)
+        return outcome
+
+    async def _run(self) -> Dict[str, Any]:
+        names = list(self.checks)
+        outcomes = await asyncio.gather(*(self._probe(name, self.checks[name]) for name in names))
+        dependencies = dict(zip(names, outcomes))
+        ready = all(outcome["ok"] for name, outcome in dependencies.items() if name in self.required)
+        degraded = [name for name, outcome in dependencies.items() if not outcome["ok"] and name not in self.required]
+        if not ready:
+            failing = [name for name, outcome in dependencies.items() if not outcome["ok"]]
+            logger.warning(f"Not ready, failing dependencies: {failing}", extra={"dependencies": dependencies})
+        elif degraded:
+            logger.warning(f"Ready but degraded, failing optional dependencies: {degraded}", extra={"dependencies": dependencies})
+        self._result = {
+            "status": "ready" if ready else "unready",
+            "degraded": degraded,
+            "dependencies": dependencies,
+            "checked_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self._checked_at = time.monotonic()
+        return self._result
+
+    async def check(self) -> Dict[str, Any]:
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.cache_ttl:
+            return self._result
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._run())
+        return await asyncio.shield(self._inflight)
+
+    @property
+    def ready(self) -> bool:
+        return self._result is not None and self._result["status"] == "ready"
@@ -1,13 +1,25 @@
 
-import aiohttp
+from typing import Optional
+import logging
 
+from ..httppool.httppool import HttpPool
+from ..metrics.metrics import instrumented, UPSTREAM_RESPONSES
+from ..resilience.resilience import Upstream
+from .tokenmanager import HeimanTokenManager
 
+logger = logging.getLogger(__name__)
 
+
+@instrumented("heiman")
 class HeimanConnector:
-    def __init__(self, spapiurl: str, clientId: str, clientSecret: str):
+    def __init__(self, spapiurl: str, clientId: str, clientSecret: str, pool: HttpPool,
+                 tokens: Optional[HeimanTokenManager] = None, upstream: Optional[Upstream] = None):
         self.spapiurl = spapiurl
         self.clientId = clientId
         self.clientSecret = clientSecret
+        self.pool = pool
+        self.tokens = tokens
+        self.upstream = upstream or Upstream("heiman")
         self.defaultHeaders = {
             "user-agent": "SH-API/1.0.0",
         }
@@ -15,129 +27,153 @@ class HeimanConnector:
     def user_id_to_tenant_id(self, user_id: str) -> str:
         return "SH_" + user_id
 
+    async def _request(self, method: str, path: str, headers: dict, **kwargs):
+        url = f"{self.spapiurl}{path}"
+        if self.tokens is None:
+            return await self._send(method, url, headers, **kwargs)
+
+        try:
+            token = await self.tokens.token()
+        except Exception as e:
+            # the Tenant-Id header alone is what these calls have always used
+            logger.warning(f"No Heiman access token, sending {path} without it: {e}")
+            return await self._send(method, url, headers, **kwargs)
+
+        header = self.tokens.header
+        status, loaded = await self._send(method, url, {**headers, header: token}, with_status=True, **kwargs)
+        if status == 401:
+            # expired or revoked early, one retry with whatever token the manager settles on
+            try:
+                token = await self.tokens.rejected(token)
+            except Exception as e:
+                logger.warning(f"Heiman token rejected and no new one available, sending {path} without it: {e}")
+                return await self._send(method, url, headers, **kwargs)
+            status, loaded = await self._send(method, url, {**headers, header: token}, with_status=True, **kwargs)
+        return loaded
+
+    async def _send(self, method: str, url: str, headers: dict, with_status: bool = False, **kwargs):
+        async def attempt():
+            async with self.pool.session(url).request(method, url, headers=headers, **kwargs) as response:
+                UPSTREAM_RESPONSES.inc("heiman", str(response.status))
+                return response.status, await response.json()
+
+        # the GETs (detail, nameByDevice) are idempotent reads and may be hedged
+        status, loaded = await self.upstream.call(attempt, failed=lambda result: result[0] >= 500, hedge=method == "GET")
+        return (status, loaded) if with_status else loaded
+
+    async def ping(self) -> int:
+        """Any answer below 500 means the API is reachable; there is no dedicated health endpoint"""
+        async with self.pool.session(self.spapiurl).head(self.spapiurl, headers=self.defaultHeaders) as response:
+            if response.status >= 500:
+                raise Exception(f"Heiman API error: {response.status}")
+            return response.status
+
     async def nameByDevice(self, userID: str, productID: str, macadress: str):
         consolidatedHeaders = self.defaultHeaders.copy()
         consolidatedHeaders["Tenant-Id"] = self.user_id_to_tenant_id(userID)
-        async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.spapiurl}/api-saas/device-instance/{productID}/{macadress}/nameByDevice", headers=consolidatedHeaders) as device_response:
-                    device_loaded = await device_response.json()
-                    return device_loaded
+        return await self._request("GET", f"/api-saas/device-instance/{productID}/{macadress}/nameByDevice", consolidatedHeaders)
 
     async def getDeviceIDDetail(self, userID: str, deviceID: str):
         consolidatedHeaders = self.defaultHeaders.copy()
         consolidatedHeaders["Tenant-Id"] = self.user_id_to_tenant_id(userID)
+        return await self._request("GET", f"/api-saas/device-instance/{deviceID}/detail", consolidatedHeaders)
+
+    def _logsQuery(self, termType: str, value: str, pageSize: int, pageIndex: int,
+                   startTime: Optional[int] = None, endTime: Optional[int] = None) -> dict:
+        terms = [
+            {
+                "type": termType,
+                "value": value,
+                "termType": "eq",
+                "column": "type"
+            }
+        ]
+        if startTime is not None:
+            terms.append({"type": "and", "value": startTime, "termType": "gte", "column": "timestamp"})
+        if endTime is not None:
+            terms.append({"type": "and", "value": endTime, "termType": "lte", "column": "timestamp"})
+        return {
+            "pageIndex": pageIndex,
+            "pageSize": pageSize,
+            "sorts": [
+                {
+                    "name": "timestamp",
+                    "order": "desc"
+                }
+            ],
+            "terms": terms
+        }
 
-        async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.spapiurl}/api-saas/device-instance/{deviceID}/detail", headers=consolidatedHeaders) as device_response:
-                    device_loaded = await device_response.json()
-                    return device_loaded
-
-    async def getDeviceEvents(self, userID: str, deviceID: str, pageSize: int = 5):
+    async def getDeviceEvents(self, userID: str, deviceID: str, pageSize: int = 5, pageIndex: int = 0,
+                              startTime: Optional[int] = None, endTime: Optional[int] = None):
         consolidatedHeaders = self.defaultHeaders.copy()
         consolidatedHeaders["Tenant-Id"] = self.user_id_to_tenant_id(userID)
-        async with aiohttp.ClientSession() as session:
-                async with session.post(f"{self.spapiurl}/api-saas/device-instance/{deviceID}/logs", headers=consolidatedHeaders, json= {
-                    "pageIndex": 0,
-                    "pageSize": 5,
-                    "terms": [
-                        {
-                            "type": "or",
-                            "value": "event",
-                            "termType": "eq",
-                            "column": "type"
-                        }
-                    ]
-                }) as device_response:
-                    device_loaded = await device_response.json()
-                    return device_loaded
-
-    async def getDeviceProperties(self, userID: str, deviceID: str, pageSize: int = 5):
+        return await self._request("POST", f"/api-saas/device-instance/{deviceID}/logs", consolidatedHeaders,
+                                   json=self._logsQuery("or", "event", pageSize, pageIndex, startTime, endTime))
+
+    async def getDeviceProperties(self, userID: str, deviceID: str, pageSize: int = 5, pageIndex: int = 0,
+                                  startTime: Optional[int] = None, endTime: Optional[int] = None):
         consolidatedHeaders = self.defaultHeaders.copy()
         consolidatedHeaders["Tenant-Id"] = self.user_id_to_tenant_id(userID)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{self.spapiurl}/api-saas/device-instance/{deviceID}/logs",
-                                    headers=consolidatedHeaders, json={
-                        "pageIndex": 0,
-                        "pageSize": 5,
-                        "terms": [
-                            {
-                                "type": "and",
-                                "value": "reportProperty",
-                                "termType": "eq",
-                                "column": "type"
-                            }
-                        ]
-                    }) as device_response:
-                device_loaded = await device_response.json()
-                return device_loaded
+        return await self._request("POST", f"/api-saas/device-instance/{deviceID}/logs", consolidatedHeaders,
+                                   json=self._logsQuery("and", "reportProperty", pageSize, pageIndex, startTime, endTime))
 
 
 
     async def unbind(self, userID: str, deviceID: str):
         consolidatedHeaders = self.defaultHeaders.copy()
         consolidatedHeaders["Tenant-Id"] = self.user_id_to_tenant_id(userID)
-        async with aiohttp.ClientSession() as session:
-                async with session.post(f"{self.spapiurl}/api-saas/sys/user/device/unbind", headers=consolidatedHeaders, json = {
-                    "deviceId": deviceID,
-                    "userId": consolidatedHeaders["Tenant-Id"],
-                    "tenantId": consolidatedHeaders["Tenant-Id"],
-                }) as response:
-                    returnLoaded = await response.json()
-                    return returnLoaded
+        return await self._request("POST", "/api-saas/sys/user/device/unbind", consolidatedHeaders, json = {
+            "deviceId": deviceID,
+            "userId": consolidatedHeaders["Tenant-Id"],
+            "tenantId": consolidatedHeaders["Tenant-Id"],
+        })
 
     async def bind(self, userID: str, deviceID: str):
         consolidatedHeaders = self.defaultHeaders.copy()
         consolidatedHeaders["Tenant-Id"] = self.user_id_to_tenant_id(userID)
-        async with aiohttp.ClientSession() as session:
-                async with session.post(f"{self.spapiurl}/api-saas/sys/user/device/bind", headers=consolidatedHeaders, json = {
-                    "deviceId": deviceID,
-                    "userId": consolidatedHeaders["Tenant-Id"],
-                    "tenantId": consolidatedHeaders["Tenant-Id"],
-                }) as response:
-                    returnLoaded = await response.json()
-                    return returnLoaded
+        return await self._request("POST", "/api-saas/sys/user/device/bind", consolidatedHeaders, json = {
+            "deviceId": deviceID,
+            "userId": consolidatedHeaders["Tenant-Id"],
+            "tenantId": consolidatedHeaders["Tenant-Id"],
+        })
 
 
-    async def deviceList(self, userID: str):
+    async def deviceList(self, userID: str, pageIndex: int = 0, pageSize: int = 50):
 
         consolidatedHeaders = self.defaultHeaders.copy()
         consolidatedHeaders["Tenant-Id"] = self.user_id_to_tenant_id(userID)
-        async with aiohttp.ClientSession() as session:
-                async with session.post(f"{self.spapiurl}/api-saas/sys/user/device/list/_query", headers=consolidatedHeaders, json = {
-                    "help": {
-                        "pageIndex": 0,
-                        "pageSize": 50
-                    },
-                    "custom": {
-                        "userId": consolidatedHeaders["Tenant-Id"],
-                        "tenantId": consolidatedHeaders["Tenant-Id"],
+        return await self._request("POST", "/api-saas/sys/user/device/list/_query", consolidatedHeaders, json = {
+            "help": {
+                "pageIndex": pageIndex,
+                "pageSize": pageSize
+            },
+            "custom": {
+                "userId": consolidatedHeaders["Tenant-Id"],
+                "tenantId": consolidatedHeaders["Tenant-Id"],
 
-                    }
-                }) as device_response:
-                    device_loaded = await device_response.json()
-                    return device_loaded
+            }
+        })
 
 
 
     async def queryDevice(self, userID: str, productID: str, name: str):
         consolidatedHeaders = self.defaultHeaders.copy()
         consolidatedHeaders["Tenant-Id"] = self.user_id_to_tenant_id(userID)
-        async with aiohttp.ClientSession() as session:
-                async with session.post(f"{self.spapiurl}/api-saas/device/instance/_query", json={
-                    "pageIndex": 0,
-                    "pageSize": 50,
-                    "terms": [
-                        {
-                            "column": "productId",
-                            "value": productID,
-                            "termType": "eq"
-                        },
-                        {
-                            "column": "name",
-                            "value": name,
-                            "termType": "eq"
-                        }
-                    ]
-                }, headers=consolidatedHeaders) as device_response:
-                    device_loaded = await device_response.json()
-                    return device_loaded["result"]["data"]
\ No newline at end of file
+        device_loaded = await self._request("POST", "/api-saas/device/instance/_query", consolidatedHeaders, json={
+            "pageIndex": 0,
+            "pageSize": 50,
+            "terms": [
+                {
+                    "column": "productId",
+                    "value": productID,
+                    "termType": "eq"
+                },
+                {
+                    "column": "name",
+                    "value": name,
+                    "termType": "eq"
+                }
+            ]
+        })
+        return device_loaded["result"]["data"]
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional
+import logging
+
+import aiohttp
+import redis.asyncio as redis
+
+from ..httppool.httppool import HttpPool
+from ..metrics.metrics import timed, UPSTREAM_SECONDS, UPSTREAM_RESPONSES
+
+logger = logging.getLogger(__name__)
+
+# Token endpoint contract (POST /api-auth/system/auth/oauth2/token with clientId, clientSecret,
+# grantTypes=client_credentials and a millisecond oauthTimestamp; the token comes back as
+# result.access_token) is what the exploratory API/main.py script does against spapi.heiman.cn.
+# That script never sends the token back, so the header is not confirmed by anything in this
+# repo: X-Access-Token is the JetLinks convention, the platform the /api-saas/device-instance
+# endpoints come from. HEIMAN_TOKEN_HEADER overrides it.
+TOKEN_HEADER = "X-Access-Token"
+
+_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class HeimanAuthError(Exception):
+    pass
+
+
+class HeimanTokenManager:
+    """Heiman OAuth2 client_credentials token shared by every replica through Redis.
+
+    Requests read the local copy and never wait on Redis while it is fresh. A
+    background task renews it refresh_ahead seconds before expiry (with jitter
+    so replicas don't all wake together). Renewal first looks in Redis, and
+    only the replica holding the lock key fetches from Heiman; the others poll
+    Redis until the new token appears. Within a replica concurrent renewals
+    share one in-flight task. Without Redis it falls back to fetching on its own.
+    After a failed fetch token() fails fast for failure_backoff seconds, so
+    callers can go on without a token instead of waiting on Heiman each time.
+    """
+
+    def __init__(self, spapiurl: str, clientId: str, clientSecret: str, pool: HttpPool,
+                 key: str = "heiman:access_token", refresh_ahead: float = 300, default_ttl: float = 3600,
+                 lock_ttl: float = 10, fetch_timeout: float = 5, failure_backoff: float = 30,
+                 header: str = TOKEN_HEADER):
+        self.spapiurl = spapiurl
+        self.clientId = clientId
+        self.clientSecret = clientSecret
+        self.pool = pool
+        self.key = key
+        self.lock_key = f"{key}:lock"
+        self.refresh_ahead = refresh_ahead
+        self.default_ttl = default_ttl
+        self.lock_ttl = lock_ttl
+        self.fetch_timeout = aiohttp.ClientTimeout(total=fetch_timeout)
+        self.failure_backoff = failure_backoff
+        self.header = header
+        self._failed_until = 0.0
+        self.redis: Optional[redis.Redis] = None
+        self._release_lock = None
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self._background: Optional[asyncio.Task] = None
+        self.fetched = 0
+        self.adopted = 0
+        self.failures = 0
+
+    def attach(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self._release_lock = redis_client.register_script(_RELEASE_LOCK)
+
+    async def start(self, redis_client: redis.Redis):
+        self.attach(redis_client)
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"Heiman token not available at startup, will retry in background: {e}")
+        self._background = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._background, self._inflight):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._background = None
+        self._inflight = None
+
+    def _fresh(self, expires_at: float) -> bool:
+        return time.time() < expires_at - self.refresh_ahead
+
+    async def token(self) -> str:
+        """The current access token; only waits when there is no unexpired local copy"""
+        if self._token is not None and time.time() < self._expires_at:
+            return self._token
+        if time.time() < self._failed_until:
+            raise HeimanAuthError("Heiman token unavailable, not retrying yet")
+        try:
+            return await self.refresh()
+        except Exception:
+            self._failed_until = time.time() + self.failure_backoff
+            raise
+
+    async def rejected(self, token: str) -> str:
+        """Heiman answered 401 to token; get a different one without every replica refetching"""
+        if token == self._token:
+            self._expires_at = 0.0
+        return await self.token()
+
+    async def refresh(self) -> str:
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._do_refresh())
+        return await asyncio.shield(self._inflight)
+
+    def _adopt(self, stored: Dict[str, Any]):
+        self._token = stored["token"]
+        self._expires_at = float(stored["expires_at"])
+
+    async def _stored(self) -> Optional[Dict[str, Any]]:
+        raw = await self.redis.get(self.key)
+        if raw is None:
+            return None
+        stored = json.loads(raw)
+        # a token another replica saw rejected is not worth adopting
+        if stored["token"] == self._token and self._expires_at == 0.0:
+            return None
+        return stored
+
+    async def _do_refresh(self) -> str:
+        if self.redis is None:
+            return await self._fetch_and_keep()
+        try:
+            stored = await self._stored()
+            if stored is not None and self._fresh(float(stored["expires_at"])):
+                self._adopt(stored)
+                self.adopted += 1
+                return self._token
+
+            owner = uuid.uuid4().hex
+            if await self.redis.set(self.lock_key, owner, px=int(self.lock_ttl * 1000), nx=True):
+                try:
+                    return await self._fetch_and_keep(publish=True)
+                finally:
+                    await self._release_lock(keys=[self.lock_key], args=[owner])
+            return await self._wait_for_holder(stored)
+        except redis.RedisError as e:
+            logger.warning(f"Redis unavailable for Heiman token, fetching directly: {e}")
+            return await self._fetch_and_keep()
+
+    async def _wait_for_holder(self, previous: Optional[Dict[str, Any]]) -> str:
+        deadline = time.monotonic() + self.lock_ttl
+        delay = 0.05
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            stored = await self._stored()
+            if stored is not None and stored != previous and time.time() < float(stored["expires_at"]):
+                self._adopt(stored)
+                self.adopted += 1
+                return self._token
+        # the holder died or is stuck; keep what we have if it still works, else fetch ourselves
+        if self._token is not None and time.time() < self._expires_at:
+            return self._token
+        return await self._fetch_and_keep(publish=True)
+
+    async def _fetch_and_keep(self, publish: bool = False) -> str:
+        token, expires_at = await self._fetch()
+        self._token, self._expires_at = token, expires_at
+        if publish:
+            ttl = max(int(expires_at - time.time()), 1)
+            await self.redis.set(self.key, json.dumps({"token": token, "expires_at": expires_at}), ex=ttl)
+        return token
+
+    async def _fetch(self):
+        url = f"{self.spapiurl}/api-auth/system/auth/oauth2/token"
+        body = {
+            "clientId": self.clientId,
+            "clientSecret": self.clientSecret,
+            "grantTypes": "client_credentials",
+            "oauthTimestamp": str(int(time.time() * 1000)),
+        }
+        try:
+            with timed(UPSTREAM_SECONDS, "heiman", "oauth_token"):
+                async with self.pool.session(url).post(url, json=body, timeout=self.fetch_timeout) as response:
+                    UPSTREAM_RESPONSES.inc("heiman", str(response.status))
+                    loaded = await response.json(content_type=None)
+            result = loaded.get("result") or {}
+            token = result.get("access_token")
+            if loaded.get("message") != "success" or not token:
+                raise HeimanAuthError(f"Heiman token request failed: {loaded.get('message')}")
+        except Exception:
+            self.failures += 1
+            raise
+        self.fetched += 1
+        expiresIn = float(result.get("expires_in") or result.get("expiresIn") or self.default_ttl)
+        logger.info(f"Fetched Heiman access token, valid for {expiresIn:.0f}s")
+        return token, time.time() + expiresIn
+
+    async def _refresh_loop(self):
+        while True:
+            if self._token is None:
+                delay = self.lock_ttl
+            else:
+                delay = max(self._expires_at - self.refresh_ahead - time.time(), 1)
+                delay += random.uniform(0, min(30.0, self.refresh_ahead / 4))
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Heiman token refresh failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "valid_for_s": round(max(self._expires_at - time.time(), 0), 1) if self._token else None,
+            "fetched": self.fetched,
+            "adopted": self.adopted,
+            "failures": self.failures,
+        }
@@ -0,0 +1,81 @@
+import aiohttp
+from aiohttp.resolver import AsyncResolver
+from typing import Dict, Optional
+from yarl import URL
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HttpPool:
+    """One keep-alive aiohttp session per upstream host, shared by all clients.
+
+    Sessions are created lazily on first use (they must be bound to the running
+    loop) and closed together in close(), which is called from the app lifespan.
+    """
+
+    def __init__(self,
+                 limit: int = 100,
+                 limit_per_host: int = 20,
+                 keepalive_timeout: float = 30,
+                 dns_cache_ttl: int = 300,
+                 total_timeout: Optional[float] = 15,
+                 connect_timeout: Optional[float] = 5,
+                 read_timeout: Optional[float] = 10):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout, sock_read=read_timeout)
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._closed = False
+
+    def _host_key(self, url: str) -> str:
+        parsed = URL(url)
+        return f"{parsed.scheme}://{parsed.host}:{parsed.port}"
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        try:
+            resolver = AsyncResolver()
+        except Exception as e:
+            # aiodns/pycares missing or broken - fall back to the threaded resolver
+            logger.warning(f"Async DNS resolver unavailable, using default: {e}")
+            resolver = None
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            resolver=resolver,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    def session(self, url: str) -> aiohttp.ClientSession:
+        """Return the pooled session for the host of the given url"""
+        if self._closed:
+            raise RuntimeError("HttpPool is closed")
+
+        key = self._host_key(url)
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            session = self._create_session()
+            self._sessions[key] = session
+            logger.info(f"Opened pooled HTTP session for {key}")
+        return session
+
+    async def open(self, *urls: str):
+        """Eagerly create sessions for known upstreams"""
+        self._closed = False
+        for url in urls:
+            self.session(url)
+
+    async def close(self):
+        self._closed = True
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        logger.info(f"Closed {len(sessions)} pooled HTTP sessions")
@@ -0,0 +1,120 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Attributes every LogRecord has; anything else came in through extra= and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg and the extra= fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Like QueueHandler.prepare, but keeps the traceback out of msg so it becomes its own field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in N records logged with extra={"sample": key}.
+
+    Meant for messages written once per event or per push during alarm bursts.
+    Warnings and errors always pass. Kept records get sampled_1_in=N so counts
+    can be scaled back up.
+    """
+
+    def __init__(self, every: Dict[str, int]):
+        super().__init__()
+        self.every = every
+        self._seen: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None or record.levelno >= logging.WARNING:
+            return True
+        every = self.every.get(key, 1)
+        if every <= 1:
+            return True
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        if seen % every:
+            return False
+        record.sampled_1_in = every
+        return True
+
+
+def parse_sampling(spec: str) -> Dict[str, int]:
+    """"event=10,push=5" -> {"event": 10, "push": 5}"""
+    every = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, value = part.partition("=")
+        every[key.strip()] = max(1, int(value))
+    return every
+
+
+def setup_logging(level: str = "INFO", sampling: Optional[Dict[str, int]] = None,
+                  loggers=("uvicorn", "uvicorn.error", "uvicorn.access")) -> logging.handlers.QueueListener:
+    """Route the root logger (and uvicorn's) through a queue to a stdout writer thread.
+
+    The event loop only formats the message and enqueues the record; JSON
+    encoding and the blocking stdout write happen on the listener thread.
+    """
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(sampling or {}))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(records, stream_handler, respect_handler_level=False)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    for name in loggers:
+        named = logging.getLogger(name)
+        named.handlers = []
+        named.propagate = True
+
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener: logging.handlers.QueueListener):
+    """Flush what is queued; safe to call more than once"""
+    if listener._thread is not None:
+        listener.stop()
+
+
+def setup_from_env() -> logging.handlers.QueueListener:
+    return setup_logging(os.getenv("LOG_LEVEL", "INFO"), parse_sampling(os.getenv("LOG_SAMPLE", "event=10,push=10")))
@@ -1,28 +1,48 @@
 import os
 from ast import parse
+import asyncio
+import base64
+import time
 
-from fastapi import FastAPI, HTTPException, Depends, Security, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Security, Request, BackgroundTasks, Query, Body
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 import jwt  # PyJWT library
-from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable, Iterator
+from datetime import datetime, timedelta, timezone
 import logging
 from .supajwks.jwksclient import JWKSClient
+from .supajwks.tokencache import VerifiedTokenCache
 import logging
 from .heiman.heimanconnector import HeimanConnector
-from pydantic import BaseModel, JsonValue
+from .heiman.tokenmanager import HeimanTokenManager, TOKEN_HEADER
+from pydantic import BaseModel, JsonValue, Field
 from .supaconnector.supaconnector import SupabaseDevicesClient
 from typing import List
 import json
-from .notifier.notifier import processNotification, NotificationRequest, processEFlaraREQ, Address
+import orjson
+from .notifier.notifier import processNotification, NotificationRequest, processEFlaraREQ, Address, EXPO_PUSH_URL, EFLARA_URL, PushDispatcher, PushDeliveryError
+from .httppool.httppool import HttpPool
+from .cache.twotiercache import TwoTierCache
+from .routing.alarmroutes import AlarmRouteStore
+from .routing.eventgate import EventGate, EventDecision, SMOKE_LOCK_TTL
+from .registration.registration import DeviceRegistrar, RegistrationError
+from .dispatch.dispatchqueue import DispatchQueue
+from .dispatch.scheduler import DelayedScheduler
+from .metrics.metrics import REGISTRY, AUTH_SECONDS, DISPATCH_BACKLOG
+from .metrics.middleware import MetricsMiddleware
+from .metrics.redismetrics import InstrumentedRedis
+from .jsonlog.jsonlog import setup_from_env as setup_logging_from_env
+from .health.health import ReadinessChecker
+from .resilience.resilience import Upstream, CircuitBreaker, CircuitOpenError, DeadlineExceeded, DeadlineMiddleware
+from .fastresponse.fastresponse import ORJSONResponse, validated_response, parse_timestamps
 
 from asyncio import sleep
 from contextlib import asynccontextmanager
 import redis.asyncio as redis
 
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, JSONResponse
 
 
 
@@ -44,20 +64,65 @@ class ListReturnItem(BaseModel):
     product_id: str
     name: Optional[str] = None
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging - JSON lines written from a background thread, see api/jsonlog
+setup_logging_from_env()
 logger = logging.getLogger(__name__)
 
 redis_client: redis.Redis = None
 
+http_pool = HttpPool(
+    limit=int(os.getenv("HTTP_POOL_LIMIT", "100")),
+    limit_per_host=int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20")),
+    keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30")),
+    dns_cache_ttl=int(os.getenv("HTTP_DNS_CACHE_TTL", "300")),
+    total_timeout=float(os.getenv("HTTP_TIMEOUT_TOTAL", "15")),
+    connect_timeout=float(os.getenv("HTTP_TIMEOUT_CONNECT", "5")),
+    read_timeout=float(os.getenv("HTTP_TIMEOUT_READ", "10")),
+)
+
+def upstream_from_env(name: str, timeout: float, hedge: bool = False) -> Upstream:
+    """Per-call timeout from <NAME>_TIMEOUT, breaker and hedging settings shared by all upstreams"""
+    return Upstream(
+        name,
+        timeout=float(os.getenv(f"{name.upper()}_TIMEOUT", str(timeout))),
+        breaker=CircuitBreaker(
+            name,
+            failure_threshold=int(os.getenv("BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("BREAKER_RESET", "30")),
+        ),
+        hedge=hedge and os.getenv("HEDGE_READS", "0") == "1",
+        hedge_quantile=float(os.getenv("HEDGE_QUANTILE", "0.95")),
+    )
+
+upstreams = {
+    "heiman": upstream_from_env("heiman", 8, hedge=True),
+    "supabase": upstream_from_env("supabase", 5, hedge=True),
+    "expo": upstream_from_env("expo", 10),
+    "eflara": upstream_from_env("eflara", 10),
+}
+
+push_dispatcher = PushDispatcher(
+    http_pool,
+    concurrency=int(os.getenv("PUSH_CONCURRENCY", "4")),
+    upstream=upstreams["expo"],
+    retries=int(os.getenv("PUSH_RETRIES", "2")),
+    retry_backoff=float(os.getenv("PUSH_RETRY_BACKOFF", "0.5")),
+)
+
+HEIMAN_URL = os.getenv("HEIMAN_URL", "https://spapi.heiman.cn")
+SUPABASE_URL = os.getenv("SUPABASE_URL", "https://zjqohfcskeirutsezxua.supabase.co")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     global redis_client
-    redis_client = redis.Redis(
-        host='redis',
-        port=6379,
+    await http_pool.open(HEIMAN_URL, SUPABASE_URL, EXPO_PUSH_URL, EFLARA_URL)
+    await jwks_client.start()
+
+    redis_client = InstrumentedRedis(
+        host=os.getenv("REDIS_HOST", "redis"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
         db=0,
         decode_responses=True,
         retry_on_error=[redis.BusyLoadingError, redis.ConnectionError],
@@ -67,17 +132,33 @@ async def lifespan(app: FastAPI):
     # Test connection
     try:
         await redis_client.ping()
-        print("✅ Connected to Redis successfully")
+        logger.info("Connected to Redis")
     except redis.ConnectionError:
-        print("❌ Failed to connect to Redis")
+        logger.error("Failed to connect to Redis")
         raise
 
+    if heiman_tokens is not None:
+        await heiman_tokens.start(redis_client)
+    await device_cache.start(redis_client)
+    alarm_routes.attach(redis_client)
+    device_registrar.attach(redis_client)
+    await event_gate.load(redis_client)
+    await dispatch_queue.start(redis_client)
+    await delayed_jobs.start(redis_client)
+
     yield
 
     # Shutdown
+    await delayed_jobs.stop()
+    await dispatch_queue.stop()
+    await device_cache.stop()
+    if heiman_tokens is not None:
+        await heiman_tokens.stop()
     if redis_client:
         await redis_client.aclose()
-        print("🔌 Redis connection closed")
+        logger.info("Redis connection closed")
+    await jwks_client.stop()
+    await http_pool.close()
 
 app = FastAPI(title="BrandbullSmart", version="1.0.0", description="From razniewski.eu with <3", lifespan=lifespan)
 app.add_middleware(
@@ -87,23 +168,97 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+app.add_middleware(DeadlineMiddleware, seconds=float(os.getenv("REQUEST_DEADLINE", "10")))
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    return JSONResponse({"detail": "UPSTREAM_UNAVAILABLE", "upstream": exc.upstream}, status_code=503,
+                        headers={"Retry-After": str(max(int(exc.retry_after + 0.999), 1))})
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse({"detail": "UPSTREAM_TIMEOUT"}, status_code=504)
 security = HTTPBearer()
 clientidheiman = os.getenv("HEIMAN_CLIENT_ID")
 secretheiman = os.getenv("HEIMAN_CLIENT_SECRET")
 
-heimanConnector = HeimanConnector("https://spapi.heiman.cn", clientidheiman, secretheiman)
-
-JWKS_URL = "https://zjqohfcskeirutsezxua.supabase.co/auth/v1/.well-known/jwks.json"
+# Opt-in: the Heiman calls work with Tenant-Id alone, and the credentials are set in every deployment.
+# When enabled every replica shares one token through Redis
+HEIMAN_AUTH_ENABLED = os.getenv("HEIMAN_AUTH_ENABLED", "0") == "1"
+if HEIMAN_AUTH_ENABLED and not (clientidheiman and secretheiman):
+    logger.warning("HEIMAN_AUTH_ENABLED is set without HEIMAN_CLIENT_ID/HEIMAN_CLIENT_SECRET, Heiman calls stay unauthenticated")
+heiman_tokens = HeimanTokenManager(
+    HEIMAN_URL, clientidheiman, secretheiman, http_pool,
+    refresh_ahead=float(os.getenv("HEIMAN_TOKEN_REFRESH_AHEAD", "300")),
+    header=os.getenv("HEIMAN_TOKEN_HEADER", TOKEN_HEADER),
+) if HEIMAN_AUTH_ENABLED and clientidheiman and secretheiman else None
+heimanConnector = HeimanConnector(HEIMAN_URL, clientidheiman, secretheiman, http_pool, heiman_tokens, upstreams["heiman"])
+
+JWKS_URL = os.getenv("JWKS_URL", f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json")
 CACHE_DURATION = 3600*4
-jwks_client = JWKSClient(JWKS_URL, CACHE_DURATION)
+jwks_client = JWKSClient(JWKS_URL, http_pool, CACHE_DURATION)
+token_cache = VerifiedTokenCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 SRK = os.getenv("SUPABASE_SERVICE_KEY")
 
-supadevices = SupabaseDevicesClient("https://zjqohfcskeirutsezxua.supabase.co", SRK)
+device_cache = TwoTierCache(
+    l1_ttl=float(os.getenv("DEVICE_CACHE_L1_TTL", "30")),
+    l2_ttl=int(os.getenv("DEVICE_CACHE_L2_TTL", "300")),
+    prefix="devcache:",
+    channel="devcache_invalidate",
+)
+supadevices = SupabaseDevicesClient(SUPABASE_URL, SRK, http_pool, device_cache, upstreams["supabase"])
+alarm_routes = AlarmRouteStore(supadevices)
+device_registrar = DeviceRegistrar(heimanConnector, supadevices, alarm_routes,
+                                   lock_ttl=float(os.getenv("REGISTER_LOCK_TTL", "30")),
+                                   commit_timeout=float(os.getenv("REGISTER_COMMIT_TIMEOUT", "10")))
+event_gate = EventGate(alarm_routes)
+dispatch_queue = DispatchQueue(
+    concurrency=int(os.getenv("DISPATCH_CONCURRENCY", "16")),
+    claim_idle_ms=int(os.getenv("DISPATCH_CLAIM_IDLE_MS", "60000")),
+    retry_backoff=float(os.getenv("DISPATCH_RETRY_BACKOFF", "1")),
+)
+delayed_jobs = DelayedScheduler(dispatch_queue)
+
+
+async def jwks_ready():
+    jwks = await jwks_client.get_jwks()
+    if not jwks.get("keys"):
+        raise Exception("JWKS has no signing keys")
+
+readiness = ReadinessChecker(
+    {
+        "redis": lambda: redis_client.ping(),
+        "jwks": jwks_ready,
+        "postgrest": supadevices.ping,
+        "heiman": heimanConnector.ping,
+    },
+    timeout=float(os.getenv("READINESS_TIMEOUT", "1")),
+    cache_ttl=float(os.getenv("READINESS_CACHE_TTL", "3")),
+    required=[name.strip() for name in os.getenv("READINESS_REQUIRED", "redis,jwks").split(",") if name.strip()],
+)
+# eFlara goes out after the alarm push, giving the other notifications time to turn off
+EFLARA_DELAY = float(os.getenv("EFLARA_DELAY", "4"))
 
 async def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)) -> Dict[str, Any]:
     token = credentials.credentials
+    started = time.perf_counter()
+
+    cached = token_cache.get(token)
+    if cached is not None:
+        AUTH_SECONDS.observe(time.perf_counter() - started, "cached")
+        return cached
 
+    outcome = "rejected"
+    try:
+        payload = await decode_token(token)
+        outcome = "verified"
+        return payload
+    finally:
+        AUTH_SECONDS.observe(time.perf_counter() - started, outcome)
+
+async def decode_token(token: str) -> Dict[str, Any]:
     try:
         unverified_header = jwt.get_unverified_header(token)
         kid = unverified_header.get("kid")
@@ -134,10 +289,11 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Security(secu
             )
 
             logger.debug(f"HS256 token verified successfully for user: {payload.get('sub', 'unknown')}")
+            token_cache.put(token, payload)
             return payload
 
         elif alg in ["ES256", "RS256"]:
-            signing_key = jwks_client.get_signing_key(kid)
+            signing_key = await jwks_client.get_signing_key(kid)
 
             payload = jwt.decode(
                 token,
@@ -152,6 +308,7 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Security(secu
             )
 
             logger.debug(f"{alg} token verified successfully for user: {payload.get('sub', 'unknown')}")
+            token_cache.put(token, payload)
             return payload
         else:
             raise HTTPException(status_code=401, detail=f"Unsupported algorithm: {alg}")
@@ -196,46 +353,18 @@ async def get_authenticated_user(payload: Optional[Dict[str, Any]] = Depends(ver
 
 @app.post("/register_device")
 async def register_device(req: DeviceRegistrationRequest, current_user: str = Depends(get_authenticated_user)):
-    print(req, current_user)
-    queried = await heimanConnector.nameByDevice(current_user, req.productID, req.deviceName)
-    message = queried.get("message", None)
-    if message == "success":
-        result = queried["result"]
-        if len(result) == 0:
-            raise HTTPException(status_code=404, detail=f"DEVICE_NOT_FOUND")
-
-        deviceID = result[0]["id"]
-        already = await supadevices.check_device_exists_in_the_system(deviceID)
-        if already:
-            fetchedDevice = await supadevices.get_device_by_device_id(deviceID)
-            user_id = fetchedDevice.get("user_id", None)
-            if user_id is not None:
-                unbinded = await heimanConnector.unbind(user_id, deviceID)
-                unbindedmessage = unbinded.get("message", None)
-                if unbindedmessage == "success":
-                    removed = await supadevices.remove_device_from_user(user_id, deviceID)
-                    already = await supadevices.check_device_exists_in_the_system(deviceID)
-
-        if not already:
-            binded = await heimanConnector.bind(current_user, deviceID)
-            bindedmessage = binded.get("message", None)
-            if bindedmessage == "success":
-                created = await supadevices.add_device_for_user(current_user, deviceID, req.deviceName, req.productID)
-
-                parsedTime = datetime.fromisoformat(created["created_at"].replace("Z", "+00:00"))
-                return RegisterDeviceResponse(
-                    created_at = parsedTime,
-                    uuid =  created["uuid"],
-                    name = created["name"]
-                )
-            else:
-                raise HTTPException(status_code=500, detail=f"Failed to bind device: {binded.get('message', 'unknown error')}")
-
-        else:
-            raise HTTPException(status_code=400, detail=f"DEVICE_ALREADY_REGISTERED")
-
-    else:
-        raise HTTPException(status_code=404, detail=f"DEVICE_NOT_FOUND")
+    logger.info(f"Registering device {req.deviceName}", extra={"user": current_user, "product_id": req.productID})
+    try:
+        created = await device_registrar.register(current_user, req.productID, req.deviceName, req.deviceName)
+    except RegistrationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    parsedTime = datetime.fromisoformat(created["created_at"].replace("Z", "+00:00"))
+    return RegisterDeviceResponse(
+        created_at = parsedTime,
+        uuid =  created["uuid"],
+        name = created["name"]
+    )
 
 @app.post("/unregister_device")
 async def unregister_device(req: DeviceRegistrationRequest, current_user: str = Depends(get_authenticated_user)):
@@ -253,6 +382,7 @@ async def unregister_device(req: DeviceRegistrationRequest, current_user: str =
             unbindedmessage = unbinded.get("message", None)
             if unbindedmessage == "success":
                 removed = await supadevices.remove_device_from_user(current_user, deviceID)
+                await alarm_routes.remove_device(current_user, deviceID)
                 if removed:
                     return {"status": "success", "detail": "Device unregistered successfully"}
                 else:
@@ -278,6 +408,7 @@ async def unregister_device(req: DeviceUnRegistrationRequest, current_user: str
     unbindedmessage = unbinded.get("message", None)
     if unbindedmessage == "success":
         removed = await supadevices.remove_device_from_user(current_user, device_id)
+        await alarm_routes.remove_device(current_user, device_id)
         if removed:
             return {"status": "success", "detail": "Device unregistered successfully"}
         else:
@@ -297,6 +428,13 @@ class PropertyReport(BaseModel):
 class DeviceEvents(BaseModel):
     events: List[Event]
     properties: List[PropertyReport]
+    cursor: Optional[str] = None
+
+class LogsQuery(BaseModel):
+    pageIndex: int = Field(ge=0)
+    pageSize: int = Field(ge=1, le=100)
+    startTime: Optional[int] = None
+    endTime: Optional[int] = None
 
 class eFlara(BaseModel):
     address: str
@@ -309,6 +447,17 @@ class DeviceInfo(BaseModel):
 
 
 
+class DeviceStatus(BaseModel):
+    uuid: str
+    name: Optional[str]
+    state: str
+    eFlara: bool
+
+HEIMAN_FANOUT_CONCURRENCY = int(os.getenv("HEIMAN_FANOUT_CONCURRENCY", "8"))
+# orjson/TypeAdapter responses for /list and /device/{uuid}/logs, same payload as the response_model path
+FAST_RESPONSES = os.getenv("FAST_RESPONSES", "0") == "1"
+HEIMAN_LIST_PAGE_SIZE = 50
+
 class NotificationTokenRequest(BaseModel):
     token: str
 
@@ -318,24 +467,38 @@ async def add_notification_token(req: NotificationTokenRequest, current_user: st
         raise HTTPException(status_code=400, detail="TOKEN_MISSING")
 
     await supadevices.add_notification_token(current_user, req.token)
+    await alarm_routes.refresh_tokens(current_user)
     return {"status": "success", "detail": "Token added successfully"}
 
+def device_state(detailed: Dict[str, Any]) -> str:
+    stateOf = detailed.get("state", None) or {}
+    if stateOf.get("text", None) == "Online":
+        return stateOf.get("value", "offline")
+    return "offline"
+
 @app.get("/device/{device_uuid}/info")
 async def get_device_info(device_uuid: str, current_user: str = Depends(get_authenticated_user)) -> DeviceInfo:
-    device_info = await supadevices.get_device_by_uuid(current_user, device_uuid)
+    # Heiman only needs the internal id, so when it is already known locally both lookups run together
+    knownDeviceID = supadevices.peek_device_id(current_user, device_uuid)
+    if knownDeviceID is not None:
+        device_info, detailed = await asyncio.gather(
+            supadevices.get_device_with_eflara(current_user, device_uuid),
+            heimanConnector.getDeviceIDDetail(current_user, knownDeviceID),
+        )
+    else:
+        device_info = await supadevices.get_device_with_eflara(current_user, device_uuid)
+        detailed = None
     if device_info is None:
         raise HTTPException(status_code=404, detail="DEVICE_NOT_FOUND")
 
-    detailed = await heimanConnector.getDeviceIDDetail(current_user, device_info["internal_device_id"])
+    if knownDeviceID != device_info["internal_device_id"]:
+        detailed = await heimanConnector.getDeviceIDDetail(current_user, device_info["internal_device_id"])
     if detailed is None or detailed.get("message", None) != "success":
         raise HTTPException(status_code=404, detail="DEVICE_NOT_FOUND")
     detailed = detailed.get("result", {})
-    deviceInfo = DeviceInfo(state="offline", name=device_info["name"], eFlara = None)
-    stateOf = detailed.get("state", {})
-    if stateOf.get("text", None) == "Online":
-        deviceInfo.state = stateOf.get("value", "offline")
+    deviceInfo = DeviceInfo(state=device_state(detailed), name=device_info["name"], eFlara = None)
 
-    eFlaraStatus = await supadevices.get_eflara_for_device(device_uuid)
+    eFlaraStatus = device_info["eflara"]
     if eFlaraStatus is not None:
         deviceInfo.eFlara = eFlara(address=eFlaraStatus["address"], enabled=eFlaraStatus["enabled"])
 
@@ -357,6 +520,7 @@ async def rename_device(device_uuid: str, req: RenameRequest, current_user: str
     await supadevices.update_device(current_user, device_uuid, {
         "name": req.name
     })
+    await alarm_routes.set_name(current_user, device_info["internal_device_id"], req.name)
     return {"status": "success", "detail": "Device renamed successfully"}
 
 @app.post("/device/{device_uuid}/eflara")
@@ -366,72 +530,126 @@ async def set_eflara_status(device_uuid: str, req: eFlara, current_user: str = D
         raise HTTPException(status_code=404, detail="DEVICE_NOT_FOUND")
 
     await supadevices.set_eflara_for_device(device_uuid, req.address, req.enabled)
+    await alarm_routes.set_eflara(current_user, device_info["internal_device_id"], req.address, req.enabled)
     return {"status": "success", "detail": "eFlara status updated successfully"}
 
+def parse_log_timestamp(parsed: Dict[str, Any]) -> Optional[datetime]:
+    timestampOf = parsed.get("timestamp", -1)
+    if timestampOf == -1:
+        return None
+    try:
+        return datetime.fromtimestamp(int(timestampOf)/1000)
+    except Exception as e:
+        logger.warning(f"Unparseable log timestamp {timestampOf}: {e}")
+        return None
+
+def log_contents(logs: Dict[str, Any], kind: str, loads: Callable[[str], Any] = json.loads) -> Iterator[Dict[str, Any]]:
+    for entry in logs.get("result", {}).get("data", []):
+        typeOf = entry.get("type", {})
+        if typeOf.get("value", "") != kind:
+            continue
+        try:
+            yield loads(entry.get("content", ""))
+        except json.JSONDecodeError:
+            continue
+
+def device_event_rows(logs: Dict[str, Any], loads: Callable[[str], Any] = json.loads) -> List[Dict[str, Any]]:
+    return [{"name": parsed.get("event", ""), "timestamp": parse_log_timestamp(parsed)}
+            for parsed in log_contents(logs, "event", loads) if parsed.get("event", "") != ""]
+
+def property_report_rows(logs: Dict[str, Any], loads: Callable[[str], Any] = json.loads) -> List[Dict[str, Any]]:
+    return [{"properties": parsed.get("properties", {}), "timestamp": parse_log_timestamp(parsed)}
+            for parsed in log_contents(logs, "reportProperty", loads)]
+
+def parse_device_events(logs: Dict[str, Any]) -> List[Event]:
+    return [Event(**row) for row in device_event_rows(logs)]
+
+def parse_property_reports(logs: Dict[str, Any]) -> List[PropertyReport]:
+    return [PropertyReport(**row) for row in property_report_rows(logs)]
+
+def has_more_logs(logs: Dict[str, Any], pageIndex: int, pageSize: int) -> bool:
+    result = logs.get("result", {})
+    total = result.get("total", None)
+    if isinstance(total, int):
+        return (pageIndex + 1) * pageSize < total
+    return len(result.get("data", [])) >= pageSize
+
+def encode_logs_cursor(query: LogsQuery) -> str:
+    raw = json.dumps(query.model_dump(), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def decode_logs_cursor(cursor: str) -> LogsQuery:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return LogsQuery.model_validate_json(raw)
+    except Exception:
+        raise HTTPException(status_code=400, detail="INVALID_CURSOR")
+
 @app.get("/device/{device_uuid}/logs")
-async def get_device_info(device_uuid: str, current_user: str = Depends(get_authenticated_user)) -> DeviceEvents:
+async def get_device_logs(device_uuid: str,
+                          pageSize: int = Query(5, ge=1, le=100),
+                          pageIndex: int = Query(0, ge=0),
+                          since: Optional[datetime] = None,
+                          until: Optional[datetime] = None,
+                          cursor: Optional[str] = None,
+                          current_user: str = Depends(get_authenticated_user)) -> DeviceEvents:
     device_info = await supadevices.get_device_by_uuid(current_user, device_uuid)
     if device_info is None:
         raise HTTPException(status_code=404, detail="DEVICE_NOT_FOUND")
 
-    toRet = DeviceEvents(events=[], properties=[])
-
-    logs = await heimanConnector.getDeviceEvents(current_user, device_info["internal_device_id"])
-    if logs.get("message", None) == "success":
-        result = logs.get("result", {})
-        data = result.get("data", [])
-        for entry in data:
-            typeOf = entry.get("type", {})
-            valueOf = typeOf.get("value", "")
-            if valueOf == "event":
-                contentOf = entry.get("content", "")
-                try:
-                    parsed = json.loads(contentOf)
-                    eventName = parsed.get("event", "")
-                    if eventName != "":
-                        timestampOf = parsed.get("timestamp", -1)
-                        parsedDate = None
-                        if timestampOf != -1:
-                            try:
-                                parsedDate = datetime.fromtimestamp(int(timestampOf)/1000)
-                            except Exception as e:
-                                print(e)
-
-                        toRet.events.append(Event(name=eventName, timestamp=parsedDate))
-                except json.JSONDecodeError:
-                    continue
-
-    logs = await heimanConnector.getDeviceProperties(current_user, device_info["internal_device_id"])
-    if logs.get("message", None) == "success":
-        result = logs.get("result", {})
-        data = result.get("data", [])
-        for entry in data:
-            typeOf = entry.get("type", {})
-            valueOf = typeOf.get("value", "")
-            if valueOf == "reportProperty":
-                contentOf = entry.get("content", "")
-                try:
-                    parsed = json.loads(contentOf)
-                    properties = parsed.get("properties", {})
-                    timestampOf = parsed.get("timestamp", -1)
-                    parsedDate = None
-                    if timestampOf != -1:
-                        try:
-                            parsedDate = datetime.fromtimestamp(int(timestampOf)/1000)
-                        except Exception as e:
-                            print(e)
-                    toRet.properties.append(PropertyReport(properties=properties, timestamp=parsedDate))
-                except json.JSONDecodeError:
-                    continue
-
-        return toRet
+    if cursor is not None:
+        query = decode_logs_cursor(cursor)
     else:
+        # Pin the upper bound on the first page so later pages don't shift when new logs arrive
+        untilOf = until or datetime.now(timezone.utc)
+        query = LogsQuery(
+            pageIndex=pageIndex,
+            pageSize=pageSize,
+            startTime=int(since.timestamp() * 1000) if since is not None else None,
+            endTime=int(untilOf.timestamp() * 1000),
+        )
+
+    deviceID = device_info["internal_device_id"]
+    events, properties = await asyncio.gather(
+        heimanConnector.getDeviceEvents(current_user, deviceID, query.pageSize, query.pageIndex, query.startTime, query.endTime),
+        heimanConnector.getDeviceProperties(current_user, deviceID, query.pageSize, query.pageIndex, query.startTime, query.endTime),
+    )
+
+    if properties.get("message", None) != "success":
         raise HTTPException(status_code=500, detail="Failed to fetch device logs")
 
+    eventsOk = events.get("message", None) == "success"
+    more = has_more_logs(properties, query.pageIndex, query.pageSize)
+    if eventsOk:
+        more = more or has_more_logs(events, query.pageIndex, query.pageSize)
+    cursorOf = encode_logs_cursor(query.model_copy(update={"pageIndex": query.pageIndex + 1})) if more else None
+
+    if FAST_RESPONSES:
+        return validated_response(DeviceEvents, {
+            "events": device_event_rows(events, orjson.loads) if eventsOk else [],
+            "properties": property_report_rows(properties, orjson.loads),
+            "cursor": cursorOf,
+        })
+
+    return DeviceEvents(
+        events=parse_device_events(events) if eventsOk else [],
+        properties=parse_property_reports(properties),
+        cursor=cursorOf,
+    )
+
 
 @app.get("/list")
 async def list_devices(current_user: str = Depends(get_authenticated_user)) -> List[ListReturnItem]:
     listing = await supadevices.list_devices_for_user(current_user)
+    if FAST_RESPONSES:
+        # rows come straight from our own table, the shape is trusted and not validated again
+        createdAt = parse_timestamps([item["created_at"] for item in listing])
+        return ORJSONResponse([
+            {"created_at": parsedTime, "internal_uuid": item["uuid"], "product_id": item["internal_product_id"],
+             "name": item.get("name", None)}
+            for item, parsedTime in zip(listing, createdAt)
+        ])
+
     toRet = []
     for item in listing:
         parsedTime = datetime.fromisoformat(item["created_at"].replace("Z", "+00:00"))
@@ -443,11 +661,82 @@ async def list_devices(current_user: str = Depends(get_authenticated_user)) -> L
         ))
     return toRet
 
+async def fetch_heiman_states(current_user: str) -> Dict[str, str]:
+    """deviceId -> state for every device bound to the user, from the paged device list.
+
+    Entries listed without a state are left out, so the caller looks them up one by one.
+    """
+    async def page(pageIndex: int) -> Dict[str, Any]:
+        listed = await heimanConnector.deviceList(current_user, pageIndex, HEIMAN_LIST_PAGE_SIZE)
+        if listed.get("message", None) != "success":
+            raise HTTPException(status_code=502, detail="Failed to list devices")
+        return listed.get("result", {})
+
+    first = await page(0)
+    pages = [first]
+    total = first.get("total", 0)
+    if isinstance(total, int) and total > HEIMAN_LIST_PAGE_SIZE:
+        pageCount = (total + HEIMAN_LIST_PAGE_SIZE - 1) // HEIMAN_LIST_PAGE_SIZE
+        pages += await asyncio.gather(*(page(index) for index in range(1, pageCount)))
+
+    states = {}
+    for result in pages:
+        for entry in result.get("data", []):
+            deviceID = entry.get("deviceId", None) or entry.get("id", None)
+            if deviceID is not None and entry.get("state", None):
+                states[deviceID] = device_state(entry)
+    return states
+
+async def fetch_heiman_states_one_by_one(current_user: str, deviceIDs: List[str]) -> Dict[str, str]:
+    semaphore = asyncio.Semaphore(HEIMAN_FANOUT_CONCURRENCY)
+
+    async def detail(deviceID: str) -> str:
+        async with semaphore:
+            try:
+                detailed = await heimanConnector.getDeviceIDDetail(current_user, deviceID)
+            except Exception as e:
+                logger.error(f"Failed to fetch detail of {deviceID}: {e}")
+                return "offline"
+        if detailed is None or detailed.get("message", None) != "success":
+            return "offline"
+        return device_state(detailed.get("result", {}))
+
+    states = await asyncio.gather(*(detail(deviceID) for deviceID in deviceIDs))
+    return dict(zip(deviceIDs, states))
+
+@app.get("/devices/status")
+async def devices_status(current_user: str = Depends(get_authenticated_user)) -> List[DeviceStatus]:
+    devices, listed = await asyncio.gather(
+        supadevices.list_devices_with_eflara(current_user),
+        fetch_heiman_states(current_user),
+        return_exceptions=True,
+    )
+    if isinstance(devices, BaseException):
+        raise devices
+    if isinstance(listed, BaseException):
+        logger.warning(f"Heiman device list failed, falling back to per device detail: {listed}")
+        listed = {}
+
+    missing = [device["internal_device_id"] for device in devices if device["internal_device_id"] not in listed]
+    if missing:
+        listed.update(await fetch_heiman_states_one_by_one(current_user, missing))
+
+    return [
+        DeviceStatus(
+            uuid=device["uuid"],
+            name=device.get("name", None),
+            state=listed.get(device["internal_device_id"], "offline"),
+            eFlara=device["eflara_enabled"],
+        )
+        for device in devices
+    ]
+
 @app.delete("/account/delete")
 async def delete_account(current_user: str = Depends(get_authenticated_user)):
     """Delete user account and all associated data"""
     try:
         result = await supadevices.delete_user_account(current_user, should_soft_delete=True)
+        await alarm_routes.forget_user(current_user)
         return result
     except Exception as e:
         logger.error(f"Failed to delete account for user {current_user}: {e}")
@@ -455,14 +744,30 @@ async def delete_account(current_user: str = Depends(get_authenticated_user)):
 
 
 
+@app.get("/health/live")
+async def liveness_check():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    result = await readiness.check()
+    return JSONResponse(result, status_code=200 if result["status"] == "ready" else 503)
+
 @app.get("/health")
 async def health_check():
     try:
-        jwks = jwks_client.get_jwks()
+        jwks = await jwks_client.get_jwks()
         return {
             "status": "healthy",
             "jwks_keys_count": len(jwks.get("keys", [])),
             "available_key_ids": [key.get("kid") for key in jwks.get("keys", [])],
+            "token_cache": token_cache.stats(),
+            "key_cache": jwks_client.key_cache_stats(),
+            "device_cache": device_cache.stats(),
+            "dispatch": dispatch_queue.stats(),
+            "delayed_jobs": delayed_jobs.stats(),
+            "heiman_token": heiman_tokens.stats() if heiman_tokens is not None else None,
+            "upstreams": {name: upstream.stats() for name, upstream in upstreams.items()},
             "timestamp": datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -483,26 +788,40 @@ class EventPayload(BaseModel):
 
 
 async def processEFlara(tokens: List[str], device_uuid: str, realAlarm: bool):
-    await sleep(4) # wait for other notifications to turn off
     eFlaraStatus = await supadevices.get_eflara_for_device(device_uuid)
     if eFlaraStatus is not None and eFlaraStatus["enabled"]:
-        print("Processing eFLARA", device_uuid)
+        logger.info("Processing eFlara", extra={"device_uuid": device_uuid, "real_alarm": realAlarm})
         title = "Zawiadomiono pierwszych ratowników (TEST)"
         if realAlarm:
-            wasReqiested = await processEFlaraREQ(Address(address=eFlaraStatus["address"]))
-            print("eFLARA REQ", wasReqiested)
-            print("eFLARA REQ", wasReqiested)
-            print("eFLARA REQ", wasReqiested)
+            wasReqiested = await processEFlaraREQ(Address(address=eFlaraStatus["address"]), http_pool, upstreams["eflara"])
+            logger.info("eFlara requested", extra={"device_uuid": device_uuid, "response": wasReqiested})
             title = "Zawiadomiono pierwszych ratowników"
         notiRequest = NotificationRequest(
             tokens=tokens,
             title=title,
             body=f"Zawiadomiono pierwszych ratowników. Adres: {eFlaraStatus['address']}"
         )
-        await processNotification(notiRequest, sound="ratownik.wav", channel="ratownik")
+        try:
+            await processNotification(notiRequest, push_dispatcher, sound="ratownik.wav", channel="ratownik")
+        except PushDeliveryError as e:
+            if not realAlarm:
+                raise
+            # the flare already went out and must not be requested again; only the push is retried
+            logger.error(f"eFlara push not delivered, queued on its own: {e}", extra={"device_uuid": device_uuid})
+            await dispatch_queue.enqueue("notification", tokens=[ticket.token for ticket in e.tickets],
+                                         title=notiRequest.title, body=notiRequest.body,
+                                         sound="ratownik.wav", channel="ratownik")
 
     pass
 
+async def notificationJob(tokens: List[str], title: str, body: str, sound: str = "dym.wav", channel: str = "alarm"):
+    # PushDeliveryError leaves the job pending, so it is delivered again
+    await processNotification(NotificationRequest(tokens=tokens, title=title, body=body), push_dispatcher,
+                              sound=sound, channel=channel)
+
+dispatch_queue.register("notification", notificationJob)
+dispatch_queue.register("eflara", processEFlara)
+
 
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -518,72 +837,181 @@ async def privacy_page():
 async def delete_page():
     return FileResponse('static/delete.html')
 
-@app.post("/internal/event", include_in_schema=False)
-async def internal_event(req: Request, event: EventPayload, background_tasks: BackgroundTasks):
+def check_internal_secret(req: Request):
     headerOf = req.headers.get("X-Internal-Secret", None)
     if headerOf != os.getenv("INTERNAL_SECRET"):
         raise HTTPException(status_code=403, detail="Forbidden")
-    
 
+def event_lock_key(event: EventPayload) -> str:
+    return EventGate.lock_key(event.user, event.messageId)
 
+def smoke_lock_key(user: str, device_uuid: str) -> str:
+    return f"smoke_event_lock_{user}_{device_uuid}"
+
+async def release_event_locks(keys: List[str]):
+    """Drop the dedup and smoke repeat locks taken for events that were not handled, so a retry from the bridge
+    is neither seen as a duplicate nor suppressed as an already processed smoke alarm"""
+    if not keys:
+        return
+    try:
+        await redis_client.delete(*keys)
+    except redis.RedisError as e:
+        logger.warning(f"Could not release {len(keys)} event locks, retries wait for them to expire: {e}")
+
+def eflara_job_id(device_uuid: str, realAlarm: bool) -> str:
+    return f"eflara:{device_uuid}" if realAlarm else f"eflara:{device_uuid}:test"
+
+def alarm_jobs(tokens: List[str], device_uuid: str, title: str, body: str, realAlarm: bool) -> List[tuple]:
+    """(job id, kind, payload, delay) for the push now and the delayed eFlara call"""
+    return [
+        (None, "notification", {"tokens": tokens, "title": title, "body": body}, 0),
+        (eflara_job_id(device_uuid, realAlarm), "eflara",
+         {"tokens": tokens, "device_uuid": device_uuid, "realAlarm": realAlarm}, EFLARA_DELAY),
+    ]
+
+async def handle_event(event: EventPayload, decision: EventDecision, jobs: List[tuple], locks: List[str]) -> Dict[str, str]:
+    """Route one event that already went through the event gate script; dispatch jobs are appended to jobs and
+    the keys of locks taken for it (dedup, smoke repeat) to locks"""
+    if not decision.acquired:
+        logger.debug("Duplicate event, ignoring", extra={"messageId": event.messageId})
+        return {"status": "duplicate"}
+    locks.append(event_lock_key(event))
+
+    logger.info(f"Processing {event.eventName}", extra={"sample": "event", "event": event.model_dump()})
+
+    userReplacedPrefix = event.user.replace("SH_", "", 1)
+
+    route = decision.route
+    if route is None:
+        # Not in the route cache yet - this also backfills it for the next event
+        route = await alarm_routes.get(userReplacedPrefix, event.deviceId)
+    if route is None:
+        logger.warning("Event for unknown device", extra={"user": event.user, "deviceId": event.deviceId})
+        return {"status": "unknown device"}
+
+    allTokens = route.tokens
+    if len(allTokens) == 0:
+        logger.info("No push tokens for event", extra={"user": event.user, "deviceId": event.deviceId})
+        return {"status": "no tokens"}
+
+    if event.eventName == "AlarmTest":
+        title = "Wykryto dym! (TEST)"
+        body = f"Wykryto dym. Urządzenie - {route.device_name}"
+        jobs.extend(alarm_jobs(allTokens, route.device_uuid, title, body, False))
+    elif event.eventName == "SmokeCheckAlarm":
+        smoke_state = event.data.get('SmokeSensorState')
+        if smoke_state is not None and str(smoke_state) != "1":
+            # Alarm cleared - drop the eFlara call if it has not gone out yet
+            if await delayed_jobs.cancel(eflara_job_id(route.device_uuid, True)):
+                logger.info("Alarm cleared, eFlara cancelled", extra={"device_uuid": route.device_uuid})
+
+        lockForRepeat = decision.smokeLock
+        if lockForRepeat is None:
+            lockForRepeat = await redis_client.set(smoke_lock_key(event.user, route.device_uuid), "1", ex=SMOKE_LOCK_TTL, nx=True)
+        if lockForRepeat:
+            locks.append(smoke_lock_key(event.user, route.device_uuid))
+            logger.warning("Smoke alarm", extra={"device_uuid": route.device_uuid, "state": smoke_state})
+            if str(smoke_state) == "1":
+                title = "ALARM! Wykryto dym!"
+                body = f"Wykryto dym! Urządzenie - {route.device_name}"
+                jobs.extend(alarm_jobs(allTokens, route.device_uuid, title, body, True))
+        else:
+            logger.info("Smoke event already processed", extra={"sample": "event", "device_uuid": route.device_uuid})
 
-    result = await redis_client.set(f"event_lock_{event.user}_{event.messageId}", "1", ex=60*10, nx=True)
-    print(result, flush=True)
-    if result:
-        print("PROCESSING EVENT", event)
+    return {"status": "event received"}
+
+async def dispatch_jobs(locks: List[str], jobs: List[tuple]):
+    """Put the jobs on the dispatch stream / schedule; if that fails the events have to be retried by the bridge,
+    so the locks taken for them are released"""
+    now = [(kind, payload) for _, kind, payload, delay in jobs if delay <= 0]
+    later = [job for job in jobs if job[3] > 0]
+    try:
+        await asyncio.gather(dispatch_queue.enqueue_many(now), delayed_jobs.schedule_many(later))
+    except redis.RedisError as e:
+        logger.error(f"Failed to enqueue {len(jobs)} dispatch jobs: {e}")
+        await release_event_locks(locks)
+        raise HTTPException(status_code=503, detail="Dispatch queue unavailable")
+
+@app.post("/internal/event", include_in_schema=False)
+async def internal_event(req: Request, event: EventPayload):
+    check_internal_secret(req)
 
-        userReplacedPrefix = event.user.replace("SH_", "", 1)
+    decision = await event_gate.check(event.user, event.deviceId, event.messageId, event.eventName)
+    jobs, locks = [], []
+    try:
+        result = await handle_event(event, decision, jobs, locks)
+    except Exception:
+        await release_event_locks(locks)
+        raise
+    if jobs:
+        await dispatch_jobs(locks, jobs)
+    return result
 
-        device = await supadevices.get_device_by_user_device_id(userReplacedPrefix, event.deviceId)
+class EventResult(BaseModel):
+    messageId: str
+    status: str
 
-        notifications = await supadevices.get_notification_tokens_for_user(userReplacedPrefix)
-        if not notifications:
-            print("NO TOKENS")
-            return {"status": "no tokens"}
+MAX_EVENT_BATCH = 500
 
-        if len(notifications) == 0:
-            print("NO TOKENS")
-            return {"status": "no tokens"}
+@app.post("/internal/events", include_in_schema=False)
+async def internal_events(req: Request, events: List[EventPayload] = Body(..., max_length=MAX_EVENT_BATCH)) -> List[EventResult]:
+    check_internal_secret(req)
+    if len(events) == 0:
+        return []
 
-        allTokens = []
-        for item in notifications:
-            token = item.get("token", None)
-            if token is not None:
-                allTokens.append(token)
+    # The gate script for the whole batch in a single round trip
+    decisions = await event_gate.check_many(events)
 
-        if event.eventName == "AlarmTest":
-            title = "Wykryto dym! (TEST)"
-            body = f"Wykryto dym. Urządzenie - {device['name']}"
-            reqNoti = NotificationRequest(
-                tokens=allTokens,
-                title=title,
-                body=body
-            )
-            background_tasks.add_task(processNotification, reqNoti)
-            background_tasks.add_task(processEFlara, allTokens, device["uuid"], False)
-        elif event.eventName == "SmokeCheckAlarm":
-
-            lockForRepeat = await redis_client.set(f"smoke_event_lock_{event.user}_{device['uuid']}", "1", ex=60*60, nx=True)
-            print(lockForRepeat, flush=True)
-            if lockForRepeat:
-                print("PROCESSING REAL EVENT", flush=True)
-                smoke_state = event.data.get('SmokeSensorState')
-                if str(smoke_state) == "1":
-                    title = "ALARM! Wykryto dym!"
-                    body = f"Wykryto dym! Urządzenie - {device['name']}"
-                    reqNoti = NotificationRequest(
-                        tokens=allTokens,
-                        title=title,
-                        body=body
-                    )
-                    background_tasks.add_task(processNotification, reqNoti)
-                    background_tasks.add_task(processEFlara, allTokens, device["uuid"], True)
-            else:
-                print("SMOKE EVENT ALREADY PROCESSED BEFORE!", flush=True)
-    else:
-        print("Duplicate event, ignoring", event.messageId, event, flush=True)
+    jobsPerEvent = [[] for _ in events]
+    locksPerEvent = [[] for _ in events]
+    handled = await asyncio.gather(
+        *(handle_event(event, decision, jobs, locks)
+          for event, decision, jobs, locks in zip(events, decisions, jobsPerEvent, locksPerEvent)),
+        return_exceptions=True,
+    )
 
-    return {"status": "event received"}
+    results = []
+    failed, dispatched, jobs = [], [], []
+    for event, outcome, eventJobs, eventLocks in zip(events, handled, jobsPerEvent, locksPerEvent):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Failed to handle event {event.messageId}: {outcome}")
+            # Let the bridge retry it
+            failed.extend(eventLocks)
+            outcome = {"status": "error"}
+        elif eventJobs:
+            dispatched.extend(eventLocks)
+            jobs.extend(eventJobs)
+        results.append(EventResult(messageId=event.messageId, status=outcome["status"]))
+
+    await release_event_locks(failed)
+    if jobs:
+        await dispatch_jobs(dispatched, jobs)
+    return results
+
+@app.get("/internal/metrics", include_in_schema=False)
+async def internal_metrics(req: Request):
+    check_internal_secret(req)
+
+    DISPATCH_BACKLOG.set(dispatch_queue.stats()["in_flight"], "in_flight")
+    try:
+        queued, delayed = await asyncio.gather(dispatch_queue.backlog(), delayed_jobs.backlog())
+        DISPATCH_BACKLOG.set(queued["pending"], "pending")
+        DISPATCH_BACKLOG.set(queued["lag"] or 0, "lag")
+        DISPATCH_BACKLOG.set(delayed["scheduled"], "scheduled")
+        DISPATCH_BACKLOG.set(delayed["overdue"], "overdue")
+    except redis.RedisError as e:
+        logger.warning(f"Dispatch backlog unavailable for metrics: {e}")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/internal/dispatch", include_in_schema=False)
+async def internal_dispatch(req: Request):
+    check_internal_secret(req)
+
+    queued, delayed = await asyncio.gather(dispatch_queue.backlog(), delayed_jobs.backlog())
+    return {
+        "queue": {**dispatch_queue.stats(), **queued},
+        "delayed": {**delayed_jobs.stats(), **delayed},
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="' + str(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """In-process metrics rendered in the Prometheus text format.
+
+    Everything runs on the event loop, so updates are plain dict operations
+    without locks. Each replica is scraped on its own.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "bbsmart_upstream_call_seconds", "Latency of calls to Heiman, Supabase, Expo and eFlara",
+    ("upstream", "operation", "outcome"))
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "bbsmart_upstream_responses_total", "HTTP responses from upstreams by status code", ("upstream", "status"))
+UPSTREAM_RESPONSE_BYTES = REGISTRY.counter(
+    "bbsmart_upstream_response_bytes_total", "Response body size received from upstreams by resource",
+    ("upstream", "resource"))
+REDIS_SECONDS = REGISTRY.histogram(
+    "bbsmart_redis_command_seconds", "Latency of Redis commands (PIPELINE for a whole pipeline), blocking reads excluded",
+    ("command", "outcome"), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0))
+REDIS_BLOCKING_SECONDS = REGISTRY.histogram(
+    "bbsmart_redis_blocking_seconds", "Time blocking Redis reads (XREADGROUP BLOCK, BLPOP...) spent waiting for data",
+    ("command", "outcome"), buckets=(0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+AUTH_SECONDS = REGISTRY.histogram(
+    "bbsmart_auth_verify_seconds", "Bearer token verification time", ("outcome",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+HTTP_SECONDS = REGISTRY.histogram(
+    "bbsmart_http_request_seconds", "API request latency by route template", ("route", "method", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "bbsmart_http_requests_in_flight", "Requests being handled by route template", ("route",))
+DISPATCH_BACKLOG = REGISTRY.gauge(
+    "bbsmart_dispatch_backlog", "Alarm dispatch jobs by state (in_flight, pending, lag, scheduled, overdue)", ("state",))
+DEPENDENCY_UP = REGISTRY.gauge(
+    "bbsmart_dependency_up", "Outcome of the last readiness check by dependency (1 ok, 0 failing)", ("dependency",))
+CIRCUIT_STATE = REGISTRY.gauge(
+    "bbsmart_circuit_state", "Circuit breaker state by upstream (0 closed, 1 half-open, 2 open)", ("upstream",))
+CIRCUIT_REJECTED = REGISTRY.counter(
+    "bbsmart_circuit_rejected_total", "Calls failed fast by an open circuit", ("upstream",))
+HEDGED_REQUESTS = REGISTRY.counter(
+    "bbsmart_hedged_requests_total", "Hedged read attempts sent, and how many answered first", ("upstream", "outcome"))
+DEADLINE_EXCEEDED = REGISTRY.counter(
+    "bbsmart_deadline_exceeded_total", "Upstream calls cut short by their timeout or the request deadline", ("upstream",))
+DEPENDENCY_CHECK_SECONDS = REGISTRY.gauge(
+    "bbsmart_dependency_check_seconds", "Latency of the last readiness check by dependency", ("dependency",))
+
+
+@contextmanager
+def timed(histogram: Histogram, *labels: str):
+    """Observe the duration of the block; the last label is "ok" or "error" depending on how it ended"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        histogram.observe(time.perf_counter() - started, *labels, outcome)
+
+
+def instrumented(upstream: str):
+    """Class decorator timing every public coroutine method into UPSTREAM_SECONDS"""
+
+    def wrap(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            with timed(UPSTREAM_SECONDS, upstream, method.__name__):
+                return await method(*args, **kwargs)
+        return wrapper
+
+    def decorate(cls):
+        for name, member in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.iscoroutinefunction(member):
+                setattr(cls, name, wrap(member))
+        return cls
+    return decorate
@@ -0,0 +1,42 @@
+import time
+
+from starlette.routing import Match
+
+from .metrics import HTTP_IN_FLIGHT, HTTP_SECONDS
+
+
+def route_template(scope) -> str:
+    # Label by template (/device/{uuid}/info), never by raw path, to keep the series count bounded
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware: in-flight gauge and latency histogram per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        route = route_template(scope)
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(route)
+            HTTP_SECONDS.observe(time.perf_counter() - started, route, scope["method"], status)
@@ -0,0 +1,58 @@
+import time
+
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+
+from .metrics import REDIS_SECONDS, REDIS_BLOCKING_SECONDS
+
+# Always wait server side until there is data or the timeout runs out
+_BLOCKING = {"BLPOP", "BRPOP", "BLMOVE", "BLMPOP", "BRPOPLPUSH", "BZPOPMIN", "BZPOPMAX", "BZMPOP"}
+
+
+def _is_blocking(command: str, args) -> bool:
+    if command in _BLOCKING:
+        return True
+    if command in ("XREAD", "XREADGROUP"):
+        # the options come before STREAMS, the keys and ids after it
+        for arg in args[1:]:
+            option = (arg.decode(errors="replace") if isinstance(arg, bytes) else str(arg)).upper()
+            if option == "STREAMS":
+                return False
+            if option == "BLOCK":
+                return True
+    return False
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await super().execute(raise_on_error)
+            outcome = "ok"
+            return result
+        finally:
+            REDIS_SECONDS.observe(time.perf_counter() - started, "PIPELINE", outcome)
+
+
+class InstrumentedRedis(redis.Redis):
+    """redis.asyncio.Redis recording every command (and pipeline) into REDIS_SECONDS.
+
+    Blocking reads go to REDIS_BLOCKING_SECONDS instead: most of their time is
+    spent idle waiting for data, which would swamp the command latency.
+    """
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+        histogram = REDIS_BLOCKING_SECONDS if _is_blocking(command, args) else REDIS_SECONDS
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await super().execute_command(*args, **options)
+            outcome = "ok"
+            return result
+        finally:
+            histogram.observe(time.perf_counter() - started, command, outcome)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
@@ -1,8 +1,12 @@
 from enum import verify
-from typing import List
-import aiohttp
-from pydantic import BaseModel
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional
+from pydantic import BaseModel, JsonValue
 import os
+from ..httppool.httppool import HttpPool
+from ..metrics.metrics import timed, UPSTREAM_SECONDS, UPSTREAM_RESPONSES
+from ..resilience.resilience import Upstream
 
 class NotificationRequest(BaseModel):
     title: str
@@ -12,42 +16,142 @@ class NotificationRequest(BaseModel):
 class Address(BaseModel):
     address: str
 
+logger = logging.getLogger(__name__)
+
 eFlaraAPIKEY = os.environ.get("EFLARA_APIKEY", "XXXX")
 
-async def processEFlaraREQ(adr: Address):
-    async with aiohttp.ClientSession() as session:
-        async with session.post("https://api.1rtest.pl/api/flares/", json={
+EFLARA_URL = os.environ.get("EFLARA_URL", "https://api.1rtest.pl/api/flares/")
+EXPO_PUSH_URL = os.environ.get("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+
+eflara_upstream = Upstream("eflara")
+
+async def processEFlaraREQ(adr: Address, pool: HttpPool, upstream: Upstream = eflara_upstream):
+    async def attempt():
+        async with pool.session(EFLARA_URL).post(EFLARA_URL, json={
             "address": adr.address,
             "apiKey":eFlaraAPIKEY
         }, ssl=False) as response:
-            jsoned = await response.json()
-            return jsoned
-
-
-async def processNotification(notification: NotificationRequest, sound = "dym.wav", channel = "alarm"):
-    url = "https://exp.host/--/api/v2/push/send"
-    print("PROCESSING REQUEST", notification)
-    for expo_token in notification.tokens:
-        message = {
-            "to": expo_token,
-            "title": notification.title,
-            "body": notification.body,
-            "sound": sound,
-            "priority": "high",
-            "channelId": channel,
-        }
+            UPSTREAM_RESPONSES.inc("eflara", str(response.status))
+            return response.status, await response.json()
+
+    with timed(UPSTREAM_SECONDS, "eflara", "flare"):
+        # a flare is not idempotent, so never hedged
+        _, jsoned = await upstream.call(attempt, failed=lambda result: result[0] >= 500)
+        return jsoned
+
+
+class PushTicket(BaseModel):
+    token: str
+    status: str
+    id: Optional[str] = None
+    message: Optional[str] = None
+    details: Optional[JsonValue] = None
+    # the whole request failed (transport, 5xx, open circuit, request-level rejection), not this token
+    retryable: bool = False
+
+
+class PushDeliveryError(Exception):
+    """Some push messages never reached Expo; the dispatch job must not be acknowledged"""
 
-        headers = {
+    def __init__(self, tickets: List[PushTicket]):
+        super().__init__(f"{len(tickets)} push messages not accepted by Expo: {tickets[0].message or tickets[0].details}")
+        self.tickets = tickets
+
+
+class PushDispatcher:
+    """Sends Expo push messages in batches of up to 100, several batches at a time.
+
+    Chunks that fail as a whole are resent up to retries times with
+    exponential backoff, so a blip doesn't wait for the queue's redelivery.
+    """
+
+    def __init__(self, pool: HttpPool, url: str = EXPO_PUSH_URL, batch_size: int = 100, concurrency: int = 4,
+                 upstream: Optional[Upstream] = None, retries: int = 2, retry_backoff: float = 0.5):
+        self.pool = pool
+        self.upstream = upstream or Upstream("expo")
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.url = url
+        self.batch_size = min(batch_size, 100)  # Expo rejects larger batches
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.headers = {
             "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
             "Content-Type": "application/json",
         }
-        try:
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=message) as response:
-                    jsoned = await response.json()
-                    print("NOTI REQ", jsoned, flush=True)
-        except Exception as e:
-            print(f"Error sending notification to {expo_token}: {e}")
+    async def _post(self, messages: List[Dict[str, Any]]):
+        async with self.pool.session(self.url).post(self.url, headers=self.headers, json=messages) as response:
+            UPSTREAM_RESPONSES.inc("expo", str(response.status))
+            return response.status, await response.json()
+
+    async def _send_chunk(self, messages: List[Dict[str, Any]]) -> List[PushTicket]:
+        tokens = [message["to"] for message in messages]
+        async with self._semaphore:
+            try:
+                with timed(UPSTREAM_SECONDS, "expo", "push_batch"):
+                    _, jsoned = await self.upstream.call(lambda: self._post(messages), failed=lambda result: result[0] >= 500)
+            except Exception as e:
+                logger.error(f"Error sending notification batch of {len(messages)}: {e}")
+                return [PushTicket(token=token, status="error", message=str(e), retryable=True) for token in tokens]
+
+        tickets = jsoned.get("data") if isinstance(jsoned, dict) else None
+        if not isinstance(tickets, list) or len(tickets) != len(tokens):
+            # Request level failure, e.g. {"errors": [...]} - nothing in this chunk was accepted
+            logger.error("Expo rejected notification batch", extra={"batch_size": len(tokens), "response": jsoned})
+            return [PushTicket(token=token, status="error", details=jsoned, retryable=True) for token in tokens]
+
+        return [
+            PushTicket(
+                token=token,
+                status=ticket.get("status", "error"),
+                id=ticket.get("id"),
+                message=ticket.get("message"),
+                details=ticket.get("details"),
+            )
+            for token, ticket in zip(tokens, tickets)
+        ]
+
+    async def dispatch(self, notification: NotificationRequest, sound: str = "dym.wav", channel: str = "alarm") -> List[PushTicket]:
+        messages = [
+            {
+                "to": expo_token,
+                "title": notification.title,
+                "body": notification.body,
+                "sound": sound,
+                "priority": "high",
+                "channelId": channel,
+            }
+            for expo_token in dict.fromkeys(notification.tokens)
+        ]
+        tickets = await self._send_all(messages)
+        for attempt in range(self.retries):
+            failed = [i for i, ticket in enumerate(tickets) if ticket.retryable]
+            if not failed:
+                break
+            delay = self.retry_backoff * 2 ** attempt
+            logger.warning(f"Resending {len(failed)} push messages in {delay:.1f}s (retry {attempt + 1}/{self.retries})")
+            await asyncio.sleep(delay)
+            for i, ticket in zip(failed, await self._send_all([messages[i] for i in failed])):
+                tickets[i] = ticket
+        return tickets
+
+    async def _send_all(self, messages: List[Dict[str, Any]]) -> List[PushTicket]:
+        chunks = [messages[i:i + self.batch_size] for i in range(0, len(messages), self.batch_size)]
+        results = await asyncio.gather(*(self._send_chunk(chunk) for chunk in chunks))
+        return [ticket for chunk in results for ticket in chunk]
 
 
+async def processNotification(notification: NotificationRequest, dispatcher: PushDispatcher, sound = "dym.wav", channel = "alarm") -> List[PushTicket]:
+    """Raises PushDeliveryError when messages never reached Expo, so the dispatch job is delivered again"""
+    tickets = await dispatcher.dispatch(notification, sound=sound, channel=channel)
+    undelivered = [ticket for ticket in tickets if ticket.retryable]
+    if undelivered:
+        raise PushDeliveryError(undelivered)
+    failed = [ticket.model_dump(exclude_none=True) for ticket in tickets if ticket.status != "ok"]
+    if failed:
+        # per token errors (e.g. DeviceNotRegistered) are final, sending again would not help
+        logger.warning(f"{len(failed)} of {len(tickets)} push messages failed", extra={"title": notification.title, "failed": failed})
+    else:
+        logger.info(f"Sent {len(tickets)} push messages", extra={"sample": "push", "title": notification.title})
+    return tickets
@@ -0,0 +1,149 @@
+import asyncio
+import uuid
+from typing import Any, Dict, Optional
+import logging
+
+import redis.asyncio as redis
+
+from ..heiman.heimanconnector import HeimanConnector
+from ..supaconnector.supaconnector import SupabaseDevicesClient, OWNER_COLUMNS
+from ..routing.alarmroutes import AlarmRouteStore
+from ..resilience.resilience import fresh_deadline
+
+logger = logging.getLogger(__name__)
+
+_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class RegistrationError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class DeviceRegistrar:
+    """Registers a device (product + MAC) for a user, taking it over from a previous owner if needed.
+
+    One Heiman lookup, one Supabase read, at most an unbind and a bind, and
+    one register_device RPC that swaps the row in a single transaction - five
+    upstream calls at most. A Redis lock per product and MAC turns a
+    double-tap or a second replica registering the same device into a 409
+    before any upstream is touched.
+
+    Once Heiman has bound the device the Supabase row and the alarm routes have
+    to follow, so those steps run shielded in their own task with a fresh
+    commit_timeout budget instead of what is left of the request deadline.
+    """
+
+    def __init__(self, heiman: HeimanConnector, supadevices: SupabaseDevicesClient, alarm_routes: AlarmRouteStore,
+                 lock_ttl: float = 30, commit_timeout: float = 10):
+        self.heiman = heiman
+        self.supadevices = supadevices
+        self.alarm_routes = alarm_routes
+        self.lock_ttl = lock_ttl
+        self.commit_timeout = commit_timeout
+        self.redis: Optional[redis.Redis] = None
+        self._release_lock = None
+
+    def attach(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self._release_lock = redis_client.register_script(_RELEASE_LOCK)
+
+    def _lock_key(self, product_id: str, mac: str) -> str:
+        return f"register_lock:{product_id}:{mac}"
+
+    async def _acquire(self, key: str) -> Optional[str]:
+        if self.redis is None:
+            return None
+        owner = uuid.uuid4().hex
+        try:
+            acquired = await self.redis.set(key, owner, px=int(self.lock_ttl * 1000), nx=True)
+        except redis.RedisError as e:
+            logger.warning(f"Redis unavailable for registration lock, registering without it: {e}")
+            return None
+        if not acquired:
+            raise RegistrationError(409, "REGISTRATION_IN_PROGRESS")
+        return owner
+
+    async def _release(self, key: str, owner: str):
+        try:
+            await self._release_lock(keys=[key], args=[owner])
+        except redis.RedisError as e:
+            logger.warning(f"Could not release registration lock {key}, it expires in {self.lock_ttl}s: {e}")
+
+    async def register(self, user_id: str, product_id: str, mac: str, name: str) -> Dict[str, Any]:
+        key = self._lock_key(product_id, mac)
+        owner = await self._acquire(key)
+        try:
+            return await self._register(user_id, product_id, mac, name)
+        finally:
+            if owner is not None:
+                await self._release(key, owner)
+
+    async def _register(self, user_id: str, product_id: str, mac: str, name: str) -> Dict[str, Any]:
+        queried = await self.heiman.nameByDevice(user_id, product_id, mac)
+        result = queried.get("result") if queried.get("message", None) == "success" else None
+        if not result:
+            raise RegistrationError(404, "DEVICE_NOT_FOUND")
+        device_id = result[0]["id"]
+
+        existing = await self.supadevices.get_device_by_device_id(device_id, OWNER_COLUMNS)
+        previous_owner = existing.get("user_id") if existing is not None else None
+        if existing is not None:
+            if previous_owner is None:
+                raise RegistrationError(400, "DEVICE_ALREADY_REGISTERED")
+            unbound = await self.heiman.unbind(previous_owner, device_id)
+            if unbound.get("message", None) != "success":
+                raise RegistrationError(400, "DEVICE_ALREADY_REGISTERED")
+
+        try:
+            bound = await self.heiman.bind(user_id, device_id)
+            if bound.get("message", None) != "success":
+                raise RegistrationError(500, f"Failed to bind device: {bound.get('message', 'unknown error')}")
+        except Exception:
+            if previous_owner is not None:
+                # unbound from the previous owner but bound to no one
+                await asyncio.shield(asyncio.ensure_future(self._restore(previous_owner, device_id)))
+            raise
+
+        commit = asyncio.ensure_future(self._commit(user_id, device_id, name, product_id, previous_owner))
+        return await asyncio.shield(commit)
+
+    async def _restore(self, previous_owner: str, device_id: str):
+        """Give the device back to its previous owner; if Heiman refuses, drop their row and route so
+        nothing claims a device that is not bound to anyone"""
+        with fresh_deadline(self.commit_timeout):
+            try:
+                rebound = await self.heiman.bind(previous_owner, device_id)
+                if rebound.get("message", None) == "success":
+                    logger.warning(f"Takeover of {device_id} failed, bound back to {previous_owner}")
+                    return
+                logger.error(f"Could not bind {device_id} back to {previous_owner}: {rebound.get('message')}")
+            except Exception as e:
+                logger.error(f"Could not bind {device_id} back to {previous_owner}: {e}")
+            try:
+                await self.supadevices.remove_device_from_user(previous_owner, device_id)
+                await self.alarm_routes.remove_device(previous_owner, device_id)
+            except Exception as e:
+                logger.error(f"Could not remove {device_id} from {previous_owner} after a failed takeover: {e}")
+
+    async def _commit(self, user_id: str, device_id: str, name: str, product_id: str,
+                      previous_owner: Optional[str]) -> Dict[str, Any]:
+        with fresh_deadline(self.commit_timeout):
+            try:
+                created = await self.supadevices.register_device(user_id, device_id, name, product_id, previous_owner)
+            except Exception as e:
+                if "DEVICE_OWNER_CHANGED" in str(e):
+                    raise RegistrationError(409, "DEVICE_OWNER_CHANGED")
+                raise
+
+            if previous_owner is not None:
+                await self.alarm_routes.remove_device(previous_owner, device_id)
+            await self.alarm_routes.put_device(user_id, device_id, created["uuid"], created.get("name"))
+            return created
@@ -0,0 +1,258 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+import logging
+
+from ..metrics.metrics import CIRCUIT_STATE, CIRCUIT_REJECTED, HEDGED_REQUESTS, DEADLINE_EXCEEDED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_deadline: ContextVar[Optional[float]] = ContextVar("upstream_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} circuit open, retry in {retry_after:.1f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Upstream calls made inside the block (and tasks started from it) must finish within seconds.
+
+    Nested deadlines only ever shorten the budget.
+    """
+    current = _deadline.get()
+    wanted = time.monotonic() + seconds
+    token = _deadline.set(wanted if current is None else min(current, wanted))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def fresh_deadline(seconds: Optional[float]):
+    """Replaces the request deadline inside the block, for the rest of a write chain whose first steps already
+    went through; None leaves each call to its upstream's own timeout"""
+    token = _deadline.set(None if seconds is None else time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures and fails fast for reset_timeout.
+
+    Then it goes half-open and lets half_open_probes calls through at a time;
+    one success closes it, one failure opens it again.
+    """
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30, half_open_probes: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+        self.opened = 0
+        CIRCUIT_STATE.set(0, name)
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+            self.state = state
+            CIRCUIT_STATE.set(self._STATE_VALUE[state], self.name)
+
+    def allow(self):
+        """Raises CircuitOpenError, otherwise the caller must report the outcome with record()"""
+        if self.state == self.OPEN:
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_timeout:
+                self.rejected += 1
+                CIRCUIT_REJECTED.inc(self.name)
+                raise CircuitOpenError(self.name, self.reset_timeout - waited)
+            self._transition(self.HALF_OPEN)
+            self.probes = 0
+        if self.state == self.HALF_OPEN:
+            if self.probes >= self.half_open_probes:
+                self.rejected += 1
+                CIRCUIT_REJECTED.inc(self.name)
+                raise CircuitOpenError(self.name, 0)
+            self.probes += 1
+
+    def record(self, ok: bool):
+        if self.state == self.HALF_OPEN:
+            self.probes = max(self.probes - 1, 0)
+        if ok:
+            self.failures = 0
+            self._transition(self.CLOSED)
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened += 1
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def release(self):
+        """The call was abandoned before it had an outcome"""
+        if self.state == self.HALF_OPEN:
+            self.probes = max(self.probes - 1, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures, "opened": self.opened,
+                "rejected": self.rejected}
+
+
+class Upstream:
+    """Timeout, circuit breaker and optional hedging around the calls to one upstream.
+
+    Each call gets min(timeout, what is left of the request deadline). With
+    hedge enabled, a read that has not answered after the hedge_quantile of
+    recent latencies gets a second identical attempt and the first answer wins.
+    """
+
+    def __init__(self, name: str, timeout: float = 10, breaker: Optional[CircuitBreaker] = None, hedge: bool = False,
+                 hedge_quantile: float = 0.95, hedge_min: float = 0.05, min_samples: int = 20, window: int = 200):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker(name)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _budget(self) -> float:
+        left = remaining()
+        if left is None:
+            return self.timeout
+        if left <= 0:
+            DEADLINE_EXCEEDED.inc(self.name)
+            raise DeadlineExceeded(f"No time left for {self.name}")
+        return min(self.timeout, left)
+
+    def hedge_delay(self) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return max(ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))], self.hedge_min)
+
+    async def call(self, attempt: Callable[[], Awaitable[T]], failed: Callable[[T], bool] = lambda result: False,
+                   hedge: bool = False) -> T:
+        """Run attempt (a fresh coroutine per call, so it can be hedged) under this upstream's policies.
+
+        failed marks results that count against the breaker without being exceptions, e.g. 5xx statuses.
+        """
+        budget = self._budget()
+        self.breaker.allow()
+        started = time.perf_counter()
+        try:
+            if hedge and self.hedge:
+                result = await self._hedged(attempt, budget)
+            else:
+                result = await asyncio.wait_for(attempt(), budget)
+        except asyncio.TimeoutError:
+            self.breaker.record(False)
+            DEADLINE_EXCEEDED.inc(self.name)
+            raise DeadlineExceeded(f"{self.name} did not answer within {budget:.2f}s")
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record(False)
+            raise
+        ok = not failed(result)
+        self.breaker.record(ok)
+        if ok and hedge:
+            # the hedge delay is a percentile of the reads alone, writes have their own latency profile
+            self._latencies.append(time.perf_counter() - started)
+        return result
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[T]], budget: float) -> T:
+        delay = self.hedge_delay()
+        if delay is None or delay >= budget:
+            return await asyncio.wait_for(attempt(), budget)
+
+        until = time.monotonic() + budget
+        first = asyncio.ensure_future(attempt())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result()
+
+            self.hedged += 1
+            HEDGED_REQUESTS.inc(self.name, "sent")
+            second = asyncio.ensure_future(attempt())
+            tasks.append(second)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                left = until - time.monotonic()
+                if left <= 0:
+                    raise asyncio.TimeoutError()
+                done, pending = await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                            HEDGED_REQUESTS.inc(self.name, "won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        return {
+            **self.breaker.stats(),
+            "timeout_s": self.timeout,
+            "hedge": self.hedge,
+            "hedge_after_ms": round(delay * 1000, 1) if self.hedge and delay is not None else None,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+class DeadlineMiddleware:
+    """Gives every HTTP request one deadline that all of its upstream calls share"""
+
+    def __init__(self, app, seconds: float = 10):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with deadline(self.seconds):
+            await self.app(scope, receive, send)
@@ -0,0 +1,131 @@
+import json
+from typing import Any, Dict, List, Optional
+import logging
+
+import redis.asyncio as redis
+from pydantic import BaseModel
+
+from ..supaconnector.supaconnector import SupabaseDevicesClient, ROUTE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Only touch the record if it is already there, so partial updates never create half a route
+_HSET_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], unpack(ARGV))
+    return 1
+end
+return 0
+"""
+
+
+class AlarmRoute(BaseModel):
+    device_uuid: str
+    device_name: Optional[str] = None
+    eflara: Optional[Dict[str, Any]] = None
+    tokens: List[str] = []
+
+
+class AlarmRouteStore:
+    """Denormalized alarm routing data kept in Redis by the write endpoints.
+
+    The device part lives in a hash keyed by (user, Heiman deviceId); push tokens
+    are per user, so they are stored once per user and read in the same
+    round trip. Supabase is only queried when either part is missing.
+    """
+
+    def __init__(self, supadevices: SupabaseDevicesClient, ttl: int = 7 * 24 * 3600):
+        self.supadevices = supadevices
+        self.ttl = ttl
+        self.redis: Optional[redis.Redis] = None
+        self._hset_if_exists = None
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self._hset_if_exists = redis_client.register_script(_HSET_IF_EXISTS)
+
+    def _device_key(self, user_id: str, device_id: str) -> str:
+        return f"alarm_route:{user_id}:{device_id}"
+
+    def _tokens_key(self, user_id: str) -> str:
+        return f"alarm_tokens:{user_id}"
+
+    def _device_fields(self, device_uuid: str, name: Optional[str], eflara: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        return {
+            "uuid": device_uuid,
+            "name": name or "",
+            "eflara": json.dumps(eflara) if eflara else "",
+        }
+
+    def _route(self, device: Dict[str, str], tokens: List[str]) -> AlarmRoute:
+        return AlarmRoute(
+            device_uuid=device["uuid"],
+            device_name=device.get("name") or None,
+            eflara=json.loads(device["eflara"]) if device.get("eflara") else None,
+            tokens=tokens,
+        )
+
+    async def get(self, user_id: str, device_id: str) -> Optional[AlarmRoute]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._device_key(user_id, device_id))
+            pipe.get(self._tokens_key(user_id))
+            device, tokens = await pipe.execute()
+
+        if device and tokens is not None:
+            self.hits += 1
+            return self._route(device, json.loads(tokens))
+
+        self.misses += 1
+        logger.info(f"Alarm route for {user_id}/{device_id} not cached, loading from Supabase")
+
+        if not device:
+            fetched = await self.supadevices.get_device_by_user_device_id(user_id, device_id, ROUTE_COLUMNS)
+            if fetched is None:
+                return None
+            eflara = await self.supadevices.get_eflara_for_device(fetched["uuid"])
+            eflara = {"address": eflara["address"], "enabled": eflara["enabled"]} if eflara else None
+            await self.put_device(user_id, device_id, fetched["uuid"], fetched.get("name"), eflara)
+            device = self._device_fields(fetched["uuid"], fetched.get("name"), eflara)
+
+        if tokens is None:
+            tokenList = await self.refresh_tokens(user_id)
+        else:
+            tokenList = json.loads(tokens)
+
+        return self._route(device, tokenList)
+
+    async def put_device(self, user_id: str, device_id: str, device_uuid: str, name: Optional[str],
+                         eflara: Optional[Dict[str, Any]] = None):
+        key = self._device_key(user_id, device_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=self._device_fields(device_uuid, name, eflara))
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def set_name(self, user_id: str, device_id: str, name: str):
+        await self._hset_if_exists(keys=[self._device_key(user_id, device_id)], args=["name", name])
+
+    async def set_eflara(self, user_id: str, device_id: str, address: str, enabled: bool):
+        eflara = json.dumps({"address": address, "enabled": enabled})
+        await self._hset_if_exists(keys=[self._device_key(user_id, device_id)], args=["eflara", eflara])
+
+    async def remove_device(self, user_id: str, device_id: str):
+        await self.redis.delete(self._device_key(user_id, device_id))
+
+    async def refresh_tokens(self, user_id: str) -> List[str]:
+        notifications = await self.supadevices.get_notification_tokens_for_user(user_id)
+        tokens = [item["token"] for item in notifications if item.get("token") is not None]
+        await self.redis.set(self._tokens_key(user_id), json.dumps(tokens), ex=self.ttl)
+        return tokens
+
+    async def forget_user(self, user_id: str):
+        keys = [self._tokens_key(user_id)]
+        async for key in self.redis.scan_iter(match=self._device_key(user_id, "*")):
+            keys.append(key)
+        await self.redis.delete(*keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,107 @@
+import json
+from typing import Any, List, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import NoScriptError
+from pydantic import BaseModel
+
+from .alarmroutes import AlarmRoute, AlarmRouteStore
+
+# KEYS[1] message dedup lock, KEYS[2] route hash, KEYS[3] user tokens
+# ARGV[1] dedup ttl, ARGV[2] smoke lock key prefix, ARGV[3] smoke lock ttl, ARGV[4] "1" to take the smoke lock
+#
+# Returns {0} for a duplicate, otherwise {1, route hash fields, tokens json or false, smoke}
+# where smoke is 1/0 for taken/already held and -1 when not requested or the route/tokens are not
+# cached (the caller then takes it itself, after its own unknown device / no tokens checks).
+# The smoke lock key is derived from the cached device uuid, so it cannot be declared in KEYS;
+# fine on our single Redis, not cluster safe.
+EVENT_GATE_SCRIPT = """
+if not redis.call('SET', KEYS[1], '1', 'EX', ARGV[1], 'NX') then
+    return {0}
+end
+local route = redis.call('HGETALL', KEYS[2])
+local tokens = redis.call('GET', KEYS[3])
+local smoke = -1
+if ARGV[4] == '1' and #route > 0 and tokens and tokens ~= '[]' then
+    for i = 1, #route, 2 do
+        if route[i] == 'uuid' then
+            if redis.call('SET', ARGV[2] .. route[i + 1], '1', 'EX', ARGV[3], 'NX') then
+                smoke = 1
+            else
+                smoke = 0
+            end
+        end
+    end
+end
+return {1, route, tokens, smoke}
+"""
+
+EVENT_LOCK_TTL = 60 * 10
+SMOKE_LOCK_TTL = 60 * 60
+
+
+class EventDecision(BaseModel):
+    acquired: bool
+    route: Optional[AlarmRoute] = None
+    smokeLock: Optional[bool] = None
+
+
+class EventGate:
+    """Dedup lock, cached alarm route and smoke repeat lock for an event in one EVALSHA"""
+
+    def __init__(self, routes: AlarmRouteStore):
+        self.routes = routes
+        self.redis: Optional[redis.Redis] = None
+        self.sha: Optional[str] = None
+
+    async def load(self, redis_client: redis.Redis):
+        self.redis = redis_client
+        self.sha = await redis_client.script_load(EVENT_GATE_SCRIPT)
+
+    @staticmethod
+    def lock_key(user: str, messageId: str) -> str:
+        return f"event_lock_{user}_{messageId}"
+
+    def _args(self, user: str, deviceId: str, messageId: str, eventName: str) -> List[Any]:
+        userID = user.replace("SH_", "", 1)
+        keys = [
+            self.lock_key(user, messageId),
+            self.routes._device_key(userID, deviceId),
+            self.routes._tokens_key(userID),
+        ]
+        argv = [EVENT_LOCK_TTL, f"smoke_event_lock_{user}_", SMOKE_LOCK_TTL, "1" if eventName == "SmokeCheckAlarm" else "0"]
+        return [self.sha, len(keys), *keys, *argv]
+
+    def _decision(self, reply: List[Any]) -> EventDecision:
+        if not reply[0]:
+            return EventDecision(acquired=False)
+
+        _, flat, tokens, smoke = reply
+        route = None
+        if flat and tokens is not None:
+            route = self.routes._route(dict(zip(flat[::2], flat[1::2])), json.loads(tokens))
+        return EventDecision(acquired=True, route=route, smokeLock=None if smoke == -1 else bool(smoke))
+
+    async def check(self, user: str, deviceId: str, messageId: str, eventName: str) -> EventDecision:
+        try:
+            reply = await self.redis.evalsha(*self._args(user, deviceId, messageId, eventName))
+        except NoScriptError:
+            # Redis restarted and lost its script cache - load again and retry
+            await self.load(self.redis)
+            reply = await self.redis.evalsha(*self._args(user, deviceId, messageId, eventName))
+        return self._decision(reply)
+
+    async def check_many(self, events: List[Any]) -> List[EventDecision]:
+        """check() for a batch of EventPayloads in one pipelined round trip"""
+        for attempt in range(2):
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for event in events:
+                        pipe.evalsha(*self._args(event.user, event.deviceId, event.messageId, event.eventName))
+                    replies = await pipe.execute()
+                return [self._decision(reply) for reply in replies]
+            except NoScriptError:
+                if attempt == 1:
+                    raise
+                # NOSCRIPT fails before the script body runs, so re-sending the batch is safe
+                await self.load(self.redis)
@@ -1,16 +1,36 @@
-import aiohttp
 import json
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import logging
+from ..httppool.httppool import HttpPool
+from ..cache.twotiercache import TwoTierCache
+from ..metrics.metrics import timed, UPSTREAM_SECONDS, UPSTREAM_RESPONSES, UPSTREAM_RESPONSE_BYTES
+from ..resilience.resilience import Upstream
 
 logger = logging.getLogger(__name__)
 
+# Columns each use case actually reads, so a lookup never pulls (and parses) more of the row than its caller needs
+LIST_COLUMNS = "created_at,uuid,internal_product_id,name"
+STATUS_COLUMNS = "uuid,name,internal_device_id,device_eflara(enabled)"
+DEVICE_COLUMNS = "internal_device_id,internal_product_id,name"
+DEVICE_INFO_COLUMNS = "user_id,internal_device_id,internal_product_id,name,device_eflara(address,enabled)"
+DEVICE_ROW_COLUMNS = "internal_device_id,internal_product_id,name,user_id,uuid"
+OWNER_COLUMNS = "user_id"
+ROUTE_COLUMNS = "uuid,name"
+EFLARA_COLUMNS = "address,enabled"
+TOKEN_COLUMNS = "token"
 
+
+# Timed per PostgREST round trip in _send rather than per public method, so lookups served from the cache
+# don't show up as Supabase latency
 class SupabaseDevicesClient:
-    def __init__(self, supabase_url: str, service_role_key: str):
+    def __init__(self, supabase_url: str, service_role_key: str, pool: HttpPool, cache: Optional[TwoTierCache] = None,
+                 upstream: Optional[Upstream] = None):
         self.supabase_url = supabase_url.rstrip('/')
         self.service_role_key = service_role_key
+        self.pool = pool
+        self.cache = cache
+        self.upstream = upstream or Upstream("supabase")
         self.base_url = f"{self.supabase_url}/rest/v1"
 
         # Default headers for all requests
@@ -21,28 +41,80 @@ class SupabaseDevicesClient:
             "Prefer": "return=representation"  # Return inserted/updated data
         }
 
-    async def _make_request(self, method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
-        """Make HTTP request to Supabase"""
+    async def _send(self, method: str, endpoint: str, prefer: Optional[str] = None, **kwargs) -> Tuple[str, Optional[int]]:
+        """One PostgREST round trip; (body, total rows from Content-Range if prefer asked for count=exact)"""
         url = f"{self.base_url}/{endpoint}"
         headersToSend = self.headers.copy()
+        if prefer is not None:
+            headersToSend["Prefer"] = prefer
 
         # merge headers if kwargs
         if 'headers' in kwargs:
             headers = kwargs.pop('headers')
-            merged_headers = {**self.headers, **headers}
+            merged_headers = {**headersToSend, **headers}
             headersToSend = merged_headers
 
-        async with aiohttp.ClientSession() as session:
-            async with session.request(method, url, headers=headersToSend, **kwargs) as response:
-                response_text = await response.text()
+        async def attempt():
+            async with self.pool.session(url).request(method, url, headers=headersToSend, **kwargs) as response:
+                UPSTREAM_RESPONSES.inc("supabase", str(response.status))
+                return response.status, await response.text(), response.headers.get("Content-Range")
 
-                if response.status >= 400:
-                    logger.error(f"Request failed: {method} {url} - {response.status}: {response_text}")
-                    raise Exception(f"Supabase API error: {response.status} - {response_text}")
+        resource = endpoint.split("?", 1)[0]
+        with timed(UPSTREAM_SECONDS, "supabase", f"{method} {resource}"):
+            # PostgREST reads are idempotent and may be hedged
+            status, response_text, content_range = await self.upstream.call(
+                attempt, failed=lambda result: result[0] >= 500, hedge=method in ("GET", "HEAD"))
 
-                if response_text:
-                    return json.loads(response_text)
-                return {}
+            UPSTREAM_RESPONSE_BYTES.inc("supabase", resource, amount=len(response_text))
+            if status >= 400:
+                logger.error(f"Request failed: {method} {url} - {status}: {response_text}")
+                raise Exception(f"Supabase API error: {status} - {response_text}")
+
+        # "0-4/5", or "*/5" when no rows came back
+        total = content_range.rpartition("/")[2] if content_range else "*"
+        return response_text, int(total) if total.isdigit() else None
+
+    async def _make_request(self, method: str, endpoint: str, prefer: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Make HTTP request to Supabase"""
+        response_text, _ = await self._send(method, endpoint, prefer, **kwargs)
+        if response_text:
+            return json.loads(response_text)
+        return {}
+
+    async def _upsert(self, table: str, rows: List[Dict[str, Any]], on_conflict: str, ignore_duplicates: bool = False,
+                      select: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """INSERT ... ON CONFLICT (on_conflict) in one round trip; only returns the select columns if asked for"""
+        resolution = "ignore-duplicates" if ignore_duplicates else "merge-duplicates"
+        if select is None:
+            await self._make_request("POST", f"{table}?on_conflict={on_conflict}",
+                                     prefer=f"resolution={resolution},return=minimal", json=rows)
+            return None
+        return await self._make_request("POST", f"{table}?on_conflict={on_conflict}&select={select}",
+                                        prefer=f"resolution={resolution},return=representation", json=rows)
+
+    async def _update_rows(self, table: str, filters: str, updates: Dict[str, Any]) -> int:
+        """PATCH without a response body; the number of rows it matched"""
+        _, count = await self._send("PATCH", f"{table}?{filters}", prefer="return=minimal,count=exact", json=updates)
+        return count or 0
+
+    async def _delete_rows(self, table: str, filters: str, select: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """DELETE matching filters; (rows deleted, their select columns if asked for)"""
+        if select is None:
+            _, count = await self._send("DELETE", f"{table}?{filters}", prefer="return=minimal,count=exact")
+            return count or 0, []
+        response_text, count = await self._send("DELETE", f"{table}?{filters}&select={select}",
+                                                prefer="return=representation,count=exact")
+        rows = json.loads(response_text) if response_text else []
+        return (len(rows) if count is None else count), rows
+
+    async def _exists(self, table: str, filters: str) -> bool:
+        """HEAD with count=exact: the answer is a Content-Range header, there is no body to parse"""
+        _, count = await self._send("HEAD", f"{table}?{filters}&limit=1", prefer="count=exact")
+        return bool(count)
+
+    async def ping(self):
+        """Cheapest PostgREST round trip that still goes through auth and the database"""
+        await self._make_request("HEAD", "devices", params={"select": "uuid", "limit": "1"})
 
     async def add_device_for_user(self, user_id: str, device_id: str, name: str, product_id: str) -> Dict[str, Any]:
         device_data = {
@@ -64,7 +136,9 @@ class SupabaseDevicesClient:
 
             if result:
                 logger.info(f"Device {device_id} added successfully")
-                return result[0] if isinstance(result, list) else result
+                created = result[0] if isinstance(result, list) else result
+                await self._invalidate_device(user_id, created.get("uuid"))
+                return created
             else:
                 raise Exception("No data returned from insert operation")
 
@@ -72,21 +146,49 @@ class SupabaseDevicesClient:
             logger.error(f"Failed to add device: {e}")
             raise
 
+    async def register_device(self, user_id: str, device_id: str, name: str, product_id: str,
+                              previous_owner: Optional[str] = None) -> Dict[str, Any]:
+        """Replace the device's row with a new one for user_id in one transaction.
+
+        See supabase/migrations/*_register_device.sql; the RPC refuses with
+        DEVICE_OWNER_CHANGED if the device no longer belongs to previous_owner.
+        """
+        logger.info(f"Registering device {device_id} for user {user_id} (previous owner {previous_owner})")
+
+        try:
+            result = await self._make_request(
+                "POST",
+                "rpc/register_device",
+                json={
+                    "p_user_id": user_id,
+                    "p_device_id": device_id,
+                    "p_name": name,
+                    "p_product_id": product_id,
+                    "p_previous_owner": previous_owner,
+                }
+            )
+        except Exception as e:
+            logger.error(f"Failed to register device: {e}")
+            raise
+
+        for row in result.get("previous") or []:
+            await self._invalidate_device(row["user_id"], row.get("uuid"))
+        created = result["device"]
+        await self._invalidate_device(user_id, created.get("uuid"))
+        return created
+
     async def remove_device_from_user(self, user_id: str, device_id: str) -> bool:
         logger.info(f"Removing device {device_id} from user {user_id}")
 
         try:
-            # First check if device exists for this user
-            existing_device = await self.check_device_exists(user_id, device_id)
-            if not existing_device:
+            # the row count says whether there was anything to delete, no need to look first
+            count, deleted = await self._delete_rows(
+                "devices", f"user_id=eq.{user_id}&internal_device_id=eq.{device_id}", select="uuid")
+            if count == 0:
                 logger.warning(f"Device {device_id} not found for user {user_id}")
                 return False
-
-            # Delete the device
-            await self._make_request(
-                "DELETE",
-                f"devices?user_id=eq.{user_id}&internal_device_id=eq.{device_id}"
-            )
+            for row in deleted:
+                await self._invalidate_device(user_id, row.get("uuid"))
 
             logger.info(f"Device {device_id} removed successfully")
             return True
@@ -95,11 +197,39 @@ class SupabaseDevicesClient:
             logger.error(f"Failed to remove device: {e}")
             raise
 
+    async def _invalidate_device(self, user_id: str, device_uuid: Optional[str]):
+        if self.cache is None or device_uuid is None:
+            return
+        await self.cache.invalidate("device", user_id, device_uuid)
+        await self.cache.invalidate("device_info", device_uuid)
+        await self.cache.invalidate("eflara", device_uuid)
+
+    async def _cached_device_uuids(self, user_id: str) -> List[str]:
+        if self.cache is None:
+            return []
+        try:
+            result = await self._make_request("GET", f"devices?user_id=eq.{user_id}&select=uuid")
+        except Exception as e:
+            logger.warning(f"Could not list devices of {user_id}, their cache entries expire on their own: {e}")
+            return []
+        return [row["uuid"] for row in result or []]
+
+    async def _invalidate_eflara(self, device_uuid: str):
+        if self.cache is None:
+            return
+        await self.cache.invalidate("device_info", device_uuid)
+        await self.cache.invalidate("eflara", device_uuid)
+
     async def get_device_by_uuid(self, user_id, uuid: str) -> Optional[Dict[str, Any]]:
+        if self.cache is not None:
+            return await self.cache.get_or_load("device", (user_id, uuid), lambda: self._get_device_by_uuid(user_id, uuid))
+        return await self._get_device_by_uuid(user_id, uuid)
+
+    async def _get_device_by_uuid(self, user_id, uuid: str) -> Optional[Dict[str, Any]]:
         try:
             result = await self._make_request(
                 "GET",
-                f"devices?user_id=eq.{user_id}&uuid=eq.{uuid}&select=internal_device_id,internal_product_id,name"
+                f"devices?user_id=eq.{user_id}&uuid=eq.{uuid}&select={DEVICE_COLUMNS}&limit=1"
             )
 
             if result and len(result) > 0:
@@ -110,26 +240,56 @@ class SupabaseDevicesClient:
             logger.error(f"Failed to get device by UUID: {e}")
             raise
 
-    async def get_device_by_device_id(self, device_id: str) -> Optional[Dict[str, Any]]:
+    async def get_device_with_eflara(self, user_id: str, uuid: str) -> Optional[Dict[str, Any]]:
+        """Device row with its eflara config embedded, fetched in a single request"""
+        if self.cache is not None:
+            device = await self.cache.get_or_load("device_info", (uuid,), lambda: self._get_device_with_eflara(uuid))
+        else:
+            device = await self._get_device_with_eflara(uuid)
+
+        if device is None or device["user_id"] != user_id:
+            return None
+        return device
+
+    async def _get_device_with_eflara(self, uuid: str) -> Optional[Dict[str, Any]]:
         try:
             result = await self._make_request(
                 "GET",
-                f"devices?internal_device_id=eq.{device_id}&select=internal_device_id,internal_product_id,name,user_id,uuid"
+                f"devices?uuid=eq.{uuid}&select={DEVICE_INFO_COLUMNS}&limit=1"
             )
 
-            if result and len(result) > 0:
-                return result[0]
-            return None
+            if not result or len(result) == 0:
+                return None
+
+            device = result[0]
+            # Embedded resource comes back as an object or a list depending on the FK uniqueness
+            eflara = device.pop("device_eflara", None)
+            if isinstance(eflara, list):
+                eflara = eflara[0] if eflara else None
+            device["eflara"] = eflara
+            return device
 
         except Exception as e:
-            logger.error(f"Failed to get device by device ID: {e}")
+            logger.error(f"Failed to get device with eflara: {e}")
             raise
 
-    async def get_device_by_user_device_id(self, user: str, device_id: str) -> Optional[Dict[str, Any]]:
+    def peek_device_id(self, user_id: str, uuid: str) -> Optional[str]:
+        """internal_device_id for uuid if this replica already has it in memory"""
+        if self.cache is None:
+            return None
+        device = self.cache.peek("device_info", uuid)
+        if device is not None and device["user_id"] == user_id:
+            return device["internal_device_id"]
+        device = self.cache.peek("device", user_id, uuid)
+        if device is not None:
+            return device["internal_device_id"]
+        return None
+
+    async def get_device_by_device_id(self, device_id: str, select: str = DEVICE_ROW_COLUMNS) -> Optional[Dict[str, Any]]:
         try:
             result = await self._make_request(
                 "GET",
-                f"devices?internal_device_id=eq.{device_id}&user_id=eq.{user}&select=internal_device_id,internal_product_id,name,user_id,uuid"
+                f"devices?internal_device_id=eq.{device_id}&select={select}&limit=1"
             )
 
             if result and len(result) > 0:
@@ -140,37 +300,36 @@ class SupabaseDevicesClient:
             logger.error(f"Failed to get device by device ID: {e}")
             raise
 
-    async def check_device_exists_in_the_system(self, device_id: str) -> Optional[Dict[str, Any]]:
+    async def get_device_by_user_device_id(self, user: str, device_id: str, select: str = DEVICE_ROW_COLUMNS) -> Optional[Dict[str, Any]]:
         try:
             result = await self._make_request(
                 "GET",
-                f"devices?internal_device_id=eq.{device_id}&select=*"
+                f"devices?internal_device_id=eq.{device_id}&user_id=eq.{user}&select={select}&limit=1"
             )
 
             if result and len(result) > 0:
-                logger.info(f"Device {device_id} found")
                 return result[0]
-            else:
-                logger.info(f"Device {device_id} not")
-                return None
+            return None
 
         except Exception as e:
-            logger.error(f"Failed to check device existence: {e}")
+            logger.error(f"Failed to get device by device ID: {e}")
             raise
 
-    async def check_device_exists(self, user_id: str, device_id: str) -> Optional[Dict[str, Any]]:
+    async def check_device_exists_in_the_system(self, device_id: str) -> bool:
         try:
-            result = await self._make_request(
-                "GET",
-                f"devices?user_id=eq.{user_id}&internal_device_id=eq.{device_id}&select=*"
-            )
+            exists = await self._exists("devices", f"internal_device_id=eq.{device_id}")
+            logger.info(f"Device {device_id} {'found' if exists else 'not found'}")
+            return exists
 
-            if result and len(result) > 0:
-                logger.info(f"Device {device_id} found for user {user_id}")
-                return result[0]
-            else:
-                logger.info(f"Device {device_id} not found for user {user_id}")
-                return None
+        except Exception as e:
+            logger.error(f"Failed to check device existence: {e}")
+            raise
+
+    async def check_device_exists(self, user_id: str, device_id: str) -> bool:
+        try:
+            exists = await self._exists("devices", f"user_id=eq.{user_id}&internal_device_id=eq.{device_id}")
+            logger.info(f"Device {device_id} {'found' if exists else 'not found'} for user {user_id}")
+            return exists
 
         except Exception as e:
             logger.error(f"Failed to check device existence: {e}")
@@ -182,7 +341,7 @@ class SupabaseDevicesClient:
 
         try:
             # Build query string
-            query_params = [f"user_id=eq.{user_id}", "select=created_at,uuid,internal_product_id,internal_device_id,name"]
+            query_params = [f"user_id=eq.{user_id}", f"select={LIST_COLUMNS}"]
 
             # Add ordering
             query_params.append("order=created_at.desc")
@@ -207,31 +366,47 @@ class SupabaseDevicesClient:
             logger.error(f"Failed to list devices: {e}")
             raise
 
-    async def update_device(self, user_id: str, device_uuid: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        logger.info(f"Updating device {device_uuid} for user {user_id}")
-
+    async def list_devices_with_eflara(self, user_id: str) -> List[Dict[str, Any]]:
+        """All devices of a user with their eflara flag, in a single request"""
         try:
             result = await self._make_request(
-                "PATCH",
-                f"devices?user_id=eq.{user_id}&uuid=eq.{device_uuid}",
-                json=updates
+                "GET",
+                f"devices?user_id=eq.{user_id}&select={STATUS_COLUMNS}&order=created_at.desc"
             )
 
-            if result:
+            devices = result if result else []
+            for device in devices:
+                eflara = device.pop("device_eflara", None)
+                if isinstance(eflara, list):
+                    eflara = eflara[0] if eflara else None
+                device["eflara_enabled"] = bool(eflara and eflara.get("enabled"))
+            return devices
+
+        except Exception as e:
+            logger.error(f"Failed to list devices with eflara: {e}")
+            raise
+
+    async def update_device(self, user_id: str, device_uuid: str, updates: Dict[str, Any]) -> bool:
+        logger.info(f"Updating device {device_uuid} for user {user_id}")
+
+        try:
+            updated = await self._update_rows("devices", f"user_id=eq.{user_id}&uuid=eq.{device_uuid}", updates)
+
+            await self._invalidate_device(user_id, device_uuid)
+
+            if updated:
                 logger.info(f"Device {device_uuid} updated successfully")
-                return result[0] if isinstance(result, list) else result
-            else:
-                return None
+            return updated > 0
 
         except Exception as e:
             logger.error(f"Failed to update device: {e}")
             raise
 
-    async def get_device_by_id(self, device_id: str) -> Optional[Dict[str, Any]]:
+    async def get_device_by_id(self, device_id: str, select: str = DEVICE_ROW_COLUMNS) -> Optional[Dict[str, Any]]:
         try:
             result = await self._make_request(
                 "GET",
-                f"devices?internal_device_id=eq.{device_id}&select=*"
+                f"devices?internal_device_id=eq.{device_id}&select={select}&limit=1"
             )
 
             if result and len(result) > 0:
@@ -246,7 +421,7 @@ class SupabaseDevicesClient:
         try:
             result = await self._make_request(
                 "GET",
-                f"notifications?user_id=eq.{user_id}&select=*"
+                f"notifications?user_id=eq.{user_id}&select={TOKEN_COLUMNS}"
             )
 
             if result:
@@ -257,44 +432,32 @@ class SupabaseDevicesClient:
             logger.error(f"Failed to get notification tokens: {e}")
             raise
 
-    async def add_notification_token(self, current_user: str, token: str) -> Dict[str, Any]:
+    async def add_notification_token(self, current_user: str, token: str) -> None:
         logger.info(f"Adding/updating notification token for user {current_user}")
 
         try:
-            token_data = {
-                "user_id": current_user,
-                "token": token
-            }
-
-            result = await self._make_request(
-                "POST",
-                "notifications",
-                json=token_data
-            )
-
-            print(result)
-
-            if result:
-                logger.info(f"Notification token added/updated successfully for user {current_user}")
-                return result[0] if isinstance(result, list) else result
-            else:
-                raise Exception("No data returned from upsert operation")
+            # a token the user already has is left as it is (unique_user_token)
+            await self._upsert("notifications", [{"user_id": current_user, "token": token}], on_conflict="user_id,token",
+                               ignore_duplicates=True)
+            logger.info(f"Notification token added/updated successfully for user {current_user}")
 
         except Exception as e:
-            if "23505" in str(e) and "unique_user_token" in str(e):
-                logger.info(f"Notification token for user {current_user} already exists, skipping insert.")
-                return None
             logger.error(f"Failed to add notification token: {e}")
             raise
 
     async def get_eflara_for_device(self, device_uuid: str) -> Optional[Dict[str, Any]]:
         """Get eflara configuration for a device by its UUID"""
+        if self.cache is not None:
+            return await self.cache.get_or_load("eflara", (device_uuid,), lambda: self._get_eflara_for_device(device_uuid))
+        return await self._get_eflara_for_device(device_uuid)
+
+    async def _get_eflara_for_device(self, device_uuid: str) -> Optional[Dict[str, Any]]:
         logger.info(f"Getting eflara config for device {device_uuid}")
 
         try:
             result = await self._make_request(
                 "GET",
-                f"device_eflara?device_uuid=eq.{device_uuid}&select=*"
+                f"device_eflara?device_uuid=eq.{device_uuid}&select={EFLARA_COLUMNS}&limit=1"
             )
 
             if result and len(result) > 0:
@@ -308,72 +471,34 @@ class SupabaseDevicesClient:
             logger.error(f"Failed to get eflara config for device {device_uuid}: {e}")
             raise
 
-    async def set_eflara_for_device(self, device_uuid: str, address: str, enabled: bool) -> Dict[str, Any]:
+    async def set_eflara_for_device(self, device_uuid: str, address: str, enabled: bool) -> None:
         """Set/update eflara address for a device"""
         logger.info(f"Setting eflara address for device {device_uuid} to {address}")
 
         try:
-            # Check if eflara config already exists for this device
-            existing_config = await self.get_eflara_for_device(device_uuid)
-
-            if existing_config:
-                # Update existing config
-                updates = {"address": address, "enabled": enabled}
-                result = await self._make_request(
-                    "PATCH",
-                    f"device_eflara?device_uuid=eq.{device_uuid}",
-                    json=updates
-                )
-                logger.info(f"Eflara address updated for device {device_uuid}")
-            else:
-                # Create new config
-                eflara_data = {
-                    "device_uuid": device_uuid,
-                    "address": address,
-                    "enabled": enabled
-                }
-
-                result = await self._make_request(
-                    "POST",
-                    "device_eflara",
-                    json=[eflara_data]
-                )
-                logger.info(f"Eflara config created for device {device_uuid}")
-
-            if result:
-                return result[0] if isinstance(result, list) else result
-            else:
-                raise Exception("No data returned from operation")
+            # one row per device (device_eflara_device_uuid_key), so insert and update are the same upsert
+            await self._upsert("device_eflara", [{"device_uuid": device_uuid, "address": address, "enabled": enabled}],
+                               on_conflict="device_uuid")
+            await self._invalidate_eflara(device_uuid)
+            logger.info(f"Eflara config set for device {device_uuid}")
 
         except Exception as e:
             logger.error(f"Failed to set eflara address for device {device_uuid}: {e}")
             raise
 
-    async def toggle_eflara_for_device(self, device_uuid: str, new_status: bool) -> Optional[Dict[str, Any]]:
-        """Toggle enabled status for eflara configuration of a device"""
+    async def toggle_eflara_for_device(self, device_uuid: str, new_status: bool) -> bool:
+        """Toggle enabled status for eflara configuration of a device; False if it has none"""
         logger.info(f"Toggling eflara status for device {device_uuid} to {new_status}")
 
         try:
-            # Check if eflara config exists for this device
-            existing_config = await self.get_eflara_for_device(device_uuid)
-
-            if not existing_config:
+            updated = await self._update_rows("device_eflara", f"device_uuid=eq.{device_uuid}", {"enabled": new_status})
+            if not updated:
                 logger.warning(f"No eflara config found for device {device_uuid}")
-                return None
-
-            # Update the enabled status
-            updates = {"enabled": new_status}
-            result = await self._make_request(
-                "PATCH",
-                f"device_eflara?device_uuid=eq.{device_uuid}",
-                json=updates
-            )
+                return False
 
-            if result:
-                logger.info(f"Eflara status toggled to {new_status} for device {device_uuid}")
-                return result[0] if isinstance(result, list) else result
-            else:
-                return None
+            await self._invalidate_eflara(device_uuid)
+            logger.info(f"Eflara status toggled to {new_status} for device {device_uuid}")
+            return True
 
         except Exception as e:
             logger.error(f"Failed to toggle eflara status for device {device_uuid}: {e}")
@@ -382,7 +507,10 @@ class SupabaseDevicesClient:
     async def delete_user_account(self, user_id: str, should_soft_delete: bool = False) -> Dict[str, Any]:
         """Delete a user account - related data will be automatically deleted by CASCADE"""
         logger.info(f"Deleting user account {user_id}")
-        
+
+        # the rows are gone after the delete, so find out what is cached for them first
+        device_uuids = await self._cached_device_uuids(user_id)
+
         try:
             # Use Supabase Auth Admin API to delete user
             # This will trigger CASCADE deletion of related data
@@ -394,22 +522,29 @@ class SupabaseDevicesClient:
             
             delete_body = {"should_soft_delete": should_soft_delete}
             
-            async with aiohttp.ClientSession() as session:
-                async with session.delete(
-                    f"{self.supabase_url}/auth/v1/admin/users/{user_id}",
+            url = f"{self.supabase_url}/auth/v1/admin/users/{user_id}"
+
+            async def attempt():
+                async with self.pool.session(url).delete(
+                    url,
                     headers=auth_headers,
                     json=delete_body
                 ) as response:
-                    
-                    if response.status >= 400:
-                        error_text = await response.text()
-                        raise Exception(f"Failed to delete user: {response.status} - {error_text}")
-                    
-                    logger.info(f"User {user_id} deleted successfully")
-                    return {
-                        "status": "success", 
-                        "detail": f"User account {user_id} deleted successfully"
-                    }
+                    UPSTREAM_RESPONSES.inc("supabase_auth", str(response.status))
+                    return response.status, await response.text()
+
+            with timed(UPSTREAM_SECONDS, "supabase", "DELETE auth/admin/users"):
+                status, error_text = await self.upstream.call(attempt, failed=lambda result: result[0] >= 500)
+                if status >= 400:
+                    raise Exception(f"Failed to delete user: {status} - {error_text}")
+
+            logger.info(f"User {user_id} deleted successfully")
+            for device_uuid in device_uuids:
+                await self._invalidate_device(user_id, device_uuid)
+            return {
+                "status": "success",
+                "detail": f"User account {user_id} deleted successfully"
+            }
             
         except Exception as e:
             logger.error(f"Failed to delete user account {user_id}: {e}")
@@ -1,72 +1,172 @@
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+import asyncio
 import base64
-import requests
+import time
+import aiohttp
 from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
 import logging
 from fastapi import FastAPI, HTTPException, Depends, Security
+from ..httppool.httppool import HttpPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class JWKSClient:
-    def __init__(self, jwks_url: str, cache_duration: int = 3600):
+    """Async JWKS cache.
+
+    Keys are refreshed by a background task shortly before they expire. Once
+    expired they are still served while a refresh runs (stale-while-revalidate),
+    concurrent refreshes share a single fetch and an unknown kid triggers at most
+    one refetch per min_refetch_interval.
+    """
+
+    def __init__(self, jwks_url: str, pool: HttpPool, cache_duration: int = 3600, refresh_ahead: int = 300,
+                 min_refetch_interval: int = 30, fetch_timeout: float = 5):
         self.jwks_url = jwks_url
+        self.pool = pool
         self.cache_duration = cache_duration
+        self.refresh_ahead = min(refresh_ahead, cache_duration / 2)
+        self.min_refetch_interval = min_refetch_interval
+        self.fetch_timeout = aiohttp.ClientTimeout(total=fetch_timeout)
         self._jwks_cache = None
         self._cache_timestamp = None
+        self._inflight: Optional[asyncio.Task] = None
+        self._last_failure = None
+        self._last_forced_refetch = None
+        self._background: Optional[asyncio.Task] = None
+        self._key_cache: Dict[str, Any] = {}
+        self.key_cache_hits = 0
+        self.key_cache_misses = 0
+
+    def _age(self) -> float:
+        if self._cache_timestamp is None:
+            return float("inf")
+        return time.monotonic() - self._cache_timestamp
+
+    def _is_stale(self) -> bool:
+        return self._age() > self.cache_duration
+
+    async def _fetch(self) -> Dict[str, Any]:
+        async with self.pool.session(self.jwks_url).get(self.jwks_url, timeout=self.fetch_timeout) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _do_refresh(self) -> Dict[str, Any]:
+        try:
+            jwks = await self._fetch()
+            if jwks != self._jwks_cache:
+                self._key_cache = {}
+            self._jwks_cache = jwks
+            self._cache_timestamp = time.monotonic()
+            self._last_failure = None
+            logger.info("JWKS cache refreshed")
+        except Exception as e:
+            self._last_failure = time.monotonic()
+            logger.error(f"Failed to fetch JWKS: {e}")
+            if self._jwks_cache is None:
+                raise HTTPException(status_code=503, detail="Unable to fetch JWKS")
+        return self._jwks_cache
 
-    def get_jwks(self) -> Dict[str, Any]:
-        """Fetch JWKS with caching"""
-        now = datetime.utcnow()
+    async def refresh(self) -> Dict[str, Any]:
+        """Fetch JWKS now; callers arriving while a fetch is running wait for the same one"""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._do_refresh())
+        return await asyncio.shield(self._inflight)
 
-        if (self._jwks_cache is None or
-                self._cache_timestamp is None or
-                (now - self._cache_timestamp).total_seconds() > self.cache_duration):
+    def _refresh_in_background(self):
+        if self._inflight is not None and not self._inflight.done():
+            return
+        if self._last_failure is not None and time.monotonic() - self._last_failure < self.min_refetch_interval:
+            return
+        self._inflight = asyncio.create_task(self._do_refresh())
 
-            try:
-                response = requests.get(self.jwks_url, timeout=10)
-                response.raise_for_status()
-                self._jwks_cache = response.json()
-                self._cache_timestamp = now
-                logger.info("JWKS cache refreshed")
-            except requests.RequestException as e:
-                logger.error(f"Failed to fetch JWKS: {e}")
-                if self._jwks_cache is None:
-                    raise HTTPException(status_code=503, detail="Unable to fetch JWKS")
+    async def get_jwks(self) -> Dict[str, Any]:
+        """Return cached JWKS, only waiting on the network when nothing is cached yet"""
+        if self._jwks_cache is None:
+            return await self.refresh()
 
-        return self._jwks_cache
+        if self._is_stale():
+            self._refresh_in_background()
 
-    def get_signing_key(self, kid: str) -> Any:
-        jwks = self.get_jwks()
+        return self._jwks_cache
 
-        available_kids = [key.get("kid") for key in jwks.get("keys", [])]
-        logger.debug(f"Available key IDs: {available_kids}")
-        logger.debug(f"Looking for key ID: {kid}")
+    async def _refresh_loop(self):
+        while True:
+            if self._jwks_cache is None or self._last_failure is not None:
+                delay = self.min_refetch_interval
+            else:
+                delay = max(self.cache_duration - self.refresh_ahead - self._age(), 1)
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh()
+            except Exception:
+                pass
 
+    async def start(self):
+        try:
+            await self.refresh()
+        except HTTPException:
+            logger.warning("JWKS not available at startup, will retry in background")
+        self._background = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._background, self._inflight):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._background = None
+        self._inflight = None
+
+    def _find_key(self, jwks: Dict[str, Any], kid: str) -> Optional[Dict[str, Any]]:
         for key in jwks.get("keys", []):
             if key.get("kid") == kid:
-                logger.debug(f"Found matching key: {key}")
-                return self._jwk_to_pem(key)
+                return key
+        return None
 
-        logger.warning(f"Key {kid} not found, forcing JWKS refresh...")
-        self._jwks_cache = None  # Force cache refresh
-        jwks = self.get_jwks()
+    def _cached_key(self, jwks: Dict[str, Any], kid: str) -> Any:
+        public_key = self._key_cache.get(kid)
+        if public_key is not None:
+            self.key_cache_hits += 1
+            return public_key
 
-        available_kids = [key.get("kid") for key in jwks.get("keys", [])]
-        logger.debug(f"After refresh - Available key IDs: {available_kids}")
+        key = self._find_key(jwks, kid)
+        if key is None:
+            return None
 
-        for key in jwks.get("keys", []):
-            if key.get("kid") == kid:
-                logger.debug(f"Found matching key after refresh: {key}")
-                return self._jwk_to_pem(key)
+        self.key_cache_misses += 1
+        logger.debug(f"Found matching key: {key}")
+        public_key = self._jwk_to_key(key)
+        self._key_cache[kid] = public_key
+        return public_key
 
+    async def get_signing_key(self, kid: str) -> Any:
+        """Return a ready to use public key object for kid"""
+        jwks = await self.get_jwks()
 
+        logger.debug(f"Looking for key ID: {kid}")
+        public_key = self._cached_key(jwks, kid)
+        if public_key is not None:
+            return public_key
+
+        now = time.monotonic()
+        if self._last_forced_refetch is None or now - self._last_forced_refetch >= self.min_refetch_interval:
+            logger.warning(f"Key {kid} not found, refetching JWKS...")
+            self._last_forced_refetch = now
+            jwks = await self.refresh()
+            public_key = self._cached_key(jwks, kid)
+            if public_key is not None:
+                return public_key
 
+        available_kids = [key.get("kid") for key in jwks.get("keys", [])]
         raise HTTPException(status_code=401,
                             detail=f"Unable to find key with kid: {kid}. Available keys: {available_kids}")
 
+    def key_cache_stats(self) -> Dict[str, Any]:
+        return {"size": len(self._key_cache), "hits": self.key_cache_hits, "misses": self.key_cache_misses}
+
 
     def _base64url_decode(self, data: str) -> bytes:
         padding = 4 - (len(data) % 4)
@@ -74,15 +174,15 @@ class JWKSClient:
             data += '=' * padding
         return base64.urlsafe_b64decode(data)
 
-    def _jwk_to_pem(self, jwk: Dict[str, Any]) -> bytes:
+    def _jwk_to_key(self, jwk: Dict[str, Any]) -> Any:
         if jwk.get("kty") == "EC":
-            return self._ec_jwk_to_pem(jwk)
+            return self._ec_jwk_to_key(jwk)
         elif jwk.get("kty") == "RSA":
-            return self._rsa_jwk_to_pem(jwk)
+            return self._rsa_jwk_to_key(jwk)
         else:
             raise HTTPException(status_code=400, detail=f"Unsupported key type: {jwk.get('kty')}")
 
-    def _ec_jwk_to_pem(self, jwk: Dict[str, Any]) -> bytes:
+    def _ec_jwk_to_key(self, jwk: Dict[str, Any]) -> ec.EllipticCurvePublicKey:
         try:
             x = self._base64url_decode(jwk["x"])
             y = self._base64url_decode(jwk["y"])
@@ -97,40 +197,25 @@ class JWKSClient:
             else:
                 raise ValueError(f"Unsupported curve: {curve_name}")
 
-            public_key = ec.EllipticCurvePublicKey.from_encoded_point(curve, b'\x04' + x + y)
-
-            pem = public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
-            return pem
+            return ec.EllipticCurvePublicKey.from_encoded_point(curve, b'\x04' + x + y)
 
         except Exception as e:
-            logger.error(f"Failed to convert EC JWK to PEM: {e}")
+            logger.error(f"Failed to load EC JWK: {e}")
             raise HTTPException(status_code=400, detail="Invalid EC key format")
 
-    def _rsa_jwk_to_pem(self, jwk: Dict[str, Any]) -> bytes:
+    def _rsa_jwk_to_key(self, jwk: Dict[str, Any]) -> rsa.RSAPublicKey:
         try:
-            from cryptography.hazmat.primitives.asymmetric import rsa
-
             n = self._base64url_decode(jwk["n"])  # modulus
             e = self._base64url_decode(jwk["e"])  # exponent
 
             n_int = int.from_bytes(n, byteorder='big')
             e_int = int.from_bytes(e, byteorder='big')
 
-            public_key = rsa.RSAPublicKey(n_int, e_int)
-
-            pem = public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
-
-            return pem
+            return rsa.RSAPublicNumbers(e_int, n_int).public_key()
 
         except KeyError as e:
             logger.error(f"Missing required RSA parameter: {e}")
             raise HTTPException(status_code=400, detail=f"Invalid RSA JWK: missing {e}")
         except Exception as e:
-            logger.error(f"Failed to convert RSA JWK to PEM: {e}")
+            logger.error(f"Failed to load RSA JWK: {e}")
             raise HTTPException(status_code=400, detail="Invalid RSA key format")
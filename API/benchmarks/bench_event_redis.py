@@ -0,0 +1,80 @@
+"""Per-event Redis latency of /internal/event: separate commands vs the event gate script.
+
+    REDIS_URL=redis://localhost:6379/0 python -m benchmarks.bench_event_redis --events 5000
+
+Run from the API directory. Writes throwaway keys under the bench_ user prefix.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+
+import redis.asyncio as redis
+
+from api.routing.alarmroutes import AlarmRouteStore
+from api.routing.eventgate import EventGate, EVENT_LOCK_TTL, SMOKE_LOCK_TTL
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+        "events": len(samples),
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+async def previous_flow(client, routes, user, device_id, message_id):
+    # dedup SET NX, route pipeline, smoke SET NX - three round trips
+    userID = user.replace("SH_", "", 1)
+    if not await client.set(f"event_lock_{user}_{message_id}", "1", ex=EVENT_LOCK_TTL, nx=True):
+        return
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(routes._device_key(userID, device_id))
+        pipe.get(routes._tokens_key(userID))
+        device, _ = await pipe.execute()
+    await client.set(f"smoke_event_lock_{user}_{device['uuid']}", "1", ex=SMOKE_LOCK_TTL, nx=True)
+
+
+async def main(args):
+    client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
+    routes = AlarmRouteStore(supadevices=None)
+    routes.attach(client)
+    gate = EventGate(routes)
+    await gate.load(client)
+
+    user = f"SH_bench_{uuid.uuid4().hex[:8]}"
+    userID = user.replace("SH_", "", 1)
+    await routes.put_device(userID, "dev-1", "uuid-1", "Kitchen")
+    await client.set(routes._tokens_key(userID), json.dumps(["ExponentPushToken[a]"]), ex=600)
+
+    results = {}
+    for name in ("previous", "script"):
+        samples = []
+        for i in range(args.events):
+            message_id = f"{name}-{i}"
+            started = time.perf_counter()
+            if name == "previous":
+                await previous_flow(client, routes, user, "dev-1", message_id)
+            else:
+                await gate.check(user, "dev-1", message_id, "SmokeCheckAlarm")
+            samples.append(time.perf_counter() - started)
+        results[name] = summary(samples)
+
+    keys = [key async for key in client.scan_iter(match=f"*{user}*")]
+    keys += [key async for key in client.scan_iter(match=f"*{userID}*")]
+    if keys:
+        await client.delete(*set(keys))
+    await client.aclose()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
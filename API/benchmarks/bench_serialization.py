@@ -0,0 +1,94 @@
+"""CPU per response of /list and /device/{uuid}/logs, response_model path vs FAST_RESPONSES.
+
+    python -m benchmarks.bench_serialization --devices 10,100,500 --logs 10,50,100 --requests 300
+
+Run from the API directory. Requests go through the ASGI app in-process
+with upstreams replaced by canned data, so the numbers are the API's own
+parsing, validation and serialization (plus routing, identical for both).
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+from api import main
+
+
+class CannedSupabase:
+    def __init__(self, devices: int):
+        self.rows = [{
+            "uuid": str(uuid.uuid4()),
+            "internal_product_id": "prod-1",
+            "name": f"Device {i}",
+            "created_at": f"2024-03-{i % 28 + 1:02d}T10:{i % 60:02d}:00.{i * 7919 % 1000000:06d}+00:00",
+        } for i in range(devices)]
+
+    async def list_devices_for_user(self, user_id):
+        return self.rows
+
+    async def get_device_by_uuid(self, user_id, uuid):
+        return {"internal_device_id": "dev-1", "internal_product_id": "prod-1", "name": "Kitchen"}
+
+
+class CannedHeiman:
+    def __init__(self, entries: int):
+        now = 1700000000000
+        self.events = self._logs("event", [{"event": "SmokeCheckAlarm", "timestamp": now - i * 60000}
+                                           for i in range(entries)])
+        self.properties = self._logs("reportProperty", [
+            {"properties": {"BatteryPercentage": 87, "SmokeSensorState": 0, "temperature": 21.5},
+             "timestamp": now - i * 60000} for i in range(entries)])
+
+    def _logs(self, kind, contents):
+        return {"message": "success", "result": {"total": len(contents) * 2, "data": [
+            {"type": {"value": kind, "text": kind}, "content": json.dumps(content)} for content in contents]}}
+
+    async def getDeviceEvents(self, *args):
+        return self.events
+
+    async def getDeviceProperties(self, *args):
+        return self.properties
+
+
+async def cpu_per_request(client: httpx.AsyncClient, path: str, requests: int) -> float:
+    for _ in range(10):
+        (await client.get(path)).raise_for_status()
+    started = time.process_time()
+    for _ in range(requests):
+        await client.get(path)
+    return (time.process_time() - started) / requests
+
+
+async def run(args):
+    main.app.dependency_overrides[main.get_authenticated_user] = lambda: "bench-user"
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        cases = [("list", "/list", int(n)) for n in args.devices.split(",")]
+        cases += [("logs", "/device/abc/logs?pageSize={n}&until=2024-01-01T00:00:00Z", int(n)) for n in args.logs.split(",")]
+        for name, path, size in cases:
+            main.supadevices = CannedSupabase(size)
+            main.heimanConnector = CannedHeiman(size)
+            path = path.format(n=size)
+            row = {"endpoint": name, "size": size}
+            for label, fast in (("model", False), ("fast", True)):
+                main.FAST_RESPONSES = fast
+                row[f"{label}_us"] = round(await cpu_per_request(client, path, args.requests) * 1e6, 1)
+            row["speedup"] = round(row["model_us"] / row["fast_us"], 2)
+            results.append(row)
+            print(json.dumps(row), flush=True)
+
+    print(f"\n{'endpoint':<10}{'size':>6}{'model us':>12}{'fast us':>12}{'speedup':>10}")
+    for row in results:
+        print(f"{row['endpoint']:<10}{row['size']:>6}{row['model_us']:>12}{row['fast_us']:>12}{row['speedup']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", default="10,100,500", help="devices per user for /list")
+    parser.add_argument("--logs", default="10,50,100", help="log entries per kind for /logs (API caps pageSize at 100)")
+    parser.add_argument("--requests", type=int, default=300)
+    asyncio.run(run(parser.parse_args()))
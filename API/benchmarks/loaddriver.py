@@ -0,0 +1,178 @@
+"""Closed-loop load driver for the API running against benchmarks.standins.
+
+    INTERNAL_SECRET=bench python -m benchmarks.loaddriver --api http://127.0.0.1:8000 \
+        --seed benchmarks/seed.json --duration 30 --concurrency 32 --label baseline
+
+Every scenario runs on its own for --duration seconds with --concurrency
+workers. p50/p95/p99 latency, throughput, error counts and the upstream
+response bytes per request (as counted by the stand-ins) are printed and
+saved to benchmarks/results/<label>-<time>.json. Two result files can be
+compared with --compare old.json new.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+import aiohttp
+import jwt
+
+SCENARIOS = ("list", "info", "logs", "register", "event")
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Driver:
+    def __init__(self, api: str, seed: Dict[str, Any], secret: str):
+        self.api = api.rstrip("/")
+        self.users = seed["users"]
+        self.secret = secret
+        self.traffic_url = seed.get("traffic_url")
+        now = int(time.time())
+        self.tokens = {
+            user["user_id"]: jwt.encode({"sub": user["user_id"], "role": "authenticated", "iat": now, "exp": now + 6 * 3600},
+                                        seed["private_key"], algorithm="ES256", headers={"kid": seed["kid"]})
+            for user in self.users
+        }
+
+    def _auth(self, user: Dict[str, Any]) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.tokens[user['user_id']]}"}
+
+    def request(self, scenario: str) -> Tuple[str, str, Dict[str, Any]]:
+        """(method, url, aiohttp kwargs) for one random request of the scenario"""
+        user = random.choice(self.users)
+        device = random.choice(user["devices"])
+        if scenario == "list":
+            return "GET", f"{self.api}/list", {"headers": self._auth(user)}
+        if scenario == "info":
+            return "GET", f"{self.api}/device/{device['uuid']}/info", {"headers": self._auth(user)}
+        if scenario == "logs":
+            return "GET", f"{self.api}/device/{device['uuid']}/logs?pageSize=10", {"headers": self._auth(user)}
+        if scenario == "register":
+            body = {"productID": "bench-product", "deviceName": f"reg-{uuid.uuid4().hex[:12]}"}
+            return "POST", f"{self.api}/register_device", {"headers": self._auth(user), "json": body}
+        if scenario == "event":
+            body = {"tenant": "SH_bench", "user": f"SH_{user['user_id']}", "eventName": "AlarmTest",
+                    "deviceId": device["device_id"], "data": {}, "messageId": uuid.uuid4().hex}
+            return "POST", f"{self.api}/internal/event", {"headers": {"X-Internal-Secret": self.secret}, "json": body}
+        raise ValueError(scenario)
+
+    async def run(self, scenario: str, duration: float, concurrency: int) -> Dict[str, Any]:
+        latencies: List[float] = []
+        statuses: Dict[str, int] = {}
+        deadline = time.monotonic() + duration
+
+        async def worker(session: aiohttp.ClientSession):
+            while time.monotonic() < deadline:
+                method, url, kwargs = self.request(scenario)
+                started = time.perf_counter()
+                try:
+                    async with session.request(method, url, **kwargs) as response:
+                        await response.read()
+                        status = str(response.status)
+                except aiohttp.ClientError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            before = await self.traffic(session)
+            started = time.monotonic()
+            await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+            elapsed = time.monotonic() - started
+            after = await self.traffic(session)
+
+        ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+        # response bytes the stand-ins sent back per API request, by upstream
+        upstreamBytes = {name: round((after[name]["bytes"] - before[name]["bytes"]) / max(len(latencies), 1), 1)
+                         for name in after} if before and after else {}
+        return {
+            "requests": len(latencies),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "errors": len(latencies) - ok,
+            "statuses": statuses,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "upstream_bytes_per_request": upstreamBytes,
+        }
+
+    async def traffic(self, session: aiohttp.ClientSession) -> Dict[str, Dict[str, int]]:
+        """Stand-in response byte counters, empty for seeds written before they existed"""
+        if not self.traffic_url:
+            return {}
+        async with session.get(self.traffic_url) as response:
+            return await response.json()
+
+
+def print_table(results: Dict[str, Dict[str, Any]]):
+    print(f"{'scenario':<10}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'sb B/req':>10}{'hm B/req':>10}")
+    for scenario, r in results.items():
+        upstreamBytes = r.get("upstream_bytes_per_request", {})
+        print(f"{scenario:<10}{r['throughput_rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>8}"
+              f"{upstreamBytes.get('supabase', '-'):>10}{upstreamBytes.get('heiman', '-'):>10}")
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    delta: Callable[[float, float], str] = lambda a, b: f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+    supabaseBytes = lambda r: r.get("upstream_bytes_per_request", {}).get("supabase", 0)
+    print(f"{'scenario':<10}{'rps':>12}{'p50':>12}{'p95':>12}{'p99':>12}{'sb B/req':>12}")
+    for scenario in new:
+        if scenario not in old:
+            continue
+        a, b = old[scenario], new[scenario]
+        print(f"{scenario:<10}{delta(a['throughput_rps'], b['throughput_rps']):>12}{delta(a['p50_ms'], b['p50_ms']):>12}"
+              f"{delta(a['p95_ms'], b['p95_ms']):>12}{delta(a['p99_ms'], b['p99_ms']):>12}"
+              f"{delta(supabaseBytes(a), supabaseBytes(b)):>12}")
+
+
+async def main(args):
+    with open(args.seed) as f:
+        seed = json.load(f)
+    driver = Driver(args.api, seed, os.getenv("INTERNAL_SECRET", "bench"))
+
+    results = {}
+    for scenario in args.scenarios.split(","):
+        results[scenario] = await driver.run(scenario, args.duration, args.concurrency)
+        print(f"{scenario}: {json.dumps(results[scenario])}", flush=True)
+    print_table(results)
+
+    os.makedirs(args.results, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.results, f"{args.label}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump({"label": args.label, "time": stamp, "duration": args.duration, "concurrency": args.concurrency,
+                   "users": len(seed["users"]), "standins": seed.get("standins"), "results": results}, f, indent=2)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--seed", default="benchmarks/seed.json")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--results", default="benchmarks/results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,370 @@
+"""Local stand-ins for Heiman, Supabase (PostgREST + JWKS), Expo push and eFlara.
+
+    python -m benchmarks.standins --users 200 --devices 3 \
+        --latency heiman=80,supabase=15,expo=120,eflara=150 --errors heiman=0.01
+
+Then start the API against them (and a local Redis):
+
+    HEIMAN_URL=http://127.0.0.1:9101 SUPABASE_URL=http://127.0.0.1:9102 \
+    EXPO_PUSH_URL=http://127.0.0.1:9103/--/api/v2/push/send EFLARA_URL=http://127.0.0.1:9104/api/flares/ \
+    REDIS_HOST=127.0.0.1 SUPABASE_SERVICE_KEY=bench INTERNAL_SECRET=bench uvicorn api.main:app --port 8000
+
+and run benchmarks.loaddriver with the seed file written here. Latency is a
+mean in ms with +-50% uniform jitter; error rate is the share of requests
+answered with a 503.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+PORTS = {"heiman": 9101, "supabase": 9102, "expo": 9103, "eflara": 9104}
+JWT_KID = "bench"
+COLUMN_DEFAULTS = {
+    "devices": {"name": "Device", "internal_name": None},
+    "device_eflara": {"enabled": False},
+}
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = part.partition("=")
+        rates[name.strip()] = float(value)
+    return rates
+
+
+def behaviour(latency_ms: float, error_rate: float, traffic: Dict[str, int]):
+    @web.middleware
+    async def middleware(request, handler):
+        if request.path.startswith("/_bench/"):
+            return await handler(request)
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms * random.uniform(0.5, 1.5) / 1000)
+        if error_rate > 0 and random.random() < error_rate:
+            return web.json_response({"message": "injected error"}, status=503)
+        response = await handler(request)
+        # what goes over the wire: HEAD answers carry headers only
+        traffic["responses"] += 1
+        if request.method != "HEAD" and response.body is not None:
+            traffic["bytes"] += len(response.body)
+        return response
+    return middleware
+
+
+class Store:
+    """In-memory tables shared by the Heiman and PostgREST stand-ins"""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {"devices": [], "notifications": [], "device_eflara": []}
+        # response bodies served per stand-in, read by the load driver around each scenario
+        self.traffic: Dict[str, Dict[str, int]] = {name: {"responses": 0, "bytes": 0} for name in PORTS}
+
+    def seed(self, users: int, devices: int) -> List[Dict[str, Any]]:
+        seeded = []
+        for u in range(users):
+            user_id = str(uuid.uuid4())
+            entry = {"user_id": user_id, "devices": []}
+            self.tables["notifications"].append({"user_id": user_id, "token": f"ExponentPushToken[bench-{u}]"})
+            for d in range(devices):
+                device = self.insert("devices", {
+                    "user_id": user_id,
+                    "internal_device_id": f"bench-{u}-{d}",
+                    "internal_name": f"bench-{u}-{d}",
+                    "internal_product_id": "bench-product",
+                    "name": f"Device {d}",
+                })
+                if d == 0:
+                    self.insert("device_eflara", {"device_uuid": device["uuid"], "address": f"Bench St {u}", "enabled": True})
+                entry["devices"].append({"uuid": device["uuid"], "device_id": device["internal_device_id"]})
+            seeded.append(entry)
+        return seeded
+
+    def insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        # Like PostgREST with Prefer: return=representation, every column comes back, defaults included
+        row = {**COLUMN_DEFAULTS.get(table, {}), **row}
+        if table in ("devices", "device_eflara"):
+            row.setdefault("uuid", str(uuid.uuid4()))
+            row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        self.tables[table].append(row)
+        return row
+
+    def devices_of(self, user_id: str) -> List[Dict[str, Any]]:
+        return [row for row in self.tables["devices"] if row["user_id"] == user_id]
+
+
+def split_select(select: str) -> List[str]:
+    columns, depth, current = [], 0, ""
+    for char in select:
+        if char == "," and depth == 0:
+            columns.append(current)
+            current = ""
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current += char
+    return columns + [current] if current else columns
+
+
+def postgrest_app(store: Store) -> web.Application:
+    """Just enough of PostgREST for SupabaseDevicesClient: eq filters, select with one level of embedding,
+    order, limit/offset, count=exact, and insert/upsert/update/delete honouring Prefer return=."""
+
+    def filters(request) -> Dict[str, str]:
+        return {key: value[3:] for key, value in request.query.items() if value.startswith("eq.")}
+
+    def matching(table: str, request) -> List[Dict[str, Any]]:
+        wanted = filters(request)
+        return [row for row in store.tables[table] if all(str(row.get(k)) == v for k, v in wanted.items())]
+
+    def project(row: Dict[str, Any], select: Optional[str]) -> Dict[str, Any]:
+        if not select or select == "*":
+            return dict(row)
+        result = {}
+        for column in split_select(select):
+            embedded = re.fullmatch(r"(\w+)\((.*)\)", column)
+            if embedded:
+                name, inner = embedded.groups()
+                related = [other for other in store.tables[name] if other.get("device_uuid") == row.get("uuid")]
+                result[name] = [project(other, inner) for other in related]
+            else:
+                result[column] = row.get(column)
+        return result
+
+    async def handle(request):
+        table = request.match_info["table"]
+        if table not in store.tables:
+            return web.json_response({"message": f"relation {table} does not exist"}, status=404)
+
+        prefer = request.headers.get("Prefer", "")
+
+        if request.method in ("GET", "HEAD"):
+            rows = matching(table, request)
+            total = len(rows)
+            order = request.query.get("order")
+            if order:
+                column, _, direction = order.partition(".")
+                rows = sorted(rows, key=lambda row: row.get(column) or "", reverse=direction == "desc")
+            offset = int(request.query.get("offset", 0))
+            limit = request.query.get("limit")
+            rows = rows[offset:offset + int(limit) if limit else None]
+            headers = {}
+            if "count=exact" in prefer:
+                shown = f"{offset}-{offset + len(rows) - 1}" if rows else "*"
+                headers["Content-Range"] = f"{shown}/{total}"
+            return web.json_response([project(row, request.query.get("select")) for row in rows], headers=headers)
+
+
+        def written(rows: List[Dict[str, Any]], status: int = 200):
+            headers = {"Content-Range": f"*/{len(rows)}"} if "count=exact" in prefer else {}
+            if "return=minimal" in prefer:
+                return web.Response(status=204 if status == 200 else status, headers=headers)
+            select = request.query.get("select")
+            return web.json_response([project(row, select) for row in rows], status=status, headers=headers)
+
+        if request.method == "POST":
+            body = await request.json()
+            rows = body if isinstance(body, list) else [body]
+            conflict = [column for column in request.query.get("on_conflict", "").split(",") if column]
+            created = []
+            for row in rows:
+                existing = next((other for other in store.tables[table]
+                                 if conflict and all(other.get(c) == row.get(c) for c in conflict)), None)
+                if existing is None:
+                    created.append(store.insert(table, row))
+                elif "resolution=merge-duplicates" in prefer:
+                    existing.update(row)
+                    created.append(existing)
+                elif "resolution=ignore-duplicates" not in prefer:
+                    return web.json_response({"code": "23505", "message": "duplicate key value"}, status=409)
+            return written(created, status=201)
+
+        if request.method == "PATCH":
+            updates = await request.json()
+            rows = matching(table, request)
+            for row in rows:
+                row.update(updates)
+            return written(rows)
+
+        if request.method == "DELETE":
+            rows = matching(table, request)
+            store.tables[table] = [row for row in store.tables[table] if row not in rows]
+            return written(rows)
+
+        return web.json_response({"message": "method not allowed"}, status=405)
+
+    return handle
+
+
+def register_device_rpc(store: Store):
+    """supabase/migrations/*_register_device.sql"""
+
+    async def handle(request):
+        params = await request.json()
+        rows = [row for row in store.tables["devices"] if row["internal_device_id"] == params["p_device_id"]]
+        if any(row["user_id"] != params["p_previous_owner"] for row in rows):
+            return web.json_response({"code": "P0001", "message": "DEVICE_OWNER_CHANGED"}, status=400)
+        store.tables["devices"] = [row for row in store.tables["devices"] if row not in rows]
+        created = store.insert("devices", {
+            "user_id": params["p_user_id"],
+            "internal_device_id": params["p_device_id"],
+            "internal_name": params["p_name"],
+            "internal_product_id": params["p_product_id"],
+        })
+        return web.json_response({"device": created, "previous": [
+            {"user_id": row["user_id"], "uuid": row["uuid"]} for row in rows]})
+
+    return handle
+
+
+def supabase_app(store: Store, jwks: Dict[str, Any], middleware) -> web.Application:
+    app = web.Application(middlewares=[middleware])
+
+    async def get_jwks(request):
+        return web.json_response(jwks)
+
+    async def get_traffic(request):
+        return web.json_response(store.traffic)
+
+    app.router.add_get("/auth/v1/.well-known/jwks.json", get_jwks)
+    app.router.add_get("/_bench/traffic", get_traffic)
+    app.router.add_post("/rest/v1/rpc/register_device", register_device_rpc(store))
+    app.router.add_route("*", "/rest/v1/{table}", postgrest_app(store))
+    return app
+
+
+def heiman_app(store: Store, middleware) -> web.Application:
+    app = web.Application(middlewares=[middleware])
+    success = lambda result: web.json_response({"message": "success", "status": 200, "result": result})
+
+    async def name_by_device(request):
+        # the mac address doubles as the Heiman device id
+        return success([{"id": request.match_info["mac"]}])
+
+    async def detail(request):
+        return success({"id": request.match_info["device_id"], "state": {"text": "Online", "value": "online"}})
+
+    async def logs(request):
+        query = await request.json()
+        kind = query["terms"][0]["value"]
+        now = int(time.time() * 1000)
+        data = []
+        for i in range(query["pageSize"]):
+            timestamp = now - (query["pageIndex"] * query["pageSize"] + i) * 60000
+            if kind == "event":
+                content = {"event": "SmokeCheckAlarm", "timestamp": timestamp}
+            else:
+                content = {"properties": {"BatteryPercentage": 87, "SmokeSensorState": 0}, "timestamp": timestamp}
+            data.append({"type": {"value": kind, "text": kind}, "content": json.dumps(content), "timestamp": timestamp})
+        return success({"pageIndex": query["pageIndex"], "pageSize": query["pageSize"], "total": 100, "data": data})
+
+    async def bind(request):
+        return success(True)
+
+    async def device_list(request):
+        query = await request.json()
+        user_id = request.headers.get("Tenant-Id", "").replace("SH_", "", 1)
+        page, size = query["help"]["pageIndex"], query["help"]["pageSize"]
+        devices = store.devices_of(user_id)
+        data = [{"deviceId": row["internal_device_id"], "state": {"text": "Online", "value": "online"}}
+                for row in devices[page * size:(page + 1) * size]]
+        return success({"total": len(devices), "data": data})
+
+    app.router.add_get("/api-saas/device-instance/{product_id}/{mac}/nameByDevice", name_by_device)
+    app.router.add_get("/api-saas/device-instance/{device_id}/detail", detail)
+    app.router.add_post("/api-saas/device-instance/{device_id}/logs", logs)
+    app.router.add_post("/api-saas/sys/user/device/bind", bind)
+    app.router.add_post("/api-saas/sys/user/device/unbind", bind)
+    app.router.add_post("/api-saas/sys/user/device/list/_query", device_list)
+    return app
+
+
+def expo_app(middleware) -> web.Application:
+    app = web.Application(middlewares=[middleware])
+
+    async def send(request):
+        messages = await request.json()
+        return web.json_response({"data": [{"status": "ok", "id": str(uuid.uuid4())} for _ in messages]})
+
+    app.router.add_post("/--/api/v2/push/send", send)
+    return app
+
+
+def eflara_app(middleware) -> web.Application:
+    app = web.Application(middlewares=[middleware])
+
+    async def flare(request):
+        await request.json()
+        return web.json_response({"status": "ok", "id": str(uuid.uuid4())})
+
+    app.router.add_post("/api/flares/", flare)
+    return app
+
+
+def signing_key():
+    """EC P-256 key for ES256 bench tokens and its JWKS"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    numbers = key.public_key().public_numbers()
+    b64 = lambda value: base64.urlsafe_b64encode(value.to_bytes(32, "big")).rstrip(b"=").decode()
+    jwks = {"keys": [{"kty": "EC", "crv": "P-256", "kid": JWT_KID, "alg": "ES256", "use": "sig",
+                      "x": b64(numbers.x), "y": b64(numbers.y)}]}
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode()
+    return pem, jwks
+
+
+def build_apps(store: Store, jwks: Dict[str, Any], latency: Dict[str, float], errors: Dict[str, float]) -> Dict[str, web.Application]:
+    middleware = {name: behaviour(latency.get(name, 0), errors.get(name, 0), store.traffic[name]) for name in PORTS}
+    return {
+        "heiman": heiman_app(store, middleware["heiman"]),
+        "supabase": supabase_app(store, jwks, middleware["supabase"]),
+        "expo": expo_app(middleware["expo"]),
+        "eflara": eflara_app(middleware["eflara"]),
+    }
+
+
+async def serve(args):
+    store = Store()
+    users = store.seed(args.users, args.devices)
+    pem, jwks = signing_key()
+    latency, errors = parse_rates(args.latency), parse_rates(args.errors)
+
+    runners = []
+    for name, app in build_apps(store, jwks, latency, errors).items():
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, args.host, PORTS[name]).start()
+        runners.append(runner)
+
+    with open(args.seed, "w") as f:
+        json.dump({"users": users, "private_key": pem, "kid": JWT_KID,
+                   "standins": {"latency_ms": latency, "error_rate": errors},
+                   "traffic_url": f"http://{args.host}:{PORTS['supabase']}/_bench/traffic"}, f)
+    print(f"Stand-ins listening on {args.host} ports {PORTS}, seed written to {args.seed}", flush=True)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--devices", type=int, default=3, help="devices per user")
+    parser.add_argument("--latency", default="heiman=80,supabase=15,expo=120,eflara=150")
+    parser.add_argument("--errors", default="")
+    parser.add_argument("--seed", default="benchmarks/seed.json")
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,44 @@
+-- Atomic device registration used by POST /register_device (SupabaseDevicesClient.register_device).
+-- Drops whatever row the device has and inserts the new owner's row in one transaction, provided
+-- the device still belongs to p_previous_owner (null: not registered at all).
+create or replace function public.register_device(
+    p_user_id uuid,
+    p_device_id text,
+    p_name text,
+    p_product_id text,
+    p_previous_owner uuid default null
+) returns json
+language plpgsql
+set search_path = public
+as $$
+declare
+    previous json;
+    created devices%rowtype;
+begin
+    -- serializes registrations of the same device whichever replica or client they come from
+    perform pg_advisory_xact_lock(hashtext('register_device:' || p_device_id));
+
+    if exists (
+        select 1 from devices
+        where internal_device_id = p_device_id and user_id is distinct from p_previous_owner
+    ) then
+        raise exception 'DEVICE_OWNER_CHANGED' using errcode = 'P0001';
+    end if;
+
+    with removed as (
+        delete from devices where internal_device_id = p_device_id returning user_id, uuid
+    )
+    select coalesce(json_agg(json_build_object('user_id', user_id, 'uuid', uuid)), '[]'::json)
+    into previous
+    from removed;
+
+    insert into devices (user_id, internal_device_id, internal_name, internal_product_id, created_at)
+    values (p_user_id, p_device_id, p_name, p_product_id, now())
+    returning * into created;
+
+    return json_build_object('device', row_to_json(created), 'previous', previous);
+end;
+$$;
+
+revoke execute on function public.register_device(uuid, text, text, text, uuid) from public, anon, authenticated;
+grant execute on function public.register_device(uuid, text, text, text, uuid) to service_role;
@@ -0,0 +1,14 @@
+-- Unique keys the client upserts against (on_conflict=...), see SupabaseDevicesClient._upsert.
+do $$
+begin
+    -- set_eflara_for_device: one eflara config per device
+    if not exists (select 1 from pg_constraint where conname = 'device_eflara_device_uuid_key') then
+        alter table public.device_eflara add constraint device_eflara_device_uuid_key unique (device_uuid);
+    end if;
+
+    -- add_notification_token: on_conflict=user_id,token
+    if not exists (select 1 from pg_constraint where conname = 'unique_user_token') then
+        alter table public.notifications add constraint unique_user_token unique (user_id, token);
+    end if;
+end;
+$$;
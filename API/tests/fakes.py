@@ -0,0 +1,280 @@
+"""Small in-memory stand-ins for the Redis commands the API uses."""
+import json
+import time
+
+from redis.exceptions import ResponseError
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.ops.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        ops, self.ops = self.ops, []
+        round_trips = self.redis.round_trips
+        results = [await method(*args, **kwargs) for method, args, kwargs in ops]
+        self.redis.round_trips = round_trips + 1
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.published = []
+        self.round_trips = 0
+        self.streams = {}
+        self._stream_seq = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        self.round_trips += 1
+        return self.data.get(key)
+
+    async def mget(self, *keys):
+        self.round_trips += 1
+        return [self.data.get(key) for key in keys]
+
+    async def incr(self, key):
+        self.round_trips += 1
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        self.round_trips += 1
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def delete(self, *keys):
+        self.round_trips += 1
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    async def exists(self, key):
+        self.round_trips += 1
+        return int(key in self.data)
+
+    async def expire(self, key, seconds):
+        return key in self.data
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        self.round_trips += 1
+        entry = self.data.setdefault(key, {})
+        if field is not None:
+            entry[field] = value
+        entry.update(mapping or {})
+        return len(mapping or {}) + (field is not None)
+
+    async def hgetall(self, key):
+        self.round_trips += 1
+        return dict(self.data.get(key, {}))
+
+    async def publish(self, channel, message):
+        self.published.append(message)
+        return 0
+
+    async def scan_iter(self, match=None):
+        prefix = match.rstrip("*") if match else ""
+        for key in list(self.data):
+            if key.startswith(prefix):
+                yield key
+
+    def register_script(self, source):
+        # Scripts are emulated by name in the tests that need them
+        redis = self
+
+        async def move_due(keys=(), args=()):
+            redis.round_trips += 1
+            schedule, jobs, stream = keys
+            now, limit = float(args[0]), int(args[1])
+            due = sorted((score, member) for member, score in redis.data.get(schedule, {}).items() if score <= now)
+            for score, member in due[:limit]:
+                job = redis.data.get(jobs, {}).pop(member, None)
+                if job is not None:
+                    job = json.loads(job)
+                    redis._stream_seq += 1
+                    redis._stream(stream)["entries"].append(
+                        (f"{redis._stream_seq}-0", {"kind": job["kind"], "payload": job["payload"], "enqueued_at": str(score)}))
+                del redis.data[schedule][member]
+            return len(due[:limit])
+
+        if "ZRANGEBYSCORE" in source:
+            return move_due
+
+        async def release_lock(keys=(), args=()):
+            redis.round_trips += 1
+            if redis.data.get(keys[0]) == args[0]:
+                del redis.data[keys[0]]
+                return 1
+            return 0
+
+        if 'redis.call("del"' in source:
+            return release_lock
+
+        async def set_if_current(keys=(), args=()):
+            redis.round_trips += 1
+            if (redis.data.get(keys[1]) or "") != args[0]:
+                return 0
+            redis.data[keys[0]] = args[1]
+            return 1
+
+        if 'redis.call("set"' in source:
+            return set_if_current
+
+        async def hset_if_exists(keys=(), args=()):
+            redis.round_trips += 1
+            if keys[0] not in redis.data:
+                return 0
+            entry = redis.data[keys[0]]
+            for field, value in zip(args[::2], args[1::2]):
+                entry[field] = value
+            return 1
+        return hset_if_exists
+
+    async def script_load(self, source):
+        self.scripts = getattr(self, "scripts", set()) | {"event_gate"}
+        return "event_gate"
+
+    async def evalsha(self, sha, numkeys, *keys_and_args):
+        # Only the event gate script is loaded with script_load
+        from redis.exceptions import NoScriptError
+        if sha not in getattr(self, "scripts", set()):
+            raise NoScriptError("NOSCRIPT No matching script")
+        self.round_trips += 1
+        lock, route_key, tokens_key = keys_and_args[:numkeys]
+        lock_ttl, smoke_prefix, smoke_ttl, check_smoke = keys_and_args[numkeys:]
+        if lock in self.data:
+            return [0]
+        self.data[lock] = "1"
+        route = self.data.get(route_key, {})
+        tokens = self.data.get(tokens_key)
+        smoke = -1
+        if check_smoke == "1" and route and tokens and tokens != "[]":
+            smoke_key = smoke_prefix + route["uuid"]
+            smoke = 0 if smoke_key in self.data else 1
+            self.data.setdefault(smoke_key, "1")
+        flat = [item for field_value in route.items() for item in field_value]
+        return [1, flat, tokens, smoke]
+
+    def _stream(self, name):
+        return self.streams.setdefault(name, {"entries": [], "groups": {}})
+
+    async def xadd(self, name, fields, maxlen=None, approximate=True):
+        self.round_trips += 1
+        self._stream_seq += 1
+        job_id = f"{self._stream_seq}-0"
+        self._stream(name)["entries"].append((job_id, dict(fields)))
+        return job_id
+
+    async def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        groups = self._stream(name)["groups"]
+        if groupname in groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        groups[groupname] = {"delivered": 0, "pending": {}}
+        return True
+
+    async def xreadgroup(self, groupname, consumername, streams, count=None, block=None):
+        self.round_trips += 1
+        result = []
+        for name in streams:
+            stream = self._stream(name)
+            group = stream["groups"][groupname]
+            new = stream["entries"][group["delivered"]:][:count]
+            group["delivered"] += len(new)
+            for job_id, _ in new:
+                group["pending"][job_id] = {"consumer": consumername, "times_delivered": 1, "delivered_at": time.monotonic()}
+            if new:
+                result.append([name, new])
+        return result
+
+    async def xack(self, name, groupname, *ids):
+        self.round_trips += 1
+        pending = self._stream(name)["groups"][groupname]["pending"]
+        return sum(1 for job_id in ids if pending.pop(job_id, None) is not None)
+
+    async def xautoclaim(self, name, groupname, consumername, min_idle_time, start_id="0-0", count=None):
+        self.round_trips += 1
+        stream = self._stream(name)
+        entries = dict(stream["entries"])
+        now = time.monotonic()
+        claimed = []
+        for job_id, entry in stream["groups"][groupname]["pending"].items():
+            if (now - entry["delivered_at"]) * 1000 >= min_idle_time and len(claimed) < (count or 100):
+                entry.update(consumer=consumername, delivered_at=now, times_delivered=entry["times_delivered"] + 1)
+                claimed.append((job_id, entries[job_id]))
+        return ["0-0", claimed, []]
+
+    async def xclaim(self, name, groupname, consumername, min_idle_time, message_ids):
+        self.round_trips += 1
+        stream = self._stream(name)
+        entries = dict(stream["entries"])
+        now = time.monotonic()
+        claimed = []
+        for job_id in message_ids:
+            entry = stream["groups"][groupname]["pending"].get(job_id)
+            if entry is not None and (now - entry["delivered_at"]) * 1000 >= min_idle_time:
+                entry.update(consumer=consumername, delivered_at=now, times_delivered=entry["times_delivered"] + 1)
+                claimed.append((job_id, entries[job_id]))
+        return claimed
+
+    async def xpending_range(self, name, groupname, min, max, count, consumername=None):
+        self.round_trips += 1
+        pending = self._stream(name)["groups"][groupname]["pending"]
+        return [{"message_id": job_id, "consumer": entry["consumer"], "times_delivered": entry["times_delivered"],
+                 "time_since_delivered": 0}
+                for job_id, entry in pending.items() if consumername in (None, entry["consumer"])]
+
+    async def xinfo_groups(self, name):
+        self.round_trips += 1
+        stream = self._stream(name)
+        return [{"name": group_name, "pending": len(group["pending"]), "lag": len(stream["entries"]) - group["delivered"]}
+                for group_name, group in stream["groups"].items()]
+
+    async def hdel(self, key, *fields):
+        self.round_trips += 1
+        entry = self.data.get(key, {})
+        return sum(1 for field in fields if entry.pop(field, None) is not None)
+
+    async def zadd(self, key, mapping):
+        self.round_trips += 1
+        zset = self.data.setdefault(key, {})
+        added = sum(1 for member in mapping if member not in zset)
+        zset.update(mapping)
+        return added
+
+    async def zrem(self, key, *members):
+        self.round_trips += 1
+        zset = self.data.get(key, {})
+        return sum(1 for member in members if zset.pop(member, None) is not None)
+
+    async def zcard(self, key):
+        self.round_trips += 1
+        return len(self.data.get(key, {}))
+
+    async def zcount(self, key, low, high):
+        self.round_trips += 1
+        low, high = float(low), float(high)
+        return sum(1 for score in self.data.get(key, {}).values() if low <= score <= high)
+
+    async def zrange(self, key, start, end, withscores=False):
+        self.round_trips += 1
+        members = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        members = members[start:None if end == -1 else end + 1]
+        return members if withscores else [member for member, _ in members]
@@ -0,0 +1,69 @@
+import asyncio
+
+from api.routing.alarmroutes import AlarmRouteStore
+from fakes import FakeRedis
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.calls = []
+
+    async def get_device_by_user_device_id(self, user, device_id, select=None):
+        self.calls.append("device")
+        return {"uuid": "uuid-1", "name": "Kitchen", "internal_device_id": device_id}
+
+    async def get_eflara_for_device(self, device_uuid):
+        self.calls.append("eflara")
+        return {"address": "Main St 1", "enabled": True, "device_uuid": device_uuid}
+
+    async def get_notification_tokens_for_user(self, user_id):
+        self.calls.append("tokens")
+        return [{"token": "ExponentPushToken[a]"}, {"token": None}]
+
+
+def make_store():
+    supabase = FakeSupabase()
+    store = AlarmRouteStore(supabase)
+    store.attach(FakeRedis())
+    return store, supabase
+
+
+def test_missing_route_falls_back_to_supabase_once():
+    async def run():
+        store, supabase = make_store()
+
+        first = await store.get("user-1", "dev-1")
+        assert first.device_uuid == "uuid-1"
+        assert first.eflara == {"address": "Main St 1", "enabled": True}
+        assert first.tokens == ["ExponentPushToken[a]"]
+        assert supabase.calls == ["device", "eflara", "tokens"]
+
+        store.redis.round_trips = 0
+        second = await store.get("user-1", "dev-1")
+        assert second == first
+        assert supabase.calls == ["device", "eflara", "tokens"]
+        assert store.redis.round_trips == 1
+
+    asyncio.run(run())
+
+
+def test_write_paths_keep_route_current():
+    async def run():
+        store, supabase = make_store()
+        await store.put_device("user-1", "dev-1", "uuid-1", "Kitchen")
+        await store.refresh_tokens("user-1")
+
+        await store.set_name("user-1", "dev-1", "Hall")
+        await store.set_eflara("user-1", "dev-1", "Main St 2", False)
+        route = await store.get("user-1", "dev-1")
+        assert route.device_name == "Hall"
+        assert route.eflara == {"address": "Main St 2", "enabled": False}
+
+        # Partial updates never create a half-filled record
+        await store.set_name("user-1", "dev-2", "Ghost")
+        assert "alarm_route:user-1:dev-2" not in store.redis.data
+
+        await store.remove_device("user-1", "dev-1")
+        assert "alarm_route:user-1:dev-1" not in store.redis.data
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from api import main
+from api.cache.twotiercache import TwoTierCache
+from api.heiman.heimanconnector import HeimanConnector
+from api.supaconnector.supaconnector import SupabaseDevicesClient
+
+
+class UpstreamCounter:
+    def __init__(self):
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def record(self, name):
+        self.calls.append(name)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+
+def make_clients(monkeypatch):
+    upstream = UpstreamCounter()
+    supadevices = SupabaseDevicesClient("https://supabase.invalid", "key", pool=None, cache=TwoTierCache())
+    heiman = HeimanConnector("https://heiman.invalid", "id", "secret", pool=None)
+
+    async def supabase_request(method, endpoint, **kwargs):
+        await upstream.record("supabase")
+        if method != "GET":
+            return []
+        return [{
+            "user_id": "user-1",
+            "internal_device_id": "dev-1",
+            "internal_product_id": "prod",
+            "name": "Kitchen",
+            "device_eflara": [{"address": "Main St 1", "enabled": True}],
+        }]
+
+    async def heiman_request(method, path, headers, **kwargs):
+        await upstream.record("heiman")
+        return {"message": "success", "result": {"state": {"text": "Online", "value": "online"}}}
+
+    monkeypatch.setattr(supadevices, "_make_request", supabase_request)
+    monkeypatch.setattr(heiman, "_request", heiman_request)
+    monkeypatch.setattr(main, "supadevices", supadevices)
+    monkeypatch.setattr(main, "heimanConnector", heiman)
+    main.app.dependency_overrides[main.get_authenticated_user] = lambda: "user-1"
+    return TestClient(main.app), upstream, supadevices
+
+
+def test_device_info_upstream_calls_per_request(monkeypatch):
+    client, upstream, supadevices = make_clients(monkeypatch)
+    try:
+        cold = client.get("/device/uuid-1/info").json()
+        assert cold == {"state": "online", "name": "Kitchen", "eFlara": {"address": "Main St 1", "enabled": True}}
+        assert upstream.calls == ["supabase", "heiman"]
+
+        upstream.calls.clear()
+        client.get("/device/uuid-1/info")
+        assert upstream.calls == ["heiman"]
+
+        # After an eflara change the device id is still known, so both lookups overlap
+        asyncio.run(supadevices._invalidate_eflara("uuid-1"))
+        supadevices.cache._l1[supadevices.cache._key("device", ("user-1", "uuid-1"))] = (float("inf"), {"internal_device_id": "dev-1"})
+        upstream.calls.clear()
+        upstream.max_in_flight = 0
+        client.get("/device/uuid-1/info")
+        assert sorted(upstream.calls) == ["heiman", "supabase"]
+        assert upstream.max_in_flight == 2
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_device_info_of_another_user_is_not_found(monkeypatch):
+    client, upstream, _ = make_clients(monkeypatch)
+    main.app.dependency_overrides[main.get_authenticated_user] = lambda: "user-2"
+    try:
+        assert client.get("/device/uuid-1/info").status_code == 404
+        assert upstream.calls == ["supabase"]
+    finally:
+        main.app.dependency_overrides.clear()
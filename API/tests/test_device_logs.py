@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from api import main
+
+
+class FakeHeiman:
+    def __init__(self, total=12):
+        self.total = total
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _logs(self, kind, content, pageSize, pageIndex, startTime, endTime):
+        self.calls.append((kind, pageSize, pageIndex, startTime, endTime))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        count = max(0, min(pageSize, self.total - pageIndex * pageSize))
+        return {"message": "success", "result": {"total": self.total, "data": [
+            {"type": {"value": kind}, "content": json.dumps(content)} for _ in range(count)
+        ]}}
+
+    async def getDeviceEvents(self, userID, deviceID, pageSize=5, pageIndex=0, startTime=None, endTime=None):
+        return await self._logs("event", {"event": "AlarmTest", "timestamp": 1700000000000}, pageSize, pageIndex, startTime, endTime)
+
+    async def getDeviceProperties(self, userID, deviceID, pageSize=5, pageIndex=0, startTime=None, endTime=None):
+        return await self._logs("reportProperty", {"properties": {"battery": 90}, "timestamp": 1700000000000}, pageSize, pageIndex, startTime, endTime)
+
+
+class FakeSupabase:
+    async def get_device_by_uuid(self, user_id, uuid):
+        return {"internal_device_id": "dev-1", "internal_product_id": "prod", "name": "Kitchen"}
+
+
+def make_client(monkeypatch, heiman):
+    monkeypatch.setattr(main, "heimanConnector", heiman)
+    monkeypatch.setattr(main, "supadevices", FakeSupabase())
+    main.app.dependency_overrides[main.get_authenticated_user] = lambda: "user-1"
+    return TestClient(main.app)
+
+
+def test_logs_are_fetched_concurrently_and_paged_with_cursor(monkeypatch):
+    heiman = FakeHeiman(total=12)
+    client = make_client(monkeypatch, heiman)
+    try:
+        first = client.get("/device/abc/logs", params={"pageSize": 5, "since": "2023-11-01T00:00:00Z"}).json()
+        assert heiman.max_in_flight == 2
+        assert len(first["events"]) == 5 and len(first["properties"]) == 5
+        assert first["cursor"]
+
+        _, pageSize, pageIndex, startTime, endTime = heiman.calls[0]
+        assert (pageSize, pageIndex, startTime) == (5, 0, 1698796800000)
+
+        heiman.calls.clear()
+        second = client.get("/device/abc/logs", params={"cursor": first["cursor"]}).json()
+        assert [call[1:] for call in heiman.calls] == [(5, 1, startTime, endTime)] * 2
+        assert second["cursor"]
+
+        third = client.get("/device/abc/logs", params={"cursor": second["cursor"]}).json()
+        assert len(third["events"]) == 2
+        assert third["cursor"] is None
+
+        assert client.get("/device/abc/logs", params={"cursor": "garbage"}).status_code == 400
+    finally:
+        main.app.dependency_overrides.clear()
@@ -0,0 +1,83 @@
+from fastapi.testclient import TestClient
+
+from api import main
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.calls = 0
+
+    async def list_devices_with_eflara(self, user_id):
+        self.calls += 1
+        return [
+            {"uuid": "u1", "name": "Kitchen", "internal_device_id": "d1", "eflara_enabled": True},
+            {"uuid": "u2", "name": "Hall", "internal_device_id": "d2", "eflara_enabled": False},
+            {"uuid": "u3", "name": None, "internal_device_id": "d3", "eflara_enabled": False},
+        ]
+
+
+class FakeHeiman:
+    def __init__(self, list_ok=True, listed=None):
+        self.list_ok = list_ok
+        self.listed = listed or [
+            {"deviceId": "d1", "state": {"text": "Online", "value": "online"}},
+            {"deviceId": "d2", "state": {"text": "Offline", "value": "offline"}},
+        ]
+        self.list_calls = 0
+        self.detail_calls = []
+
+    async def deviceList(self, userID, pageIndex=0, pageSize=50):
+        self.list_calls += 1
+        if not self.list_ok:
+            return {"message": "error"}
+        return {"message": "success", "result": {"total": len(self.listed), "data": self.listed}}
+
+    async def getDeviceIDDetail(self, userID, deviceID):
+        self.detail_calls.append(deviceID)
+        return {"message": "success", "result": {"state": {"text": "Online", "value": "online"}}}
+
+
+def get_status(monkeypatch, heiman):
+    supabase = FakeSupabase()
+    monkeypatch.setattr(main, "supadevices", supabase)
+    monkeypatch.setattr(main, "heimanConnector", heiman)
+    main.app.dependency_overrides[main.get_authenticated_user] = lambda: "user-1"
+    try:
+        return TestClient(main.app).get("/devices/status").json(), supabase
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_status_uses_device_list_and_fills_gaps_with_detail(monkeypatch):
+    heiman = FakeHeiman()
+    body, supabase = get_status(monkeypatch, heiman)
+
+    assert body == [
+        {"uuid": "u1", "name": "Kitchen", "state": "online", "eFlara": True},
+        {"uuid": "u2", "name": "Hall", "state": "offline", "eFlara": False},
+        {"uuid": "u3", "name": None, "state": "online", "eFlara": False},
+    ]
+    assert supabase.calls == 1
+    assert heiman.list_calls == 1
+    assert heiman.detail_calls == ["d3"]
+
+
+def test_status_falls_back_to_detail_fan_out(monkeypatch):
+    heiman = FakeHeiman(list_ok=False)
+    body, _ = get_status(monkeypatch, heiman)
+
+    assert [item["state"] for item in body] == ["online"] * 3
+    assert sorted(heiman.detail_calls) == ["d1", "d2", "d3"]
+
+
+def test_listed_entries_without_state_fall_back_to_detail(monkeypatch):
+    heiman = FakeHeiman(listed=[
+        {"deviceId": "d1", "state": {"text": "Offline", "value": "offline"}},
+        {"deviceId": "d2", "name": "Hall"},
+        {"id": "d3", "state": None},
+    ])
+    body, _ = get_status(monkeypatch, heiman)
+
+    assert [item["state"] for item in body] == ["offline", "online", "online"]
+    assert heiman.list_calls == 1
+    assert sorted(heiman.detail_calls) == ["d2", "d3"]
@@ -0,0 +1,133 @@
+import asyncio
+
+from api.dispatch.dispatchqueue import DispatchQueue
+from fakes import FakeRedis
+
+
+async def make_queue(redis, consumer, **kwargs):
+    queue = DispatchQueue(consumer=consumer, claim_idle_ms=0, **kwargs)
+    queue.redis = redis
+    await queue._ensure_group()
+    return queue
+
+
+async def drain(queue):
+    await asyncio.gather(*queue._running)
+
+
+def test_job_is_acknowledged_after_handler_and_latency_recorded():
+    async def run():
+        redis = FakeRedis()
+        queue = await make_queue(redis, "a")
+        done = []
+
+        async def notify(tokens, title, body):
+            done.append((tokens, title))
+        queue.register("notification", notify)
+
+        await queue.enqueue_many([("notification", {"tokens": ["t"], "title": "Alarm", "body": "b"})])
+        assert await queue._read_once() == 1
+        await drain(queue)
+
+        assert done == [(["t"], "Alarm")]
+        assert redis.streams["alarm_jobs"]["groups"]["alarm_dispatchers"]["pending"] == {}
+        stats = queue.stats()
+        assert stats["processed"] == 1
+        assert "notification_latency_p95_ms" in stats
+
+    asyncio.run(run())
+
+
+def test_failed_job_is_reclaimed_by_another_replica():
+    async def run():
+        redis = FakeRedis()
+        crashing = await make_queue(redis, "a")
+        healthy = await make_queue(redis, "b")
+        done = []
+
+        async def broken(**payload):
+            raise RuntimeError("pod went away")
+
+        async def eflara(tokens, device_uuid, realAlarm):
+            done.append(device_uuid)
+        crashing.register("eflara", broken)
+        healthy.register("eflara", eflara)
+
+        await crashing.enqueue("eflara", tokens=["t"], device_uuid="uuid-1", realAlarm=True)
+        await crashing._read_once()
+        await drain(crashing)
+        assert done == []
+
+        # nothing new for b, but the job a left unacknowledged is claimable
+        assert await healthy._read_once() == 0
+        assert await healthy._reclaim_once() == 1
+        await drain(healthy)
+
+        assert done == ["uuid-1"]
+        assert healthy.stats()["reclaimed"] == 1
+        assert redis.streams["alarm_jobs"]["groups"]["alarm_dispatchers"]["pending"] == {}
+
+    asyncio.run(run())
+
+
+def test_job_goes_to_dead_letter_stream_after_max_deliveries():
+    async def run():
+        redis = FakeRedis()
+        queue = await make_queue(redis, "a", max_deliveries=2)
+
+        async def broken(**payload):
+            raise RuntimeError("always fails")
+        queue.register("eflara", broken)
+
+        await queue.enqueue("eflara", tokens=[], device_uuid="uuid-1", realAlarm=False)
+        await queue._read_once()
+        await drain(queue)
+        for _ in range(3):
+            await queue._reclaim_once()
+            await drain(queue)
+
+        assert queue.stats()["dead"] == 1
+        assert len(redis.streams["alarm_jobs:dead"]["entries"]) == 1
+        assert redis.streams["alarm_jobs"]["groups"]["alarm_dispatchers"]["pending"] == {}
+
+    asyncio.run(run())
+
+
+def test_failed_job_is_retried_on_a_short_backoff_not_the_claim_idle_time():
+    async def run():
+        redis = FakeRedis()
+        queue = DispatchQueue(consumer="a", claim_idle_ms=60000, retry_backoff=0.01, max_deliveries=3)
+        queue.redis = redis
+        await queue._ensure_group()
+        attempts = []
+
+        async def flaky(tokens, title, body):
+            attempts.append(title)
+            if len(attempts) < 3:
+                raise RuntimeError("expo 503")
+        queue.register("notification", flaky)
+
+        await queue.enqueue("notification", tokens=["t"], title="ALARM", body="b")
+        await queue._read_once()
+        for _ in range(50):
+            if queue.stats()["processed"]:
+                break
+            await asyncio.sleep(0.01)
+
+        assert len(attempts) == 3
+        assert queue.stats()["retried"] == 2
+        assert redis.streams["alarm_jobs"]["groups"]["alarm_dispatchers"]["pending"] == {}
+
+        async def broken(**payload):
+            raise RuntimeError("always fails")
+        queue.register("eflara", broken)
+        await queue.enqueue("eflara", tokens=[], device_uuid="uuid-1", realAlarm=True)
+        await queue._read_once()
+        for _ in range(50):
+            if queue.stats()["dead"]:
+                break
+            await asyncio.sleep(0.01)
+        assert queue.stats()["dead"] == 1
+        assert queue.stats()["failed"] == 2 + 3
+
+    asyncio.run(run())
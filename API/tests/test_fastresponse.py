@@ -0,0 +1,68 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from api import main
+
+
+class FakeSupabase:
+    async def list_devices_for_user(self, user_id):
+        return [
+            {"uuid": "u1", "internal_product_id": "p", "name": "Kitchen", "created_at": "2024-03-01T10:00:00.123456+00:00"},
+            {"uuid": "u2", "internal_product_id": "p", "name": None, "created_at": "2024-03-01T10:00:00.12Z"},
+            {"uuid": "u3", "internal_product_id": "p", "created_at": "2024-03-01T10:00:00+02:00"},
+        ]
+
+    async def get_device_by_uuid(self, user_id, uuid):
+        return {"internal_device_id": "dev-1", "internal_product_id": "p", "name": "Kitchen"}
+
+
+class FakeHeiman:
+    def _logs(self, kind, contents):
+        return {"message": "success", "result": {"total": 40, "data": [
+            {"type": {"value": kind}, "content": content} for content in contents
+        ]}}
+
+    async def getDeviceEvents(self, *args):
+        return self._logs("event", [
+            json.dumps({"event": "SmokeCheckAlarm", "timestamp": 1700000000123}),
+            json.dumps({"event": "", "timestamp": 1700000000000}),
+            json.dumps({"event": "AlarmTest"}),
+            "not json",
+        ])
+
+    async def getDeviceProperties(self, *args):
+        return self._logs("reportProperty", [
+            json.dumps({"properties": {"BatteryPercentage": 87, "ratio": 0.5, "label": "żółw"}, "timestamp": 1700000000000}),
+            json.dumps({"timestamp": 1700000060000}),
+        ])
+
+
+def responses(monkeypatch, path):
+    monkeypatch.setattr(main, "supadevices", FakeSupabase())
+    monkeypatch.setattr(main, "heimanConnector", FakeHeiman())
+    main.app.dependency_overrides[main.get_authenticated_user] = lambda: "user-1"
+    client = TestClient(main.app)
+    try:
+        monkeypatch.setattr(main, "FAST_RESPONSES", False)
+        slow = client.get(path)
+        monkeypatch.setattr(main, "FAST_RESPONSES", True)
+        fast = client.get(path)
+    finally:
+        main.app.dependency_overrides.clear()
+    return slow, fast
+
+
+def test_fast_list_matches_response_model_output(monkeypatch):
+    slow, fast = responses(monkeypatch, "/list")
+    assert fast.status_code == slow.status_code == 200
+    assert fast.json() == slow.json()
+    assert fast.json()[1]["created_at"] == "2024-03-01T10:00:00.120000Z"
+
+
+def test_fast_logs_match_response_model_output(monkeypatch):
+    slow, fast = responses(monkeypatch, "/device/abc/logs?pageSize=5&until=2024-01-01T00:00:00Z")
+    assert fast.status_code == slow.status_code == 200
+    assert fast.json() == slow.json()
+    assert [event["name"] for event in fast.json()["events"]] == ["SmokeCheckAlarm", "AlarmTest"]
+    assert fast.json()["cursor"]
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from api import main
+from api.health.health import ReadinessChecker
+
+
+def test_checks_run_concurrently_and_a_stalled_dependency_times_out():
+    calls = []
+
+    async def ok():
+        calls.append("ok")
+        await asyncio.sleep(0.05)
+
+    async def stalled():
+        await asyncio.sleep(10)
+
+    async def broken():
+        raise ConnectionError("refused")
+
+    checker = ReadinessChecker({"redis": ok, "heiman": stalled, "postgrest": broken}, timeout=0.2)
+
+    started = time.perf_counter()
+    result = asyncio.run(checker.check())
+    assert time.perf_counter() - started < 0.5
+
+    assert result["status"] == "unready"
+    deps = result["dependencies"]
+    assert deps["redis"]["ok"] and deps["redis"]["latency_ms"] >= 50
+    assert not deps["heiman"]["ok"] and "timed out" in deps["heiman"]["error"]
+    assert deps["postgrest"] == {"ok": False, "error": "refused", "latency_ms": deps["postgrest"]["latency_ms"],
+                                 "required": True}
+
+
+def test_result_is_cached_and_concurrent_probes_share_one_check():
+    calls = []
+
+    async def ok():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+
+    checker = ReadinessChecker({"redis": ok}, cache_ttl=60)
+
+    async def run():
+        results = await asyncio.gather(*(checker.check() for _ in range(10)))
+        await checker.check()
+        return results
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result["status"] == "ready" for result in results)
+
+
+def test_optional_dependency_is_reported_without_failing_readiness():
+    async def ok():
+        pass
+
+    async def broken():
+        raise RuntimeError()
+
+    checker = ReadinessChecker({"redis": ok, "heiman": broken}, required=["redis"])
+    result = asyncio.run(checker.check())
+    assert result["status"] == "ready"
+    assert result["degraded"] == ["heiman"]
+    assert result["dependencies"]["heiman"] == {"ok": False, "error": "RuntimeError",
+                                                "latency_ms": result["dependencies"]["heiman"]["latency_ms"],
+                                                "required": False}
+
+
+def test_only_redis_and_jwks_are_required_by_default():
+    assert main.readiness.required == {"redis", "jwks"}
+    assert set(main.readiness.checks) == {"redis", "jwks", "postgrest", "heiman"}
+
+
+def test_probe_endpoints(monkeypatch):
+    async def broken():
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(main, "readiness", ReadinessChecker({"redis": broken}))
+    client = TestClient(main.app)
+
+    assert client.get("/health/live").json() == {"status": "alive"}
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["dependencies"]["redis"]["error"] == "down"
@@ -0,0 +1,22 @@
+import asyncio
+
+from api.httppool.httppool import HttpPool
+
+
+def test_one_session_per_host_and_clean_close():
+    async def run():
+        pool = HttpPool(limit_per_host=7)
+        await pool.open("https://spapi.heiman.cn")
+
+        first = pool.session("https://spapi.heiman.cn/api-saas/a")
+        second = pool.session("https://spapi.heiman.cn/api-saas/b")
+        other = pool.session("https://exp.host/--/api/v2/push/send")
+
+        assert first is second
+        assert first is not other
+        assert first.connector.limit_per_host == 7
+
+        await pool.close()
+        assert first.closed and other.closed
+
+    asyncio.run(run())
@@ -0,0 +1,216 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from api import main
+from api.routing.alarmroutes import AlarmRouteStore
+from api.routing.eventgate import EventGate
+from api.dispatch.dispatchqueue import DispatchQueue
+from api.dispatch.scheduler import DelayedScheduler
+from fakes import FakeRedis
+
+
+class FakeSupabase:
+    async def get_device_by_user_device_id(self, user, device_id, select=None):
+        if device_id == "unknown":
+            return None
+        return {"uuid": "uuid-" + device_id, "name": "Kitchen", "internal_device_id": device_id}
+
+    async def get_eflara_for_device(self, device_uuid):
+        return None
+
+    async def get_notification_tokens_for_user(self, user_id):
+        return [{"token": "ExponentPushToken[a]"}]
+
+
+def event(messageId, eventName="AlarmTest", deviceId="dev-1", data=None):
+    return {"tenant": "SH_t", "user": "SH_user-1", "eventName": eventName, "deviceId": deviceId,
+            "data": data or {}, "messageId": messageId}
+
+
+def make_client(monkeypatch):
+    redis = FakeRedis()
+    routes = AlarmRouteStore(FakeSupabase())
+    routes.attach(redis)
+    gate = EventGate(routes)
+    asyncio.run(gate.load(redis))
+    queue = DispatchQueue(consumer="test")
+    queue.redis = redis
+    asyncio.run(queue._ensure_group())
+    delayed = DelayedScheduler(queue)
+    delayed.attach(redis)
+
+    monkeypatch.setenv("INTERNAL_SECRET", "secret")
+    monkeypatch.setattr(main, "redis_client", redis)
+    monkeypatch.setattr(main, "alarm_routes", routes)
+    monkeypatch.setattr(main, "event_gate", gate)
+    monkeypatch.setattr(main, "dispatch_queue", queue)
+    monkeypatch.setattr(main, "delayed_jobs", delayed)
+    return TestClient(main.app), redis, Jobs(redis, queue, delayed)
+
+
+class Jobs:
+    """What the handlers put on the dispatch stream or scheduled for later"""
+
+    def __init__(self, redis, queue, delayed):
+        self.redis = redis
+        self.queue = queue
+        self.delayed = delayed
+
+    def __iter__(self):
+        queued = [fields for _, fields in self.redis.streams.get(self.queue.stream, {}).get("entries", [])]
+        scheduled = [json.loads(job) for job in self.redis.data.get(self.delayed.jobs_key, {}).values()]
+        for fields in queued + scheduled:
+            payload = json.loads(fields["payload"])
+            if fields["kind"] == "notification":
+                yield payload["title"]
+            else:
+                yield ("eflara", payload["device_uuid"], payload["realAlarm"])
+
+    def count(self, item):
+        return list(self).count(item)
+
+
+def smoke(messageId, deviceId="dev-2"):
+    return event(messageId, eventName="SmokeCheckAlarm", deviceId=deviceId, data={"SmokeSensorState": 1})
+
+
+def test_batch_returns_result_per_item_with_one_dedup_round_trip(monkeypatch):
+    client, redis, sent = make_client(monkeypatch)
+    headers = {"X-Internal-Secret": "secret"}
+    # warm the route cache
+    client.post("/internal/events", json=[event("w1"), event("w2", deviceId="dev-2")], headers=headers)
+    redis.round_trips = 0
+
+    batch = [event("m1"), event("m1"), smoke("m2"), smoke("m3"), event("m4", deviceId="unknown")]
+    response = client.post("/internal/events", json=batch, headers=headers)
+
+    assert response.json() == [
+        {"messageId": "m1", "status": "event received"},
+        {"messageId": "m1", "status": "duplicate"},
+        {"messageId": "m2", "status": "event received"},
+        {"messageId": "m3", "status": "event received"},
+        {"messageId": "m4", "status": "unknown device"},
+    ]
+    # one pipeline of gate scripts, the route lookup of the unknown device,
+    # then the XADD and schedule pipelines (sent concurrently)
+    assert redis.round_trips == 4
+    assert sent.count("ALARM! Wykryto dym!") == 1
+    assert ("eflara", "uuid-dev-2", True) in sent
+
+
+def test_single_event_is_one_round_trip_once_route_is_cached(monkeypatch):
+    client, redis, sent = make_client(monkeypatch)
+    headers = {"X-Internal-Secret": "secret"}
+
+    # cold route: gate, route lookup + backfill, then the smoke lock is taken outside the script
+    assert client.post("/internal/event", json=smoke("m1"), headers=headers).json() == {"status": "event received"}
+    assert ("eflara", "uuid-dev-2", True) in sent
+
+    redis.round_trips = 0
+    assert client.post("/internal/event", json=smoke("m2"), headers=headers).json() == {"status": "event received"}
+    assert client.post("/internal/event", json=smoke("m2"), headers=headers).json() == {"status": "duplicate"}
+    # repeat smoke alarm is suppressed inside the gate, the duplicate stops at it
+    assert redis.round_trips == 2
+    assert sent.count("ALARM! Wykryto dym!") == 1
+
+    redis.round_trips = 0
+    client.post("/internal/event", json=event("m3", deviceId="dev-2"), headers=headers)
+    # gate + XADD and schedule pipelines
+    assert redis.round_trips == 3
+
+
+def test_gate_reloads_script_after_redis_restart(monkeypatch):
+    client, redis, _ = make_client(monkeypatch)
+    redis.scripts.clear()
+
+    response = client.post("/internal/event", json=event("m1"), headers={"X-Internal-Secret": "secret"})
+    assert response.json() == {"status": "event received"}
+
+
+def test_batch_requires_internal_secret(monkeypatch):
+    client, _, _ = make_client(monkeypatch)
+    assert client.post("/internal/events", json=[event("m1")]).status_code == 403
+
+
+def test_events_are_not_acknowledged_when_the_queue_is_down(monkeypatch):
+    client, redis, sent = make_client(monkeypatch)
+
+    async def broken(jobs):
+        raise main.redis.ConnectionError("down")
+    monkeypatch.setattr(main.dispatch_queue, "enqueue_many", broken)
+
+    response = client.post("/internal/event", json=event("m1"), headers={"X-Internal-Secret": "secret"})
+    assert response.status_code == 503
+    # the bridge retry must not be treated as a duplicate
+    assert "event_lock_SH_user-1_m1" not in redis.data
+
+
+def test_smoke_alarm_retried_after_a_failed_enqueue_still_alerts(monkeypatch):
+    client, redis, sent = make_client(monkeypatch)
+    headers = {"X-Internal-Secret": "secret"}
+    enqueue = main.dispatch_queue.enqueue_many
+
+    async def broken(jobs):
+        raise main.redis.ConnectionError("down")
+
+    # cold route: the smoke lock is taken by a SET after the lookup; warm: inside the gate script
+    for alarms, messageId in enumerate(("cold", "warm"), start=1):
+        monkeypatch.setattr(main.dispatch_queue, "enqueue_many", broken)
+        assert client.post("/internal/event", json=smoke(messageId), headers=headers).status_code == 503
+        assert "smoke_event_lock_SH_user-1_uuid-dev-2" not in redis.data
+
+        monkeypatch.setattr(main.dispatch_queue, "enqueue_many", enqueue)
+        assert client.post("/internal/event", json=smoke(messageId), headers=headers).json() == {"status": "event received"}
+        assert sent.count("ALARM! Wykryto dym!") == alarms
+        # let the next alarm through the repeat window
+        del redis.data["smoke_event_lock_SH_user-1_uuid-dev-2"]
+
+
+def test_batch_smoke_alarm_retried_after_a_failed_enqueue_still_alerts(monkeypatch):
+    client, redis, sent = make_client(monkeypatch)
+    headers = {"X-Internal-Secret": "secret"}
+    enqueue = main.dispatch_queue.enqueue_many
+
+    async def broken(jobs):
+        raise main.redis.ConnectionError("down")
+    monkeypatch.setattr(main.dispatch_queue, "enqueue_many", broken)
+    assert client.post("/internal/events", json=[smoke("m1"), event("m2")], headers=headers).status_code == 503
+
+    monkeypatch.setattr(main.dispatch_queue, "enqueue_many", enqueue)
+    response = client.post("/internal/events", json=[smoke("m1"), event("m2")], headers=headers)
+    assert [item["status"] for item in response.json()] == ["event received"] * 2
+    assert sent.count("ALARM! Wykryto dym!") == 1
+
+
+def test_failed_single_event_releases_its_lock(monkeypatch):
+    _, redis, sent = make_client(monkeypatch)
+    client = TestClient(main.app, raise_server_exceptions=False)
+    lookup = main.alarm_routes.get
+
+    async def broken(user, device_id):
+        raise RuntimeError("postgrest down")
+    monkeypatch.setattr(main.alarm_routes, "get", broken)
+
+    response = client.post("/internal/event", json=event("m1"), headers={"X-Internal-Secret": "secret"})
+    assert response.status_code == 500
+    assert "event_lock_SH_user-1_m1" not in redis.data
+
+    monkeypatch.setattr(main.alarm_routes, "get", lookup)
+    response = client.post("/internal/event", json=event("m1"), headers={"X-Internal-Secret": "secret"})
+    assert response.json() == {"status": "event received"}
+    assert sent.count("Wykryto dym! (TEST)") == 1
+
+
+def test_cleared_alarm_cancels_pending_eflara(monkeypatch):
+    client, redis, sent = make_client(monkeypatch)
+    headers = {"X-Internal-Secret": "secret"}
+
+    client.post("/internal/event", json=smoke("m1"), headers=headers)
+    assert ("eflara", "uuid-dev-2", True) in sent
+
+    cleared = event("m2", eventName="SmokeCheckAlarm", deviceId="dev-2", data={"SmokeSensorState": 0})
+    assert client.post("/internal/event", json=cleared, headers=headers).json() == {"status": "event received"}
+    assert ("eflara", "uuid-dev-2", True) not in sent
+    assert main.delayed_jobs.stats()["cancelled"] == 1
@@ -0,0 +1,29 @@
+import json
+import logging
+
+from api.jsonlog.jsonlog import JsonFormatter, SamplingFilter, parse_sampling
+
+
+def record(msg, level=logging.INFO, **extra):
+    entry = logging.LogRecord("api.test", level, __file__, 1, msg, (), None)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def test_json_line_carries_extra_fields():
+    line = json.loads(JsonFormatter().format(record("Processing event", messageId="m1", event={"deviceId": "d"})))
+    assert line["level"] == "INFO"
+    assert line["logger"] == "api.test"
+    assert line["msg"] == "Processing event"
+    assert line["messageId"] == "m1"
+    assert line["event"] == {"deviceId": "d"}
+
+
+def test_sampling_keeps_one_in_n_but_never_drops_warnings():
+    sampler = SamplingFilter(parse_sampling("event=3, push=1"))
+
+    kept = [sampler.filter(record("e", sample="event")) for _ in range(6)]
+    assert kept == [True, False, False, True, False, False]
+    assert sampler.filter(record("w", level=logging.WARNING, sample="event"))
+    assert all(sampler.filter(record("p", sample="push")) for _ in range(3))
+    assert sampler.filter(record("plain"))
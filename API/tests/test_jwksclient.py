@@ -0,0 +1,114 @@
+import asyncio
+import base64
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from fastapi import HTTPException
+
+from api.supajwks.jwksclient import JWKSClient
+
+EC_KEY = {
+    "kty": "EC",
+    "crv": "P-256",
+    "kid": "key-1",
+    "x": "f83OJ3D2xF1Bg8vub9tLe1gHMzV76e8Tus9uPHvRVEU",
+    "y": "x_FEzRu9m36HLN_tue659LNpXW6pCyStikYjKIWI5a0",
+}
+
+
+class FakeJWKSClient(JWKSClient):
+    def __init__(self, jwks, **kwargs):
+        super().__init__("https://example.invalid/jwks.json", pool=None, **kwargs)
+        self.jwks = jwks
+        self.fetches = 0
+        self.gate = None
+
+    async def _fetch(self):
+        self.fetches += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        return self.jwks
+
+
+def test_concurrent_refreshes_share_one_fetch():
+    async def run():
+        client = FakeJWKSClient({"keys": [EC_KEY]})
+        client.gate = asyncio.Event()
+        waiters = [asyncio.create_task(client.get_jwks()) for _ in range(10)]
+        await asyncio.sleep(0)
+        client.gate.set()
+        results = await asyncio.gather(*waiters)
+        assert client.fetches == 1
+        assert all(result == {"keys": [EC_KEY]} for result in results)
+
+    asyncio.run(run())
+
+
+def test_stale_keys_are_served_while_refreshing():
+    async def run():
+        client = FakeJWKSClient({"keys": [EC_KEY]}, cache_duration=60)
+        await client.get_jwks()
+        client._cache_timestamp -= 120
+        client.jwks = {"keys": []}
+        client.gate = asyncio.Event()
+
+        stale = await client.get_jwks()
+        assert stale == {"keys": [EC_KEY]}
+        await asyncio.sleep(0)
+        assert client.fetches == 2
+
+        client.gate.set()
+        await client._inflight
+        assert await client.get_jwks() == {"keys": []}
+
+    asyncio.run(run())
+
+
+def test_unknown_kid_refetch_is_rate_limited():
+    async def run():
+        client = FakeJWKSClient({"keys": [EC_KEY]}, min_refetch_interval=30)
+        assert await client.get_signing_key("key-1")
+
+        for _ in range(5):
+            with pytest.raises(HTTPException) as error:
+                await client.get_signing_key("rotated")
+            assert error.value.status_code == 401
+
+        assert client.fetches == 2
+        assert client._jwks_cache == {"keys": [EC_KEY]}
+
+    asyncio.run(run())
+
+
+def test_parsed_key_objects_are_cached_per_kid():
+    async def run():
+        client = FakeJWKSClient({"keys": [EC_KEY]})
+        first = await client.get_signing_key("key-1")
+        second = await client.get_signing_key("key-1")
+
+        assert isinstance(first, ec.EllipticCurvePublicKey)
+        assert first is second
+        assert client.key_cache_stats() == {"size": 1, "hits": 1, "misses": 1}
+
+    asyncio.run(run())
+
+
+def test_rsa_jwk_loads_as_public_key():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    numbers = private_key.public_key().public_numbers()
+
+    def b64(value: int) -> str:
+        raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+        return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+    jwk = {"kty": "RSA", "kid": "rsa-1", "n": b64(numbers.n), "e": b64(numbers.e)}
+    token = jwt.encode({"sub": "user", "exp": int(time.time()) + 60}, private_key, algorithm="RS256", headers={"kid": "rsa-1"})
+
+    async def run():
+        client = FakeJWKSClient({"keys": [jwk]})
+        key = await client.get_signing_key("rsa-1")
+        assert jwt.decode(token, key, algorithms=["RS256"])["sub"] == "user"
+
+    asyncio.run(run())
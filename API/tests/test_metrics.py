@@ -0,0 +1,126 @@
+import asyncio
+
+import redis.asyncio as redis
+from fastapi.testclient import TestClient
+
+from api import main
+from api.cache.twotiercache import TwoTierCache
+from api.metrics.metrics import Registry, UPSTREAM_SECONDS, REDIS_SECONDS, REDIS_BLOCKING_SECONDS, instrumented
+from api.metrics.redismetrics import InstrumentedRedis
+from api.supaconnector.supaconnector import SupabaseDevicesClient
+
+
+def test_histogram_buckets_are_cumulative_and_labels_escaped():
+    registry = Registry()
+    latency = registry.histogram("x_seconds", "test", ("route",), buckets=(0.1, 1.0))
+    latency.observe(0.05, 'a"b')
+    latency.observe(0.5, 'a"b')
+    latency.observe(5, 'a"b')
+
+    lines = registry.render().splitlines()
+    assert 'x_seconds_bucket{route="a\\"b",le="0.1"} 1' in lines
+    assert 'x_seconds_bucket{route="a\\"b",le="1.0"} 2' in lines
+    assert 'x_seconds_bucket{route="a\\"b",le="+Inf"} 3' in lines
+    assert 'x_seconds_count{route="a\\"b"} 3' in lines
+
+
+def test_instrumented_times_public_coroutines_with_outcome():
+    @instrumented("testupstream")
+    class Client:
+        async def fetch(self):
+            return 1
+
+        async def fail(self):
+            raise RuntimeError()
+
+    async def run():
+        client = Client()
+        assert await client.fetch() == 1
+        try:
+            await client.fail()
+        except RuntimeError:
+            pass
+
+    asyncio.run(run())
+    assert UPSTREAM_SECONDS._values[("testupstream", "fetch", "ok")][0][0] == 1
+    assert sum(UPSTREAM_SECONDS._values[("testupstream", "fail", "error")][0]) == 1
+
+
+class FakeBacklog:
+    def stats(self):
+        return {"in_flight": 2}
+
+    async def backlog(self):
+        return {"pending": 3, "lag": 4, "scheduled": 5, "overdue": 0}
+
+
+def test_metrics_endpoint_reports_routes_by_template_and_backlog(monkeypatch):
+    monkeypatch.setenv("INTERNAL_SECRET", "secret")
+    monkeypatch.setattr(main, "dispatch_queue", FakeBacklog())
+    monkeypatch.setattr(main, "delayed_jobs", FakeBacklog())
+    client = TestClient(main.app)
+
+    assert client.get("/internal/metrics").status_code == 403
+    client.get("/device/some-uuid/info")
+    body = client.get("/internal/metrics", headers={"X-Internal-Secret": "secret"}).text
+
+    assert 'bbsmart_http_request_seconds_count{route="/device/{device_uuid}/info",method="GET",status="403"}' in body
+    assert "some-uuid" not in body
+    assert 'bbsmart_dispatch_backlog{state="pending"} 3' in body
+    assert 'bbsmart_http_requests_in_flight{route="/internal/metrics"} 1' in body
+
+
+class OneRowPool:
+    def session(self, url):
+        return self
+
+    def request(self, method, url, headers=None, **kwargs):
+        return OneRow()
+
+
+class OneRow:
+    status = 200
+    headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def text(self):
+        return '[{"name": "Kitchen"}]'
+
+
+def test_cache_hits_are_not_recorded_as_supabase_latency():
+    supadevices = SupabaseDevicesClient("https://supabase", "key", OneRowPool(), cache=TwoTierCache())
+    key = ("supabase", "GET devices", "ok")
+    before = sum(UPSTREAM_SECONDS._values[key][0]) if key in UPSTREAM_SECONDS._values else 0
+
+    async def run():
+        for _ in range(3):
+            assert await supadevices.get_device_by_uuid("user-1", "uuid-1") == {"name": "Kitchen"}
+
+    asyncio.run(run())
+    assert sum(UPSTREAM_SECONDS._values[key][0]) == before + 1
+
+
+def test_blocking_redis_reads_are_kept_out_of_command_latency(monkeypatch):
+    async def answer(self, *args, **options):
+        return []
+    monkeypatch.setattr(redis.Redis, "execute_command", answer)
+    client = InstrumentedRedis()
+
+    def count(histogram, command):
+        values = histogram._values.get((command, "ok"))
+        return sum(values[0]) if values else 0
+
+    before = count(REDIS_SECONDS, "XREADGROUP"), count(REDIS_BLOCKING_SECONDS, "XREADGROUP")
+
+    async def run():
+        await client.xreadgroup("group", "consumer", {"block": ">"}, count=10, block=5000)
+        await client.xreadgroup("group", "consumer", {"block": ">"}, count=10)
+
+    asyncio.run(run())
+    assert count(REDIS_SECONDS, "XREADGROUP") == before[0] + 1
+    assert count(REDIS_BLOCKING_SECONDS, "XREADGROUP") == before[1] + 1
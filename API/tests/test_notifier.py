@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from api.notifier.notifier import PushDispatcher, NotificationRequest, PushDeliveryError, processNotification
+
+
+class FakeResponse:
+    status = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self):
+        return self.payload
+
+
+class FakeExpo:
+    def __init__(self):
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def session(self, url):
+        return self
+
+    def post(self, url, headers=None, json=None):
+        self.batches.append(json)
+        expo = self
+
+        class Call(FakeResponse):
+            async def __aenter__(self):
+                expo.in_flight += 1
+                expo.max_in_flight = max(expo.max_in_flight, expo.in_flight)
+                await asyncio.sleep(0.01)
+                expo.in_flight -= 1
+                return self
+
+        tickets = []
+        for message in json:
+            if "bad" in message["to"]:
+                tickets.append({"status": "error", "message": "not registered", "details": {"error": "DeviceNotRegistered"}})
+            else:
+                tickets.append({"status": "ok", "id": "ticket-" + message["to"]})
+        return Call({"data": tickets})
+
+
+def test_dispatch_batches_and_returns_ticket_per_token():
+    expo = FakeExpo()
+    dispatcher = PushDispatcher(expo, concurrency=2)
+    tokens = [f"ExponentPushToken[{i}]" for i in range(250)] + ["ExponentPushToken[bad]"]
+
+    tickets = asyncio.run(dispatcher.dispatch(NotificationRequest(title="t", body="b", tokens=tokens)))
+
+    assert [len(batch) for batch in expo.batches] == [100, 100, 51]
+    assert expo.max_in_flight == 2
+    assert [ticket.token for ticket in tickets] == tokens
+    assert tickets[0].status == "ok" and tickets[0].id == "ticket-ExponentPushToken[0]"
+    assert tickets[-1].status == "error" and tickets[-1].details == {"error": "DeviceNotRegistered"}
+
+
+def test_request_level_error_marks_whole_chunk():
+    class FailingExpo(FakeExpo):
+        def post(self, url, headers=None, json=None):
+            return FakeResponse({"errors": [{"code": "PUSH_TOO_MANY_EXPERIENCE_IDS"}]})
+
+    tickets = asyncio.run(PushDispatcher(FailingExpo()).dispatch(NotificationRequest(title="t", body="b", tokens=["a", "b"])))
+
+    assert [ticket.status for ticket in tickets] == ["error", "error"]
+
+
+def test_failed_chunk_is_resent_with_backoff():
+    class FlakyExpo(FakeExpo):
+        def post(self, url, headers=None, json=None):
+            if len(self.batches) == 0:
+                self.batches.append(json)
+                return FakeResponse({"errors": [{"code": "INTERNAL_SERVER_ERROR"}]})
+            return super().post(url, headers, json)
+
+    expo = FlakyExpo()
+    tickets = asyncio.run(PushDispatcher(expo, retry_backoff=0.01).dispatch(
+        NotificationRequest(title="t", body="b", tokens=["a", "b"])))
+
+    assert len(expo.batches) == 2
+    assert [ticket.status for ticket in tickets] == ["ok", "ok"]
+
+
+def test_undelivered_push_raises_so_the_job_stays_pending():
+    class DownExpo(FakeExpo):
+        def post(self, url, headers=None, json=None):
+            self.batches.append(json)
+            raise ConnectionError("expo unreachable")
+
+    expo = DownExpo()
+    dispatcher = PushDispatcher(expo, retries=2, retry_backoff=0.01)
+    with pytest.raises(PushDeliveryError) as raised:
+        asyncio.run(processNotification(NotificationRequest(title="t", body="b", tokens=["a", "b"]), dispatcher))
+
+    assert len(expo.batches) == 3
+    assert [ticket.token for ticket in raised.value.tickets] == ["a", "b"]
+
+
+def test_per_token_errors_are_final():
+    tickets = asyncio.run(processNotification(
+        NotificationRequest(title="t", body="b", tokens=["ExponentPushToken[bad]"]), PushDispatcher(FakeExpo())))
+    assert tickets[0].status == "error" and not tickets[0].retryable
@@ -0,0 +1,166 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from api import main
+from api.cache.twotiercache import TwoTierCache
+from api.heiman.heimanconnector import HeimanConnector
+from api.registration.registration import DeviceRegistrar
+from api.resilience.resilience import DeadlineExceeded, deadline, remaining
+from api.routing.alarmroutes import AlarmRouteStore
+from api.supaconnector.supaconnector import SupabaseDevicesClient
+from fakes import FakeRedis
+
+MAX_UPSTREAM_CALLS = 5
+
+
+class FakeUpstreams:
+    """Heiman and PostgREST behind the connectors, recording every call"""
+
+    def __init__(self):
+        self.calls = []
+        self.rows = {}
+        self.known = {"AA:BB": "dev-1"}
+        self.bind_delay = 0.01
+        self.refuse_bind = set()
+
+    async def heiman(self, method, path, headers, **kwargs):
+        self.calls.append(("heiman", path.rsplit("/", 1)[-1]))
+        await asyncio.sleep(self.bind_delay if path.endswith("/bind") else 0.01)
+        if path.endswith("nameByDevice"):
+            mac = path.split("/")[-2]
+            return {"message": "success", "result": [{"id": self.known[mac]}] if mac in self.known else []}
+        if path.endswith("/bind") and headers["Tenant-Id"] in self.refuse_bind:
+            return {"message": "device is offline"}
+        return {"message": "success", "result": True}
+
+    async def remove(self, user_id, device_id):
+        self.calls.append(("supabase", "devices"))
+        if self.rows.get(device_id, {}).get("user_id") != user_id:
+            return False
+        del self.rows[device_id]
+        return True
+
+    async def supabase(self, method, endpoint, **kwargs):
+        self.calls.append(("supabase", endpoint.split("?")[0]))
+        # what Upstream.call does with an exhausted request deadline
+        if remaining() is not None and remaining() <= 0:
+            raise DeadlineExceeded("No time left for supabase")
+        await asyncio.sleep(0.01)
+        if method == "GET":
+            device_id = endpoint.split("internal_device_id=eq.")[1].split("&")[0]
+            return [self.rows[device_id]] if device_id in self.rows else []
+        params = kwargs["json"]
+        previous = self.rows.pop(params["p_device_id"], None)
+        created = {"user_id": params["p_user_id"], "internal_device_id": params["p_device_id"], "name": "Device",
+                   "uuid": f"uuid-{len(self.calls)}", "created_at": "2026-10-17T10:00:00+00:00"}
+        self.rows[params["p_device_id"]] = created
+        return {"device": created, "previous": [previous] if previous else []}
+
+
+def make_client(monkeypatch):
+    upstreams = FakeUpstreams()
+    redis = FakeRedis()
+    supadevices = SupabaseDevicesClient("https://supabase.invalid", "key", pool=None, cache=TwoTierCache())
+    heiman = HeimanConnector("https://heiman.invalid", "id", "secret", pool=None)
+    monkeypatch.setattr(supadevices, "_make_request", upstreams.supabase)
+    monkeypatch.setattr(heiman, "_request", upstreams.heiman)
+    monkeypatch.setattr(supadevices, "remove_device_from_user", upstreams.remove)
+    alarm_routes = AlarmRouteStore(supadevices)
+    alarm_routes.attach(redis)
+    registrar = DeviceRegistrar(heiman, supadevices, alarm_routes)
+    registrar.attach(redis)
+    monkeypatch.setattr(main, "device_registrar", registrar)
+    return TestClient(main.app), upstreams, redis
+
+
+def register(client, user, mac="AA:BB"):
+    main.app.dependency_overrides[main.get_authenticated_user] = lambda: user
+    return client.post("/register_device", json={"deviceName": mac, "productID": "prod"})
+
+
+def test_register_paths_stay_within_upstream_budget(monkeypatch):
+    client, upstreams, redis = make_client(monkeypatch)
+    try:
+        response = register(client, "user-1")
+        assert response.status_code == 200
+        assert upstreams.calls == [("heiman", "nameByDevice"), ("supabase", "devices"),
+                                   ("heiman", "bind"), ("supabase", "rpc/register_device")]
+        assert redis.data["alarm_route:user-1:dev-1"]["uuid"] == response.json()["uuid"]
+
+        upstreams.calls.clear()
+        response = register(client, "user-2")
+        assert response.status_code == 200
+        assert upstreams.calls == [("heiman", "nameByDevice"), ("supabase", "devices"), ("heiman", "unbind"),
+                                   ("heiman", "bind"), ("supabase", "rpc/register_device")]
+        assert len(upstreams.calls) == MAX_UPSTREAM_CALLS
+        assert "alarm_route:user-1:dev-1" not in redis.data
+        assert redis.data["alarm_route:user-2:dev-1"]["uuid"] == response.json()["uuid"]
+
+        upstreams.calls.clear()
+        assert register(client, "user-2", mac="CC:DD").status_code == 404
+        assert upstreams.calls == [("heiman", "nameByDevice")]
+        assert not [key for key in redis.data if key.startswith("register_lock:")]
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_double_tap_does_the_upstream_work_once(monkeypatch):
+    _, upstreams, _ = make_client(monkeypatch)
+
+    async def run():
+        return await asyncio.gather(*(main.device_registrar.register("user-1", "prod", "AA:BB", "AA:BB")
+                                      for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert sum(isinstance(result, dict) for result in results) == 1
+    assert sorted(getattr(result, "status_code", 200) for result in results) == [200, 409, 409]
+    assert len(upstreams.calls) == 4
+
+
+def test_rows_follow_a_bind_that_used_up_the_request_deadline(monkeypatch):
+    _, upstreams, redis = make_client(monkeypatch)
+    upstreams.bind_delay = 0.1
+
+    async def run():
+        with deadline(0.05):
+            return await main.device_registrar.register("user-1", "prod", "AA:BB", "AA:BB")
+
+    created = asyncio.run(run())
+    assert upstreams.rows["dev-1"]["user_id"] == "user-1"
+    assert redis.data["alarm_route:user-1:dev-1"]["uuid"] == created["uuid"]
+
+
+def test_failed_takeover_binds_the_device_back_to_its_owner(monkeypatch):
+    client, upstreams, redis = make_client(monkeypatch)
+    try:
+        assert register(client, "user-1").status_code == 200
+        upstreams.calls.clear()
+        upstreams.refuse_bind.add("SH_user-2")
+
+        assert register(client, "user-2").status_code == 500
+        assert upstreams.calls == [("heiman", "nameByDevice"), ("supabase", "devices"), ("heiman", "unbind"),
+                                   ("heiman", "bind"), ("heiman", "bind")]
+        assert upstreams.rows["dev-1"]["user_id"] == "user-1"
+        assert "alarm_route:user-1:dev-1" in redis.data
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_failed_takeover_that_cannot_be_undone_drops_the_previous_owner(monkeypatch):
+    client, upstreams, redis = make_client(monkeypatch)
+    try:
+        assert register(client, "user-1").status_code == 200
+        upstreams.refuse_bind.update({"SH_user-1", "SH_user-2"})
+
+        assert register(client, "user-2").status_code == 500
+        assert "dev-1" not in upstreams.rows
+        assert "alarm_route:user-1:dev-1" not in redis.data
+
+        # nothing claims the device any more, so the next attempt is a plain bind
+        upstreams.refuse_bind.clear()
+        upstreams.calls.clear()
+        assert register(client, "user-2").status_code == 200
+        assert ("heiman", "unbind") not in upstreams.calls
+    finally:
+        main.app.dependency_overrides.clear()
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import main
+from api.resilience.resilience import (CircuitBreaker, CircuitOpenError, DeadlineExceeded, Upstream, deadline,
+                                       remaining)
+from api.supaconnector.supaconnector import SupabaseDevicesClient
+
+
+def test_breaker_fails_fast_then_probes_half_open():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record(False)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    time.sleep(0.06)
+    breaker.allow()
+    assert breaker.state == "half_open"
+    # only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.stats() == {"state": "closed", "consecutive_failures": 0, "opened": 2, "rejected": 2}
+
+
+def test_request_deadline_reaches_calls_in_child_tasks():
+    upstream = Upstream("slow", timeout=10)
+
+    async def stalled():
+        await asyncio.sleep(5)
+
+    async def run():
+        with deadline(0.1):
+            with deadline(5):
+                assert remaining() <= 0.1
+            started = time.perf_counter()
+            results = await asyncio.gather(upstream.call(stalled), upstream.call(stalled), return_exceptions=True)
+            return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(run())
+    assert all(isinstance(result, DeadlineExceeded) for result in results)
+    assert elapsed < 0.5
+
+
+def test_slow_read_is_hedged_and_the_loser_cancelled():
+    upstream = Upstream("reads", hedge=True, hedge_min=0.01, min_samples=5)
+    cancelled = []
+    calls = 0
+
+    async def read():
+        nonlocal calls
+        calls += 1
+        if calls == 6:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        await asyncio.sleep(0.005)
+        return calls
+
+    async def run():
+        for _ in range(5):
+            await upstream.call(read, hedge=True)
+        started = time.perf_counter()
+        result = await upstream.call(read, hedge=True)
+        await asyncio.sleep(0)
+        return result, time.perf_counter() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result == 7
+    assert elapsed < 0.5
+    assert cancelled == [True]
+    assert upstream.stats()["hedged"] == upstream.stats()["hedge_wins"] == 1
+
+
+class StalledPool:
+    def session(self, url):
+        return self
+
+    def request(self, method, url, **kwargs):
+        class Stalled:
+            async def __aenter__(self):
+                await asyncio.sleep(5)
+
+            async def __aexit__(self, *args):
+                return False
+        return Stalled()
+
+
+def test_stalled_upstream_times_out_then_fails_fast(monkeypatch):
+    upstream = Upstream("supabase", timeout=0.05, breaker=CircuitBreaker("supabase", failure_threshold=2))
+    monkeypatch.setattr(main, "supadevices", SupabaseDevicesClient("https://supabase", "key", StalledPool(), upstream=upstream))
+    main.app.dependency_overrides[main.get_authenticated_user] = lambda: "user-1"
+    try:
+        client = TestClient(main.app)
+        assert [client.get("/list").status_code for _ in range(2)] == [504, 504]
+
+        started = time.perf_counter()
+        response = client.get("/list")
+        assert time.perf_counter() - started < 0.05
+        assert response.status_code == 503
+        assert response.json() == {"detail": "UPSTREAM_UNAVAILABLE", "upstream": "supabase"}
+        assert int(response.headers["Retry-After"]) >= 1
+    finally:
+        main.app.dependency_overrides.clear()
@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+from api.dispatch.dispatchqueue import DispatchQueue
+from api.dispatch.scheduler import DelayedScheduler
+from fakes import FakeRedis
+
+
+def make_scheduler():
+    redis = FakeRedis()
+    queue = DispatchQueue(consumer="test")
+    queue.redis = redis
+    scheduler = DelayedScheduler(queue)
+    scheduler.attach(redis)
+    return scheduler, redis
+
+
+def stream_payloads(redis, scheduler):
+    return [json.loads(fields["payload"]) for _, fields in redis._stream(scheduler.queue.stream)["entries"]]
+
+
+def test_only_due_jobs_reach_the_dispatch_stream():
+    async def run():
+        scheduler, redis = make_scheduler()
+        await scheduler.schedule("eflara:a", "eflara", 0, device_uuid="a")
+        await scheduler.schedule("eflara:b", "eflara", 60, device_uuid="b")
+
+        assert await scheduler.fire_due() == 1
+        assert stream_payloads(redis, scheduler) == [{"device_uuid": "a"}]
+        backlog = await scheduler.backlog()
+        assert backlog["scheduled"] == 1 and backlog["overdue"] == 0
+        assert 0 < backlog["next_due_in_s"] <= 60
+
+    asyncio.run(run())
+
+
+def test_same_id_replaces_and_cancel_removes():
+    async def run():
+        scheduler, redis = make_scheduler()
+        await scheduler.schedule("eflara:a", "eflara", 0, device_uuid="a", realAlarm=False)
+        await scheduler.schedule("eflara:a", "eflara", 0, device_uuid="a", realAlarm=True)
+        await scheduler.schedule("eflara:b", "eflara", 0, device_uuid="b")
+
+        assert await scheduler.cancel("eflara:b") == 1
+        assert await scheduler.cancel("eflara:b") == 0
+        assert await scheduler.fire_due() == 1
+        assert stream_payloads(redis, scheduler) == [{"device_uuid": "a", "realAlarm": True}]
+        assert redis.data[scheduler.jobs_key] == {}
+
+    asyncio.run(run())
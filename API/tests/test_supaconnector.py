@@ -0,0 +1,140 @@
+import asyncio
+
+from api.cache.twotiercache import TwoTierCache
+from api.metrics.metrics import UPSTREAM_RESPONSE_BYTES
+from api.supaconnector.supaconnector import SupabaseDevicesClient, OWNER_COLUMNS
+from fakes import FakeRedis
+
+
+class FakeResponse:
+    def __init__(self, status, body="", headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def text(self):
+        return self.body
+
+
+class RecordingPool:
+    """PostgREST that answers every write with the given response and records what was asked"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def session(self, url):
+        return self
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append((method, url.split("/rest/v1/")[1], headers["Prefer"], kwargs.get("json")))
+        return self.responses.pop(0)
+
+    def delete(self, url, headers=None, json=None):
+        self.requests.append(("DELETE", url.split("/auth/v1/")[1], None, json))
+        return self.responses.pop(0)
+
+
+def client(*responses, cache=None):
+    pool = RecordingPool(*responses)
+    return SupabaseDevicesClient("https://supabase", "key", pool, cache=cache), pool
+
+
+def test_eflara_writes_are_one_round_trip_without_a_body():
+    supadevices, pool = client(FakeResponse(201), FakeResponse(204, headers={"Content-Range": "*/1"}),
+                               FakeResponse(204, headers={"Content-Range": "*/0"}))
+
+    async def run():
+        await supadevices.set_eflara_for_device("uuid-1", "Main St 1", True)
+        return await supadevices.toggle_eflara_for_device("uuid-1", False), \
+            await supadevices.toggle_eflara_for_device("uuid-2", False)
+
+    assert asyncio.run(run()) == (True, False)
+    assert pool.requests == [
+        ("POST", "device_eflara?on_conflict=device_uuid", "resolution=merge-duplicates,return=minimal",
+         [{"device_uuid": "uuid-1", "address": "Main St 1", "enabled": True}]),
+        ("PATCH", "device_eflara?device_uuid=eq.uuid-1", "return=minimal,count=exact", {"enabled": False}),
+        ("PATCH", "device_eflara?device_uuid=eq.uuid-2", "return=minimal,count=exact", {"enabled": False}),
+    ]
+
+
+def test_duplicate_notification_token_is_ignored_by_postgrest():
+    supadevices, pool = client(FakeResponse(201))
+    assert asyncio.run(supadevices.add_notification_token("user-1", "ExponentPushToken[x]")) is None
+    assert pool.requests == [("POST", "notifications?on_conflict=user_id,token",
+                              "resolution=ignore-duplicates,return=minimal",
+                              [{"user_id": "user-1", "token": "ExponentPushToken[x]"}])]
+
+
+def test_remove_device_is_a_single_counted_delete():
+    supadevices, pool = client(FakeResponse(200, '[{"uuid": "uuid-1"}]', {"Content-Range": "0-0/1"}),
+                               FakeResponse(200, "[]", {"Content-Range": "*/0"}))
+
+    async def run():
+        return await supadevices.remove_device_from_user("user-1", "dev-1"), \
+            await supadevices.remove_device_from_user("user-1", "dev-2")
+
+    assert asyncio.run(run()) == (True, False)
+    assert [request[:3] for request in pool.requests] == [
+        ("DELETE", "devices?user_id=eq.user-1&internal_device_id=eq.dev-1&select=uuid", "return=representation,count=exact"),
+        ("DELETE", "devices?user_id=eq.user-1&internal_device_id=eq.dev-2&select=uuid", "return=representation,count=exact"),
+    ]
+
+
+def test_existence_probes_are_bodyless_heads():
+    supadevices, pool = client(FakeResponse(200, headers={"Content-Range": "0-0/1"}),
+                               FakeResponse(200, headers={"Content-Range": "*/0"}))
+
+    async def run():
+        return await supadevices.check_device_exists_in_the_system("dev-1"), \
+            await supadevices.check_device_exists("user-1", "dev-2")
+
+    assert asyncio.run(run()) == (True, False)
+    assert pool.requests == [
+        ("HEAD", "devices?internal_device_id=eq.dev-1&limit=1", "count=exact", None),
+        ("HEAD", "devices?user_id=eq.user-1&internal_device_id=eq.dev-2&limit=1", "count=exact", None),
+    ]
+
+
+def test_lookups_ask_only_for_their_use_case_columns():
+    before = UPSTREAM_RESPONSE_BYTES._values.get(("supabase", "devices"), 0)
+    supadevices, pool = client(FakeResponse(200, '[{"user_id": "user-1"}]'), FakeResponse(200, "[]"))
+
+    async def run():
+        return await supadevices.get_device_by_device_id("dev-1", OWNER_COLUMNS), \
+            await supadevices.list_devices_for_user("user-1")
+
+    assert asyncio.run(run()) == ({"user_id": "user-1"}, [])
+    assert [request[1] for request in pool.requests] == [
+        "devices?internal_device_id=eq.dev-1&select=user_id&limit=1",
+        "devices?user_id=eq.user-1&select=created_at,uuid,internal_product_id,name&order=created_at.desc",
+    ]
+    assert UPSTREAM_RESPONSE_BYTES._values[("supabase", "devices")] - before == len('[{"user_id": "user-1"}]') + 2
+
+
+def test_deleting_the_account_invalidates_its_cached_devices():
+    redis, cache = FakeRedis(), TwoTierCache()
+    cache.attach(redis)
+    supadevices, pool = client(FakeResponse(200, '[{"uuid": "uuid-1"}]'), FakeResponse(200), cache=cache)
+
+    async def cached():
+        return {"name": "Kitchen"}
+
+    async def run():
+        await cache.get_or_load("device", ("user-1", "uuid-1"), cached)
+        await cache.get_or_load("device_info", ("uuid-1",), cached)
+        await cache.get_or_load("eflara", ("uuid-1",), cached)
+        await cache.get_or_load("device", ("user-2", "uuid-2"), cached)
+        return await supadevices.delete_user_account("user-1", should_soft_delete=True)
+
+    assert asyncio.run(run())["status"] == "success"
+    assert [request[:2] for request in pool.requests] == [("GET", "devices?user_id=eq.user-1&select=uuid"),
+                                                         ("DELETE", "admin/users/user-1")]
+    assert [key for key in redis.data if not key.startswith("cache:gen:")] == ["cache:device:user-2:uuid-2"]
+    assert cache.peek("device", "user-1", "uuid-1") is None and cache.peek("eflara", "uuid-1") is None
@@ -0,0 +1,34 @@
+import time
+
+from api.supajwks.tokencache import VerifiedTokenCache
+
+
+def test_hit_until_exp_then_miss():
+    cache = VerifiedTokenCache()
+    cache.put("token", {"sub": "user", "exp": time.time() + 60})
+    cache.put("expired", {"sub": "user", "exp": time.time() - 1})
+
+    assert cache.get("token")["sub"] == "user"
+    assert cache.get("expired") is None
+    assert cache.get("unknown") is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 2}
+
+
+def test_tokens_without_exp_are_not_cached():
+    cache = VerifiedTokenCache()
+    cache.put("token", {"sub": "user"})
+
+    assert cache.get("token") is None
+
+
+def test_least_recently_used_token_is_evicted():
+    cache = VerifiedTokenCache(maxsize=2)
+    exp = time.time() + 60
+    cache.put("a", {"sub": "a", "exp": exp})
+    cache.put("b", {"sub": "b", "exp": exp})
+    cache.get("a")
+    cache.put("c", {"sub": "c", "exp": exp})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
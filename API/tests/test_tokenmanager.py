@@ -0,0 +1,135 @@
+import asyncio
+import json
+import time
+
+from api.heiman.heimanconnector import HeimanConnector
+from api.heiman.tokenmanager import HeimanTokenManager, TOKEN_HEADER
+from fakes import FakeRedis
+
+
+class FakeResponse:
+    def __init__(self, status, payload, delay=0.0):
+        self.status = status
+        self.payload = payload
+        self.delay = delay
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self, content_type="application/json"):
+        return self.payload
+
+
+class FakeHeiman:
+    """Token endpoint plus one device call that only accepts the newest token"""
+
+    def __init__(self, expires_in=7200):
+        self.expires_in = expires_in
+        self.issued = []
+        self.calls = []
+
+    def session(self, url):
+        return self
+
+    def post(self, url, json=None, timeout=None):
+        self.issued.append(f"token-{len(self.issued) + 1}")
+        return FakeResponse(200, {"message": "success", "result": {
+            "access_token": self.issued[-1], "expires_in": self.expires_in}}, delay=0.02)
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.calls.append(headers.get(TOKEN_HEADER))
+        if headers.get(TOKEN_HEADER) != self.issued[-1]:
+            return FakeResponse(401, {"message": "unauthorized"})
+        return FakeResponse(200, {"message": "success", "result": {}})
+
+
+def replicas(count, heiman, redis, **kwargs):
+    managers = [HeimanTokenManager("https://heiman", "id", "secret", heiman, **kwargs) for _ in range(count)]
+    for manager in managers:
+        manager.attach(redis)
+    return managers
+
+
+def test_replicas_share_one_fetch_and_hot_path_skips_redis():
+    heiman, redis = FakeHeiman(), FakeRedis()
+    managers = replicas(5, heiman, redis)
+
+    async def run():
+        tokens = await asyncio.gather(*(manager.token() for manager in managers for _ in range(20)))
+        redis.round_trips = 0
+        again = await asyncio.gather(*(manager.token() for manager in managers))
+        return tokens, again
+
+    tokens, again = asyncio.run(run())
+    assert heiman.issued == ["token-1"]
+    assert set(tokens) == set(again) == {"token-1"}
+    assert redis.round_trips == 0
+    assert json.loads(redis.data["heiman:access_token"])["token"] == "token-1"
+    assert "heiman:access_token:lock" not in redis.data
+
+
+def test_refresh_ahead_renews_once_and_others_adopt_from_redis():
+    heiman, redis = FakeHeiman(expires_in=600), FakeRedis()
+    first, second = replicas(2, heiman, redis, refresh_ahead=300)
+
+    async def run():
+        await first.token()
+        await second.token()
+        # both inside the refresh window
+        for manager in (first, second):
+            manager._expires_at = time.time() + 100
+        stored = json.loads(redis.data["heiman:access_token"])
+        stored["expires_at"] = time.time() + 100
+        redis.data["heiman:access_token"] = json.dumps(stored)
+
+        await first.refresh()
+        await second.refresh()
+        return await second.token()
+
+    assert asyncio.run(run()) == "token-2"
+    assert heiman.issued == ["token-1", "token-2"]
+    assert second.adopted == 2 and second.fetched == 0
+
+
+def test_connector_injects_token_and_retries_once_after_401():
+    heiman, redis = FakeHeiman(), FakeRedis()
+    first, second = replicas(2, heiman, redis)
+    connectors = [HeimanConnector("https://heiman", "id", "secret", heiman, manager) for manager in (first, second)]
+
+    async def run():
+        await connectors[0].getDeviceIDDetail("user-1", "dev-1")
+        await connectors[1].getDeviceIDDetail("user-1", "dev-1")
+        # revoked server side; the first replica to notice fetches, the other adopts
+        heiman.issued.append("token-revoked-elsewhere")
+        a = await connectors[0].getDeviceIDDetail("user-1", "dev-1")
+        b = await connectors[1].getDeviceIDDetail("user-1", "dev-1")
+        return a, b
+
+    a, b = asyncio.run(run())
+    assert a["message"] == b["message"] == "success"
+    assert heiman.issued == ["token-1", "token-revoked-elsewhere", "token-3"]
+    assert heiman.calls == ["token-1", "token-1", "token-1", "token-3", "token-1", "token-3"]
+
+
+def test_connector_falls_back_to_tenant_id_when_no_token_can_be_fetched():
+    heiman, redis = FakeHeiman(), FakeRedis()
+
+    def refused(url, json=None, timeout=None):
+        return FakeResponse(200, {"message": "invalid client"})
+    heiman.post = refused
+    heiman.issued.append(None)
+    manager, = replicas(1, heiman, redis)
+    connector = HeimanConnector("https://heiman", "id", "secret", heiman, manager)
+
+    async def run():
+        return [await connector.getDeviceIDDetail("user-1", "dev-1") for _ in range(3)]
+
+    results = asyncio.run(run())
+    assert [result["message"] for result in results] == ["success"] * 3
+    assert heiman.calls == [None] * 3
+    # one failed fetch, then the backoff keeps requests from waiting on the token endpoint
+    assert manager.failures == 1
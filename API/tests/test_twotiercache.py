@@ -0,0 +1,96 @@
+import asyncio
+
+from api.cache.twotiercache import TwoTierCache
+from fakes import FakeRedis
+
+
+def test_l1_then_l2_then_loader_with_per_namespace_stats():
+    async def run():
+        shared = FakeRedis()
+        replica_a, replica_b = TwoTierCache(), TwoTierCache()
+        replica_a.attach(shared)
+        replica_b.attach(shared)
+        loads = []
+
+        async def loader():
+            loads.append(1)
+            return {"name": "Kitchen"}
+
+        assert await replica_a.get_or_load("device", ("u", "d"), loader) == {"name": "Kitchen"}
+        assert await replica_a.get_or_load("device", ("u", "d"), loader) == {"name": "Kitchen"}
+        assert await replica_b.get_or_load("device", ("u", "d"), loader) == {"name": "Kitchen"}
+        assert len(loads) == 1
+
+        assert replica_a.stats()["device"] == {"l1_hits": 1, "l2_hits": 0, "misses": 1, "hit_ratio": 0.5}
+        assert replica_b.stats()["device"]["l2_hits"] == 1
+
+    asyncio.run(run())
+
+
+def test_invalidate_drops_both_tiers_and_publishes_key():
+    async def run():
+        shared = FakeRedis()
+        cache = TwoTierCache()
+        cache.attach(shared)
+
+        async def loader():
+            return {"enabled": True}
+
+        await cache.get_or_load("eflara", ("d",), loader)
+        await cache.invalidate("eflara", "d")
+
+        assert cache.peek("eflara", "d") is None
+        assert shared.data == {"cache:gen:eflara:d": "1"}
+        assert shared.published == ["cache:eflara:d"]
+
+    asyncio.run(run())
+
+
+def test_load_racing_an_invalidation_is_not_written_back():
+    async def run():
+        shared = FakeRedis()
+        replica_a, replica_b = TwoTierCache(), TwoTierCache()
+        replica_a.attach(shared)
+        replica_b.attach(shared)
+        rows = {"d": {"enabled": False}}
+
+        async def slow_loader():
+            # read before the update below commits, returned after its invalidation
+            row = dict(rows["d"])
+            await asyncio.sleep(0.02)
+            return row
+
+        async def update():
+            await asyncio.sleep(0.01)
+            rows["d"] = {"enabled": True}
+            await replica_b.invalidate("eflara", "d")
+
+        stale, _ = await asyncio.gather(replica_a.get_or_load("eflara", ("d",), slow_loader), update())
+        assert stale == {"enabled": False}
+        assert "cache:eflara:d" not in shared.data
+        assert replica_a.peek("eflara", "d") is None
+
+        async def loader():
+            return dict(rows["d"])
+
+        assert await replica_a.get_or_load("eflara", ("d",), loader) == {"enabled": True}
+        assert await replica_b.get_or_load("eflara", ("d",), loader) == {"enabled": True}
+        assert replica_b.stats()["eflara"]["l2_hits"] == 1
+
+    asyncio.run(run())
+
+
+def test_none_is_not_cached():
+    async def run():
+        cache = TwoTierCache()
+        loads = []
+
+        async def loader():
+            loads.append(1)
+            return None
+
+        await cache.get_or_load("device", ("u", "missing"), loader)
+        await cache.get_or_load("device", ("u", "missing"), loader)
+        assert len(loads) == 2
+
+    asyncio.run(run())
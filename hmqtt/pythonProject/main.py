@@ -8,40 +8,247 @@ import hmac
 import time
 import uuid
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import json
+import logging
+import queue
+import threading
+from collections import deque
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+
+logger = logging.getLogger(__name__)
 URL_TO_SEND = os.environ.get("URL_TO_SEND", "http://localhost:3000/internal/event")
+URL_TO_SEND_BATCH = os.environ.get("URL_TO_SEND_BATCH", URL_TO_SEND.rstrip("/") + "s")
 INTERNAL_SECRET = os.environ.get("INTERNAL_SECRET", "SECRET")
 
 
-def sendEvent(tenant, user, event, deviceid, data, messageid):
-    try:
-        headers = {
+FORWARD_QUEUE_SIZE = int(os.environ.get("FORWARD_QUEUE_SIZE", "10000"))
+FORWARD_WORKERS = int(os.environ.get("FORWARD_WORKERS", "4"))
+FORWARD_TIMEOUT = float(os.environ.get("FORWARD_TIMEOUT", "5"))
+FORWARD_RETRIES = int(os.environ.get("FORWARD_RETRIES", "3"))
+STATS_INTERVAL = float(os.environ.get("STATS_INTERVAL", "60"))
+FORWARD_BATCH_SIZE = int(os.environ.get("FORWARD_BATCH_SIZE", "50"))
+FORWARD_BATCH_WINDOW = float(os.environ.get("FORWARD_BATCH_WINDOW", "0.05"))
+FORWARD_EVENT_ATTEMPTS = int(os.environ.get("FORWARD_EVENT_ATTEMPTS", "5"))
+FORWARD_RETRY_BACKOFF = float(os.environ.get("FORWARD_RETRY_BACKOFF", "0.5"))
+FORWARD_RETRY_BACKOFF_MAX = float(os.environ.get("FORWARD_RETRY_BACKOFF_MAX", "30"))
+
+# what became of one forwarded event
+OK, RETRY, FAILED = "ok", "retry", "failed"
+
+
+class EventForwarder:
+    """Forwards events to the API from a bounded queue drained by worker threads.
+
+    _on_message runs on paho's network thread, so it only enqueues; a full queue
+    drops the event instead of stalling MQTT reads. POSTs are retried, which is
+    safe because the API dedups on messageId.
+
+    With batch_size > 1 a worker coalesces whatever arrives within batch_window
+    of the first event (up to batch_size events) into one /internal/events POST.
+    If the batch URL answers 404 or 405 (an API without /internal/events, or a
+    wrong URL_TO_SEND_BATCH) batching is turned off and the events of that batch
+    and all later ones go to /internal/event one by one.
+
+    Events the API could not handle (status "error" in a batch, a 5xx or a
+    transport error) go back on the queue after an exponential backoff, up to
+    attempts tries in total; the API drops their dedup lock so the retry counts.
+    """
+
+    def __init__(self, url: str, secret: str, queue_size: int = FORWARD_QUEUE_SIZE, workers: int = FORWARD_WORKERS,
+                 timeout: float = FORWARD_TIMEOUT, retries: int = FORWARD_RETRIES, stats_interval: float = STATS_INTERVAL,
+                 batch_url: Optional[str] = None, batch_size: int = 1, batch_window: float = FORWARD_BATCH_WINDOW,
+                 attempts: int = FORWARD_EVENT_ATTEMPTS, retry_backoff: float = FORWARD_RETRY_BACKOFF,
+                 retry_backoff_max: float = FORWARD_RETRY_BACKOFF_MAX):
+        self.url = url
+        self.attempts = attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.batch_url = batch_url
+        self.batch_size = batch_size if batch_url else 1
+        self.batch_window = batch_window
+        self.workers = workers
+        self.timeout = timeout
+        self.stats_interval = stats_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=Retry(
+            total=retries,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+        ))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
             "Content-Type": "application/json",
-            "X-Internal-Secret": INTERNAL_SECRET
-        }
-        payload = {
-            "tenant": tenant,
-            "user": user,
-            "eventName": event,
-            "deviceId": deviceid,
-            "data": data,
-            "messageId": messageid
-        }
-        response = requests.post(URL_TO_SEND, headers=headers, json=payload)
-        if response.status_code == 200:
-            print(f"Event sent successfully to {URL_TO_SEND}")
-        else:
+            "X-Internal-Secret": secret
+        })
+
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+        self.forwarded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.retried = 0
+        self.retrying = 0
+        self._latencies = deque(maxlen=1000)
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"forwarder-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.stats_interval > 0:
+            thread = threading.Thread(target=self._report, name="forwarder-stats", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self.session.close()
+
+    def submit(self, payload: Dict[str, Any]) -> bool:
+        try:
+            self.queue.put_nowait((time.monotonic(), payload, 1))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            print(f"Forward queue full, dropping event {payload.get('messageId')}")
+            return False
+
+    def _outcome(self, status_code: int) -> str:
+        # a request the API refuses (bad secret, invalid payload) fails the same way every time
+        return FAILED if 400 <= status_code < 500 and status_code != 429 else RETRY
+
+    def _post(self, payload: Dict[str, Any]) -> str:
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            if response.status_code == 200:
+                return OK
             print(f"Failed to send event. Status code: {response.status_code}, Response: {response.text}")
-    except Exception as e:
-        print(f"Error sending event: {e}")
+            return self._outcome(response.status_code)
+        except Exception as e:
+            print(f"Error sending event: {e}")
+        return RETRY
+
+    def _post_batch(self, payloads: List[Dict[str, Any]]) -> List[str]:
+        try:
+            response = self.session.post(self.batch_url, json=payloads, timeout=self.timeout)
+            if response.status_code == 200:
+                return [RETRY if result.get("status") == "error" else OK for result in response.json()]
+            if response.status_code in (404, 405):
+                print(f"Batch endpoint {self.batch_url} answered {response.status_code}, sending events one by one")
+                self.batch_size = 1
+                return [self._post(payload) for payload in payloads]
+            print(f"Failed to send batch of {len(payloads)}. Status code: {response.status_code}, Response: {response.text}")
+            return [self._outcome(response.status_code)] * len(payloads)
+        except Exception as e:
+            print(f"Error sending batch of {len(payloads)}: {e}")
+        return [RETRY] * len(payloads)
+
+    def _retry(self, item):
+        enqueuedAt, payload, attempt = item
+        delay = min(self.retry_backoff * 2 ** (attempt - 1), self.retry_backoff_max)
+        with self._lock:
+            self.retried += 1
+            self.retrying += 1
+        timer = threading.Timer(delay, self._requeue, args=((enqueuedAt, payload, attempt + 1),))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, item):
+        with self._lock:
+            self.retrying -= 1
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            print(f"Forward queue full, dropping retried event {item[1].get('messageId')}")
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                first = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = self._collect(first) if self.batch_size > 1 else [first]
+            try:
+                if len(batch) == 1:
+                    results = [self._post(batch[0][1])]
+                else:
+                    results = self._post_batch([payload for _, payload, _ in batch])
+                now = time.monotonic()
+                retry = []
+                with self._lock:
+                    self.batches += 1
+                    for item, outcome in zip(batch, results):
+                        if outcome == RETRY and item[2] < self.attempts:
+                            retry.append(item)
+                            continue
+                        if outcome == OK:
+                            self.forwarded += 1
+                        else:
+                            self.failed += 1
+                            print(f"Giving up on event {item[1].get('messageId')} after {item[2]} attempts")
+                        self._latencies.append(now - item[0])
+                for item in retry:
+                    self._retry(item)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            result = {
+                "queue_depth": self.queue.qsize(),
+                "forwarded": self.forwarded,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "retried": self.retried,
+                "retrying": self.retrying,
+            }
+        if latencies:
+            result["latency_p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 1)
+            result["latency_p95_ms"] = round(latencies[int(len(latencies) * 0.95)] * 1000, 1)
+            result["latency_max_ms"] = round(latencies[-1] * 1000, 1)
+        return result
+
+    def _report(self):
+        while not self._stopping.wait(self.stats_interval):
+            print(f"Forwarder stats: {json.dumps(self.stats())}")
+
 
 class HeimanMqttClient:
-    def __init__(self, app_id: str, secure_key: str, broker_host: str = "spmqtt.heiman.cn", broker_port: int = 1884):
+    def __init__(self, app_id: str, secure_key: str, forwarder: EventForwarder, broker_host: str = "spmqtt.heiman.cn", broker_port: int = 1884):
         self.app_id = app_id
         self.secure_key = secure_key
+        self.forwarder = forwarder
         self.broker_host = broker_host
         self.broker_port = broker_port
 
@@ -144,13 +351,14 @@ class HeimanMqttClient:
             topic = msg.topic
             payload = msg.payload.decode('utf-8')
             splitted = topic.split('/')
+            # runs on paho's network thread for every message: parse and enqueue, logging only at debug level
+            # with lazy arguments so nothing is formatted unless it is enabled
             if len(splitted) <= 3 or not splitted[3].startswith("SH_"):
-                print("Omitting", topic)
+                logger.debug("Omitting %s", topic)
                 return
 
             tenant = splitted[3]
             user = splitted[4]
-            print(f"Message for Tenant: {tenant}, User: {user}")
             try:
                 loaded = json.loads(payload)
                 messageType = loaded.get("messageType", "UNKNOWN")
@@ -159,17 +367,25 @@ class HeimanMqttClient:
                     deviceID = loaded.get("deviceId", "UNKNOWN")
                     messageId = loaded.get("messageId", "UNKNOWN")
                     data = loaded.get("data", {})
-                    print(tenant, user, eventName, deviceID, data)
-                    sendEvent(tenant, user, eventName, deviceID, data, messageId)
-                print(payload)
+                    logger.debug("Event %s for tenant %s, user %s, device %s: %s", eventName, tenant, user, deviceID, data)
+                    self.forwarder.submit({
+                        "tenant": tenant,
+                        "user": user,
+                        "eventName": eventName,
+                        "deviceId": deviceID,
+                        "data": data,
+                        "messageId": messageId
+                    })
+                else:
+                    logger.debug("%s message on %s: %s", messageType, topic, payload)
 
             except json.JSONDecodeError:
-                print("Its not json!!", payload)
+                logger.warning("Not JSON on %s: %s", topic, payload)
                 return
 
 
         except Exception as e:
-            print(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
 
     def _on_publish(self, client, userdata, mid):
         """Callback for when a message is published"""
@@ -212,12 +428,15 @@ class HeimanMqttClient:
 
 
 def main():
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     APP_ID = os.environ.get("APP_ID", None)
     SECURE_KEY = os.environ.get("SECURE_KEY", None)
     print(f"App ID: {APP_ID}")
     print(f"Secure Key: {SECURE_KEY[:8]}...")
 
-    client = HeimanMqttClient(APP_ID, SECURE_KEY)
+    forwarder = EventForwarder(URL_TO_SEND, INTERNAL_SECRET, batch_url=URL_TO_SEND_BATCH, batch_size=FORWARD_BATCH_SIZE)
+    forwarder.start()
+    client = HeimanMqttClient(APP_ID, SECURE_KEY, forwarder)
 
     if client.connect():
         print("\n🎉 Successfully connected! Listening for messages...")
@@ -231,6 +450,7 @@ def main():
         except KeyboardInterrupt:
             print("\n\n🛑 Stopping client...")
             client.disconnect()
+            forwarder.stop()
             print("✅ Client stopped successfully")
 
     else:
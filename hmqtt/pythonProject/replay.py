@@ -0,0 +1,399 @@
+"""Replay recorded or synthetic Heiman MQTT traffic through the bridge.
+
+In-process, straight into HeimanMqttClient._on_message:
+
+    python replay.py --rate 2000 --count 20000 --sink-latency-ms 40 --sink-concurrency 8
+
+Through a local broker (plain TCP, no auth), publishing and consuming over MQTT:
+
+    python replay.py --mode broker --broker-host 127.0.0.1 --broker-port 1883 --subscribe /iot/user/#
+
+(the bridge's own $queue/ subscription only works on EMQX, pass --subscribe for mosquitto)
+
+Recorded traffic is JSON lines of {"topic": ..., "payload": ...}; capture some
+from the real broker with APP_ID/SECURE_KEY set:
+
+    python replay.py --record capture.jsonl --duration 600
+    python replay.py --source capture.jsonl --rate 500
+
+Forwarded events land on a stand-in /internal/event(s) served here, which can
+be made slow (--sink-latency-ms), narrow (--sink-concurrency) or flaky
+(--sink-errors) to build backpressure. The report covers injection and
+forwarding rate, injection-to-sink latency and where events were lost
+(queue full, failed POSTs, or never arrived). EVENT payloads get a fresh
+messageId each so every one can be traced.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+from main import EventForwarder, HeimanMqttClient
+
+DEFAULT_MIX = "event=0.5,property=0.3,online=0.08,offline=0.07,foreign=0.05"
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+class Synthetic:
+    """Heiman-shaped messages for a fleet of users and devices"""
+
+    def __init__(self, users: int, devices: int, mix: Dict[str, float], product_id: str = "bench-product"):
+        self.product_id = product_id
+        self.fleet = [(f"SH_bench-{u}", f"bench-{u}-{d}") for u in range(users) for d in range(devices)]
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+
+    def topic(self, user: str, device: str, suffix: str) -> str:
+        return f"/iot/user/SH_bench/{user}/{self.product_id}/{device}/{suffix}"
+
+    def message(self) -> Tuple[str, Dict[str, Any]]:
+        kind = random.choices(self.kinds, self.weights)[0]
+        user, device = random.choice(self.fleet)
+        timestamp = int(time.time() * 1000)
+        if kind == "event":
+            if random.random() < 0.5:
+                event, data = "SmokeCheckAlarm", {"SmokeSensorState": random.choice([0, 1])}
+            else:
+                event, data = "AlarmTest", {}
+            return self.topic(user, device, "event"), {
+                "messageType": "EVENT", "event": event, "deviceId": device, "data": data,
+                "messageId": uuid.uuid4().hex, "timestamp": timestamp}
+        if kind == "property":
+            return self.topic(user, device, "properties/report"), {
+                "messageType": "REPORT_PROPERTY", "deviceId": device, "messageId": uuid.uuid4().hex,
+                "properties": {"BatteryPercentage": random.randint(5, 100), "SmokeSensorState": 0},
+                "timestamp": timestamp}
+        if kind in ("online", "offline"):
+            return self.topic(user, device, kind), {
+                "messageType": kind.upper(), "deviceId": device, "messageId": uuid.uuid4().hex, "timestamp": timestamp}
+        # another integrator's tenant on the shared broker, the bridge must skip it
+        return f"/iot/user/OTHER_tenant/OTHER_{user}/{self.product_id}/{device}/event", {
+            "messageType": "EVENT", "event": "AlarmTest", "deviceId": device, "data": {},
+            "messageId": uuid.uuid4().hex, "timestamp": timestamp}
+
+    def __iter__(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        while True:
+            yield self.message()
+
+
+def recorded(path: str) -> Iterator[Tuple[str, Any]]:
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    while True:
+        for line in lines:
+            payload = line["payload"]
+            if isinstance(payload, str):
+                try:
+                    payload = json.loads(payload)
+                except json.JSONDecodeError:
+                    pass
+            if isinstance(payload, dict) and payload.get("messageType") == "EVENT":
+                payload = dict(payload, messageId=uuid.uuid4().hex)
+            yield line["topic"], payload
+
+
+def is_forwarded(topic: str, payload: Any) -> bool:
+    splitted = topic.split("/")
+    return (len(splitted) > 3 and splitted[3].startswith("SH_")
+            and isinstance(payload, dict) and payload.get("messageType") == "EVENT")
+
+
+class Sink:
+    """Stand-in for the API's /internal/event and /internal/events"""
+
+    def __init__(self, port: int, latency_ms: float, concurrency: int, error_rate: float):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.slots = threading.Semaphore(concurrency) if concurrency > 0 else None
+        self.lock = threading.Lock()
+        self.arrivals: Dict[str, float] = {}
+        self.duplicates = 0
+        self.requests = 0
+        self.rejected = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/internal/event"
+
+    def _record(self, events: List[Dict[str, Any]]):
+        now = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            for event in events:
+                if event.get("messageId") in self.arrivals:
+                    self.duplicates += 1
+                else:
+                    self.arrivals[event.get("messageId")] = now
+
+    def _handler(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, body: Any):
+                encoded = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with sink.slots or contextlib.nullcontext():
+                    if sink.latency_ms > 0:
+                        time.sleep(sink.latency_ms * random.uniform(0.5, 1.5) / 1000)
+                    if sink.error_rate > 0 and random.random() < sink.error_rate:
+                        with sink.lock:
+                            sink.rejected += 1
+                        return self._reply(503, {"detail": "injected error"})
+                if self.path == "/internal/events":
+                    sink._record(body)
+                    return self._reply(200, [{"messageId": event.get("messageId"), "status": "event received"}
+                                             for event in body])
+                sink._record([body])
+                return self._reply(200, {"status": "event received"})
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="sink", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Replay:
+    def __init__(self, args):
+        self.args = args
+        self.sink = Sink(args.sink_port, args.sink_latency_ms, args.sink_concurrency, args.sink_errors)
+        self.forwarder = EventForwarder(
+            self.sink.url, "replay", queue_size=args.queue_size, workers=args.workers, timeout=args.timeout,
+            retries=args.retries, stats_interval=0, batch_url=self.sink.url + "s" if args.batch_size > 1 else None,
+            batch_size=args.batch_size, batch_window=args.batch_window)
+        self.bridge = HeimanMqttClient("replay", "replay", self.forwarder,
+                                       broker_host=args.broker_host, broker_port=args.broker_port)
+        self.injected_at: Dict[str, float] = {}
+        self.kinds: Dict[str, int] = {}
+        self.handler_times: List[float] = []
+        self.publisher: Optional[mqtt.Client] = None
+
+    def _connect_broker(self):
+        # the bridge's connect() is TLS + Heiman credentials only, a local broker gets plain TCP
+        self.bridge.client.connect(self.args.broker_host, self.args.broker_port, 60)
+        self.bridge.client.loop_start()
+        deadline = time.monotonic() + 10
+        while not self.bridge.is_connected and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if not self.bridge.is_connected:
+            raise SystemExit(f"Bridge could not connect to {self.args.broker_host}:{self.args.broker_port}")
+        if self.args.subscribe:
+            self.bridge.client.subscribe(self.args.subscribe, qos=2)
+
+        self.publisher = mqtt.Client(client_id=f"replay_{uuid.uuid4().hex[:8]}", protocol=mqtt.MQTTv311)
+        self.publisher.max_queued_messages_set(0)
+        self.publisher.connect(self.args.broker_host, self.args.broker_port, 60)
+        self.publisher.loop_start()
+        time.sleep(0.5)
+
+    def _inject(self, topic: str, payload: Any):
+        encoded = payload if isinstance(payload, str) else json.dumps(payload)
+        if self.publisher is not None:
+            self.publisher.publish(topic, encoded, qos=self.args.qos)
+            return
+        message = mqtt.MQTTMessage(topic=topic.encode())
+        message.payload = encoded.encode()
+        started = time.perf_counter()
+        self.bridge._on_message(self.bridge.client, None, message)
+        self.handler_times.append(time.perf_counter() - started)
+
+    def _source(self) -> Iterator[Tuple[str, Any]]:
+        if self.args.source == "synthetic":
+            return iter(Synthetic(self.args.users, self.args.devices, parse_mix(self.args.mix)))
+        return recorded(self.args.source)
+
+    def _drain(self) -> float:
+        """Wait until the forwarder is idle and the sink has gone quiet; returns when the last event arrived"""
+        deadline = time.monotonic() + self.args.drain_timeout
+        expected = len(self.injected_at)
+        while time.monotonic() < deadline:
+            with self.sink.lock:
+                arrived = len(self.sink.arrivals)
+            stats = self.forwarder.stats()
+            if arrived + stats["dropped"] + stats["failed"] >= expected and stats["queue_depth"] == 0 \
+                    and stats["retrying"] == 0:
+                break
+            time.sleep(0.05)
+        with self.sink.lock:
+            return max(self.sink.arrivals.values(), default=time.monotonic())
+
+    def run(self) -> Dict[str, Any]:
+        self.sink.start()
+        self.forwarder.start()
+        if self.args.mode == "broker":
+            self._connect_broker()
+
+        source = self._source()
+        rate = self.args.rate
+        started = time.monotonic()
+        with contextlib.ExitStack() as stack:
+            if not self.args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            for index in range(self.args.count):
+                if rate > 0:
+                    wait = started + index / rate - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                topic, payload = next(source)
+                kind = payload.get("messageType", "UNKNOWN") if isinstance(payload, dict) else "RAW"
+                splitted = topic.split("/")
+                if len(splitted) <= 3 or not splitted[3].startswith("SH_"):
+                    kind = "FOREIGN"
+                self.kinds[kind] = self.kinds.get(kind, 0) + 1
+                if is_forwarded(topic, payload):
+                    self.injected_at[payload["messageId"]] = time.monotonic()
+                self._inject(topic, payload)
+            injected = time.monotonic()
+            last_arrival = self._drain()
+
+        if self.publisher is not None:
+            self.publisher.loop_stop()
+            self.publisher.disconnect()
+            self.bridge.disconnect()
+        self.forwarder.stop()
+        self.sink.stop()
+        return self.report(started, injected, last_arrival)
+
+    def report(self, started: float, injected: float, last_arrival: float) -> Dict[str, Any]:
+        with self.sink.lock:
+            arrivals = dict(self.sink.arrivals)
+        latencies = [arrivals[messageId] - at for messageId, at in self.injected_at.items() if messageId in arrivals]
+        forwarder = self.forwarder.stats()
+        events = len(self.injected_at)
+        received = len(latencies)
+        result = {
+            "mode": self.args.mode,
+            "source": self.args.source,
+            "messages": self.args.count,
+            "by_type": self.kinds,
+            "target_rate": self.args.rate,
+            "injected_msgs_per_s": round(self.args.count / max(injected - started, 1e-9), 1),
+            "events": events,
+            "received": received,
+            "forwarded_events_per_s": round(received / max(last_arrival - started, 1e-9), 1),
+            "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "latency_max_ms": round(max(latencies, default=0) * 1000, 2),
+            "lost": events - received,
+            "loss_pct": round((events - received) / events * 100, 3) if events else 0.0,
+            "dropped_queue_full": forwarder["dropped"],
+            "failed_post": forwarder["failed"],
+            "retried_post": forwarder["retried"],
+            "sink_requests": self.sink.requests,
+            "sink_rejected": self.sink.rejected,
+            "sink_duplicates": self.sink.duplicates,
+            "bridge": {"workers": self.args.workers, "queue_size": self.args.queue_size,
+                       "batch_size": self.args.batch_size, "batch_window": self.args.batch_window},
+            "sink": {"latency_ms": self.args.sink_latency_ms, "concurrency": self.args.sink_concurrency,
+                     "error_rate": self.args.sink_errors},
+        }
+        if self.handler_times:
+            result["on_message_p50_us"] = round(percentile(self.handler_times, 0.50) * 1e6, 1)
+            result["on_message_p99_us"] = round(percentile(self.handler_times, 0.99) * 1e6, 1)
+        return result
+
+
+def record(path: str, duration: float):
+    """Capture raw traffic from the real broker into a JSON lines file for later replay"""
+    client = HeimanMqttClient(os.environ.get("APP_ID"), os.environ.get("SECURE_KEY"), forwarder=None)
+    captured = 0
+    with open(path, "a") as f:
+        lock = threading.Lock()
+
+        def on_message(_client, _userdata, msg):
+            nonlocal captured
+            with lock:
+                f.write(json.dumps({"topic": msg.topic, "payload": msg.payload.decode("utf-8", "replace"),
+                                    "t": time.time()}) + "\n")
+                captured += 1
+
+        client.client.on_message = on_message
+        if not client.connect():
+            raise SystemExit("Failed to connect to MQTT broker")
+        try:
+            time.sleep(duration)
+        except KeyboardInterrupt:
+            pass
+        client.disconnect()
+    print(f"Captured {captured} messages into {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("inprocess", "broker"), default="inprocess")
+    parser.add_argument("--source", default="synthetic", help="'synthetic' or a JSON lines capture")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=1000, help="messages per second, 0 for as fast as possible")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--devices", type=int, default=3)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--verbose", action="store_true", help="keep the bridge's prints and per-message debug logs")
+
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--batch-window", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--retries", type=int, default=3)
+
+    parser.add_argument("--sink-port", type=int, default=0)
+    parser.add_argument("--sink-latency-ms", type=float, default=20)
+    parser.add_argument("--sink-concurrency", type=int, default=0, help="parallel requests the sink serves, 0 = unbounded")
+    parser.add_argument("--sink-errors", type=float, default=0)
+    parser.add_argument("--drain-timeout", type=float, default=30)
+
+    parser.add_argument("--broker-host", default="127.0.0.1")
+    parser.add_argument("--broker-port", type=int, default=1883)
+    parser.add_argument("--subscribe", help="extra topic filter for the bridge in broker mode")
+    parser.add_argument("--qos", type=int, default=1)
+
+    parser.add_argument("--record", metavar="PATH")
+    parser.add_argument("--duration", type=float, default=300)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    if args.record:
+        record(args.record, args.duration)
+    else:
+        result = Replay(args).run()
+        print(json.dumps(result, indent=2))
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(result, f, indent=2)